@@ -0,0 +1,31 @@
+"""Add details_scraped_at
+
+Revision ID: 306440299639
+Revises: 68dc93d8f344
+Create Date: 2026-10-17 11:02:17.845391
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '306440299639'
+down_revision = '68dc93d8f344'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.execute('''
+        ALTER TABLE restaurants_info
+            ADD COLUMN details_scraped_at timestamptz NULL; -- Time when homepage of the business was last scraped by reviews crawler
+
+        COMMENT ON COLUMN restaurants_info.details_scraped_at IS 'Time when homepage of the business was last scraped by reviews crawler';
+    ''') # noqa
+
+
+def downgrade():
+    op.execute('''
+        ALTER TABLE restaurants_info DROP COLUMN IF EXISTS details_scraped_at;
+    ''')
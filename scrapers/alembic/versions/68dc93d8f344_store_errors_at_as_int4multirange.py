@@ -0,0 +1,67 @@
+"""Store errors_at as int4multirange
+
+Revision ID: 68dc93d8f344
+Revises: 9335f701f671
+Create Date: 2026-10-17 10:12:41.302117
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '68dc93d8f344'
+down_revision = '9335f701f671'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # NOTE: multiranges need PostgreSQL 14 or later
+    op.execute('''
+        ALTER TABLE restaurants_info
+            ADD COLUMN errors_at_ranges int4multirange NOT NULL DEFAULT '{}';
+
+        -- '[(0, 19), (40, 47)]' -> '{[0,20),[40,48)}', '-1' -> '{}'
+        UPDATE restaurants_info
+        SET errors_at_ranges = (
+            SELECT coalesce(range_agg(int4range(m[1]::int, m[2]::int, '[]')), '{}')
+            FROM regexp_matches(errors_at, '\\((-?\\d+),\\s*(-?\\d+)\\)', 'g') AS m
+            WHERE m[2]::int >= m[1]::int
+        )
+        WHERE errors_at <> '-1';
+
+        ALTER TABLE restaurants_info DROP COLUMN errors_at;
+        ALTER TABLE restaurants_info RENAME COLUMN errors_at_ranges TO errors_at;
+
+        COMMENT ON COLUMN restaurants_info.errors_at IS 'ranges of reviews to scrape. if empty and last_review_count != -1 then all reviews scraped';
+
+        -- businesses with reviews left to scrape, ex.
+        -- select business_id, (select sum(upper(r) - lower(r)) from unnest(errors_at) r) as missing_reviews
+        -- from restaurants_info where location = 'Chicago, IL' and not isempty(errors_at)
+        CREATE INDEX restaurants_info_pending_reviews_idx
+            ON restaurants_info ("location")
+            WHERE NOT isempty(errors_at);
+    ''') # noqa
+
+
+def downgrade():
+    op.execute('''
+        DROP INDEX IF EXISTS restaurants_info_pending_reviews_idx;
+
+        ALTER TABLE restaurants_info
+            ADD COLUMN errors_at_text text NOT NULL DEFAULT '-1'::text;
+
+        -- '{[0,20),[40,48)}' -> '[(0, 19), (40, 47)]', '{}' -> '-1'
+        UPDATE restaurants_info
+        SET errors_at_text = '[' || (
+            SELECT string_agg('(' || lower(r) || ', ' || (upper(r) - 1) || ')', ', ' ORDER BY lower(r))
+            FROM unnest(errors_at) AS r
+        ) || ']'
+        WHERE NOT isempty(errors_at);
+
+        ALTER TABLE restaurants_info DROP COLUMN errors_at;
+        ALTER TABLE restaurants_info RENAME COLUMN errors_at_text TO errors_at;
+
+        COMMENT ON COLUMN restaurants_info.errors_at IS 'list of ranges of reviews to scrape. if -1 and last_review_count != -1 then all reviews scraped';
+    ''') # noqa
@@ -0,0 +1,31 @@
+"""Count menu page parse failures
+
+Revision ID: 9d2e5b7c4a18
+Revises: f3a8c2b91d07
+Create Date: 2026-10-17 23:02:37.415962
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9d2e5b7c4a18'
+down_revision = 'f3a8c2b91d07'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.execute('''
+        ALTER TABLE menu_fingerprints
+            ADD COLUMN parse_failures int4 NOT NULL DEFAULT 0;
+
+        COMMENT ON COLUMN menu_fingerprints.parse_failures IS 'number of scrapes in a row the page had no menu, menus crawler sets restaurants_info.menu_url to NULL after MENU_MAX_PARSE_FAILURES';
+    ''') # noqa
+
+
+def downgrade():
+    op.execute('''
+        ALTER TABLE menu_fingerprints DROP COLUMN parse_failures;
+    ''')
@@ -0,0 +1,42 @@
+"""Create menu_fingerprints table
+
+Revision ID: b71e2f0c94a5
+Revises: 306440299639
+Create Date: 2026-10-17 12:21:09.552813
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b71e2f0c94a5'
+down_revision = '306440299639'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.execute('''
+        CREATE TABLE menu_fingerprints (
+            menu_url text NOT NULL, -- menu or sub menu url, like, /menu/ramuntos-brick-oven-pizza-williston-williston/dinner
+            business_id text NOT NULL,
+            sub_menu_name text NULL, -- key of the sub menu in restaurants_info.menu
+            content_hash text NULL, -- sha1 of menu sections of the page
+            etag text NULL, -- ETag response header, sent as If-None-Match
+            last_modified text NULL, -- Last-Modified response header, sent as If-Modified-Since
+            checked_at timestamptz NOT NULL, -- last time page was downloaded (or found not modified)
+            changed_at timestamptz NOT NULL, -- last time content_hash changed
+            CONSTRAINT menu_fingerprints_pkey PRIMARY KEY (menu_url)
+        );
+
+        CREATE INDEX menu_fingerprints_business_id_idx ON menu_fingerprints (business_id);
+
+        COMMENT ON TABLE menu_fingerprints IS 'content hash of menu pages, used by menus crawler to re-scrape only changed menus';
+    ''') # noqa
+
+
+def downgrade():
+    op.execute('''
+        DROP TABLE IF EXISTS menu_fingerprints;
+    ''')
@@ -0,0 +1,53 @@
+"""Add indexes for spider queries
+
+Revision ID: c4e9a1d27f36
+Revises: b71e2f0c94a5
+Create Date: 2026-10-17 13:05:44.118203
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c4e9a1d27f36'
+down_revision = 'b71e2f0c94a5'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # CONCURRENTLY does not block writes of running crawlers, but can not
+    # run inside a transaction
+    with op.get_context().autocommit_block():
+        op.execute('''
+            -- businesses of a location, ReviewsSpider.start_requests
+            CREATE INDEX CONCURRENTLY IF NOT EXISTS restaurants_info_location_idx
+                ON restaurants_info ("location");
+        ''') # noqa
+
+        op.execute('''
+            -- menus to scrape, MenuSpider.start_requests
+            CREATE INDEX CONCURRENTLY IF NOT EXISTS restaurants_info_pending_menus_idx
+                ON restaurants_info ("location")
+                WHERE menu_url IS NOT NULL AND menu_items_scraped_flag = 0;
+        ''') # noqa
+
+        # NOTE: businesses with errors left (errors_at not '-1', now not empty
+        # int4multirange) are indexed by restaurants_info_pending_reviews_idx,
+        # see 68dc93d8f344
+
+        op.execute('''
+            ANALYZE restaurants_info;
+        ''')
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        op.execute('''
+            DROP INDEX CONCURRENTLY IF EXISTS restaurants_info_pending_menus_idx;
+        ''')
+
+        op.execute('''
+            DROP INDEX CONCURRENTLY IF EXISTS restaurants_info_location_idx;
+        ''')
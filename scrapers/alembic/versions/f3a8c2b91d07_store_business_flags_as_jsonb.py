@@ -0,0 +1,78 @@
+"""Store covid19/amenity flags as jsonb
+
+Revision ID: f3a8c2b91d07
+Revises: c4e9a1d27f36
+Create Date: 2026-10-17 13:48:20.631950
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f3a8c2b91d07'
+down_revision = 'c4e9a1d27f36'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.execute('''
+        ALTER TABLE restaurants_info
+            ADD COLUMN business_flags jsonb NOT NULL DEFAULT '{}'::jsonb;
+
+        COMMENT ON COLUMN restaurants_info.business_flags IS 'covid19 updates and amenities seen on homepage, { "covid19_takeout" : 1, "amenity_outdoor_seating" : 0, ... }. flags not in it were never seen';
+
+        -- covid19_* and amenity_* columns were added by reviews crawler for
+        -- every new label, and every row was padded with 0 for all labels, so
+        -- 0 can not be told apart from "not seen" - only 1s are moved
+        UPDATE restaurants_info r
+        SET business_flags = coalesce((
+            SELECT jsonb_object_agg(key, value)
+            FROM jsonb_each(to_jsonb(r))
+            WHERE (key LIKE 'covid19\\_%' OR key LIKE 'amenity\\_%')
+                AND value NOT IN ('0'::jsonb, 'null'::jsonb)
+        ), '{}'::jsonb);
+
+        DO $$
+        DECLARE
+            drop_columns text;
+        BEGIN
+            SELECT string_agg(format('DROP COLUMN %I', column_name), ', ')
+            INTO drop_columns
+            FROM information_schema.columns
+            WHERE table_schema = current_schema()
+                AND table_name = 'restaurants_info'
+                AND (column_name LIKE 'covid19\\_%' OR column_name LIKE 'amenity\\_%');
+
+            IF drop_columns IS NOT NULL THEN
+                EXECUTE 'ALTER TABLE restaurants_info ' || drop_columns;
+            END IF;
+        END $$;
+
+        -- businesses with a flag, ex.
+        -- select business_id from restaurants_info
+        -- where business_flags @> '{"amenity_outdoor_seating": 1}'
+        CREATE INDEX restaurants_info_business_flags_idx
+            ON restaurants_info USING gin (business_flags jsonb_path_ops);
+    ''') # noqa
+
+
+def downgrade():
+    op.execute('''
+        DROP INDEX IF EXISTS restaurants_info_business_flags_idx;
+
+        DO $$
+        DECLARE
+            flag text;
+        BEGIN
+            FOR flag IN SELECT DISTINCT jsonb_object_keys(business_flags) FROM restaurants_info
+            LOOP
+                EXECUTE format('ALTER TABLE restaurants_info ADD COLUMN %I int4 NULL DEFAULT 0', flag);
+                EXECUTE format('UPDATE restaurants_info SET %I = (business_flags ->> %L)::int4 '
+                               'WHERE business_flags ? %L', flag, flag, flag);
+            END LOOP;
+        END $$;
+
+        ALTER TABLE restaurants_info DROP COLUMN business_flags;
+    ''') # noqa
@@ -0,0 +1,92 @@
+"""Benchmark parsing of saved business homepages
+
+Compares the old way of parsing homepages (whole page through BeautifulSoup,
+then `<script type="application/json">` tags from the tree) with
+`extract_json_scripts`, which scans the raw bytes for the JSON payloads only.
+
+Save some homepages first, for example:
+
+    $ curl -o pages/brendas.html https://www.yelp.com/biz/brendas-french-soul-food-san-francisco-5
+
+Then run (from `scrapers` directory):
+
+    $ python benchmarks/bench_homepage_parse.py --pages-dir pages
+"""
+import argparse
+import json
+import os
+import sys
+from glob import glob
+from html import unescape
+from time import perf_counter
+
+from bs4 import BeautifulSoup
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from yelp_scraper.utils import BusinessDetails
+from yelp_scraper.utils import extract_json_scripts
+
+
+def old_json_scripts(body : bytes) -> list:
+    text = body.decode("utf-8", errors="replace")
+    soup = BeautifulSoup(unescape(text.replace("<!--","").replace("-->","")), "html.parser")
+    return [script.string for script in soup.find_all('script', type="application/json")]
+
+
+def timeit(fn, pages, repeat):
+    best = None
+    for _ in range(repeat):
+        start = perf_counter()
+        for body in pages:
+            fn(body)
+        elapsed = perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main(args):
+    paths = sorted(glob(os.path.join(args.pages_dir, "*.htm*")))
+    if not paths:
+        sys.exit(f"No html pages in {args.pages_dir}")
+
+    pages = []
+    for path in paths:
+        with open(path, "rb") as f:
+            pages.append(f.read())
+
+    mismatches = [path 
+                  for path, body 
+                  in zip(paths, pages) 
+                  if ([json.loads(s) for s in old_json_scripts(body)] 
+                      != [json.loads(s) for s in extract_json_scripts(body)])]
+
+    old_time = timeit(old_json_scripts, pages, args.repeat)
+    new_time = timeit(extract_json_scripts, pages, args.repeat)
+    details_time = timeit(lambda body: BusinessDetails(body).get_all_updates_and_details(),
+                          pages,
+                          args.repeat)
+
+    print(f"pages                      : {len(pages)} "
+          f"({sum(len(body) for body in pages) / 1e6:.1f} MB)")
+    print(f"mismatched payloads        : {len(mismatches)} {mismatches if mismatches else ''}")
+    print(f"BeautifulSoup full parse   : {1000 * old_time / len(pages):8.2f} ms/page")
+    print(f"extract_json_scripts       : {1000 * new_time / len(pages):8.2f} ms/page "
+          f"({old_time / new_time:.1f}x faster)")
+    print(f"BusinessDetails (all data) : {1000 * details_time / len(pages):8.2f} ms/page")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument("--pages-dir",
+                        type=str,
+                        required=True,
+                        help="Directory containing saved homepages (*.html)")
+
+    parser.add_argument("--repeat",
+                        type=int,
+                        default=3,
+                        help="Number of times to repeat each measurement (best is reported)")
+
+    main(parser.parse_args())
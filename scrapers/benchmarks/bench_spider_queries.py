@@ -0,0 +1,210 @@
+"""Benchmark queries of spiders' `start_requests` with and without indexes
+
+Creates a synthetic `restaurants_info` like table (temporary, wide - menu
+jsonb and amenity columns) with `--rows` businesses spread over
+`--locations` locations, and runs the queries of `ReviewsSpider` and
+`MenuSpider` (their first batch of `--batch-size` rows, see 
+`db.fetch_in_batches`) with `EXPLAIN (ANALYZE, BUFFERS)`, first without indexes and then
+with the indexes of migration c4e9a1d27f36 (and 68dc93d8f344). Query plans
+and best execution time of `--repeat` runs are printed.
+
+Database is from `.env` (same as the spiders, see `credentials.Postgres`),
+needs PostgreSQL 14 or later (int4multirange). Run from `scrapers`
+directory:
+
+    $ python benchmarks/bench_spider_queries.py --rows 1000000 --locations 500
+"""
+import argparse
+import os
+import sys
+from time import perf_counter
+
+import psycopg2
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from yelp_scraper.credentials import Postgres
+
+TABLE = "bench_restaurants_info"
+
+# same as the migrations
+INDEXES = [f'CREATE INDEX {TABLE}_location_idx ON {TABLE} ("location")',
+           (f'CREATE INDEX {TABLE}_pending_menus_idx ON {TABLE} ("location") '
+            f'WHERE menu_url IS NOT NULL AND menu_items_scraped_flag = 0'),
+           (f'CREATE INDEX {TABLE}_pending_reviews_idx ON {TABLE} ("location") '
+            f'WHERE NOT isempty(errors_at)')]
+
+QUERIES = {
+    "reviews spider - businesses of a location" : (
+        f"select business_id, business_url, num_reviews, last_reviews_count, errors_at::text "
+        f"from {TABLE} where location = %(location)s "
+        f"order by business_id limit %(batch_size)s"),
+
+    "reviews spider - conditional crawl" : (
+        f"select business_id, business_url, num_reviews, last_reviews_count, errors_at::text "
+        f"from {TABLE} where location = %(location)s "
+            f"and not coalesce(num_reviews = last_reviews_count "
+                            f"and isempty(errors_at) "
+                            f"and details_scraped_at > now() - make_interval(days => 14), "
+                         f"false) "
+        f"order by business_id limit %(batch_size)s"),
+
+    "reviews - businesses with errors left" : (
+        f"select business_id, errors_at::text "
+        f"from {TABLE} where location = %(location)s and not isempty(errors_at)"),
+
+    "menu spider - menus to scrape" : (
+        f"select business_id, menu_url, menu_items_scraped_flag "
+        f"from {TABLE} where location = %(location)s "
+            f"and menu_url is not null and (menu_items_scraped_flag = 0) "
+        f"order by business_id limit %(batch_size)s"),
+}
+
+
+def create_table(cursor, rows : int, locations : int, amenities : int) -> None:
+    amenity_columns = ", ".join(f"amenity_{i} int4 NULL DEFAULT 0" for i in range(amenities))
+    amenity_values = ", ".join(f"(random() < 0.5)::int" for _ in range(amenities))
+    amenity_names = ", ".join(f"amenity_{i}" for i in range(amenities))
+
+    cursor.execute(f"DROP TABLE IF EXISTS {TABLE}")
+    cursor.execute(f'''
+        CREATE TEMP TABLE {TABLE} (
+            business_id text NOT NULL PRIMARY KEY,
+            business_name text NULL,
+            business_url text NOT NULL,
+            "location" text NULL,
+            overall_rating float4 NULL,
+            num_reviews int2 NULL,
+            menu_url text NULL,
+            menu_items_scraped_flag int4 NULL DEFAULT 0,
+            address_line1 text NULL,
+            categories _text NULL,
+            last_reviews_count int2 NOT NULL DEFAULT '-1'::integer,
+            errors_at int4multirange NOT NULL DEFAULT '{{}}',
+            details_scraped_at timestamptz NULL,
+            menu jsonb NULL,
+            {amenity_columns}
+        )''')
+
+    # 70% of businesses have a menu, 90% of those are scraped (with a ~2KB
+    # menu), 10% have reviews left to scrape
+    cursor.execute(f'''
+        INSERT INTO {TABLE} (business_id, business_name, business_url, "location",
+                             overall_rating, num_reviews, menu_url,
+                             menu_items_scraped_flag, address_line1, categories,
+                             last_reviews_count, errors_at, details_scraped_at,
+                             menu, {amenity_names})
+        SELECT 'business-' || i,
+               'Business ' || i,
+               '/biz/business-' || i,
+               'City ' || (i %% %(locations)s) || ', IL',
+               round((random() * 4 + 1)::numeric, 1),
+               (random() * 1000)::int,
+               CASE WHEN has_menu THEN '/menu/business-' || i END,
+               (has_menu AND random() < 0.9)::int,
+               i || ' Main St',
+               ARRAY['Pizza', 'Bars'],
+               (random() * 1000)::int,
+               CASE WHEN random() < 0.1 THEN int4multirange(int4range(0, 20)) ELSE '{{}}' END,
+               now() - random() * interval '30 days',
+               CASE WHEN has_menu THEN jsonb_build_object('main', repeat('pizza margherita ', 120)) END,
+               {amenity_values}
+        FROM (SELECT i, random() < 0.7 AS has_menu
+              FROM generate_series(1, %(rows)s) AS i) AS t''',
+                   {"rows" : rows, "locations" : locations})
+    cursor.execute(f"ANALYZE {TABLE}")
+
+
+def explain(cursor, query : str, params : dict, repeat : int):
+    best = None
+    plan = None
+    for _ in range(repeat):
+        cursor.execute("EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) " + query, params)
+        result = cursor.fetchone()[0][0]
+        if (best is None) or (result["Execution Time"] < best):
+            best = result["Execution Time"]
+            plan = result["Plan"]
+
+    cursor.execute("EXPLAIN " + query, params)
+    text_plan = "\n".join(f"    {row[0]}" for row in cursor.fetchall())
+    return best, plan["Actual Rows"], text_plan
+
+
+def run_queries(cursor, location : str, repeat : int, batch_size : int) -> dict:
+    timings = {}
+    for name, query in QUERIES.items():
+        best, num_rows, text_plan = explain(cursor, 
+                                            query, 
+                                            {"location" : location, "batch_size" : batch_size}, 
+                                            repeat)
+        timings[name] = best
+        print(f"{name} - {num_rows} rows, {best:.2f} ms")
+        print(text_plan)
+    return timings
+
+
+def main(args):
+    conn = psycopg2.connect(host = Postgres.PG_HOST,
+                            port = Postgres.PG_PORT,
+                            dbname = Postgres.PG_DBNAME,
+                            user = Postgres.PG_USER,
+                            password = Postgres.PG_PWD)
+    conn.autocommit = True
+    cursor = conn.cursor()
+
+    start = perf_counter()
+    create_table(cursor, args.rows, args.locations, args.amenities)
+    cursor.execute(f"SELECT pg_size_pretty(pg_total_relation_size('{TABLE}'))")
+    print(f"{args.rows} rows ({cursor.fetchone()[0]}) created in {perf_counter() - start:.1f} s\n")
+
+    location = f"City {args.locations // 2}, IL"
+
+    print("=== without indexes ===")
+    before = run_queries(cursor, location, args.repeat, args.batch_size)
+
+    start = perf_counter()
+    for index in INDEXES:
+        cursor.execute(index)
+    cursor.execute(f"ANALYZE {TABLE}")
+    print(f"\nindexes created in {perf_counter() - start:.1f} s\n")
+
+    print("=== with indexes ===")
+    after = run_queries(cursor, location, args.repeat, args.batch_size)
+
+    print("\n=== summary ===")
+    for name in QUERIES:
+        print(f"{name:45} : {before[name]:9.2f} ms -> {after[name]:7.2f} ms "
+              f"({before[name] / max(after[name], 1e-3):.0f}x)")
+
+    conn.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument("--rows",
+                        type=int,
+                        default=1000000,
+                        help="Number of businesses in synthetic table")
+
+    parser.add_argument("--locations",
+                        type=int,
+                        default=500,
+                        help="Number of locations businesses are spread over")
+
+    parser.add_argument("--amenities",
+                        type=int,
+                        default=40,
+                        help="Number of amenity columns (table width)")
+
+    parser.add_argument("--repeat",
+                        type=int,
+                        default=3,
+                        help="Number of times to run each query (best is reported)")
+
+    parser.add_argument("--batch-size",
+                        type=int,
+                        default=2000,
+                        help="Rows fetched at a time by spiders (DB_CURSOR_ITERSIZE)")
+
+    main(parser.parse_args())
@@ -0,0 +1,97 @@
+"""Benchmark storage backends of `CSPipeline` on synthetic reviews
+
+Writes chunks of fake reviews (same fields as `Review` item) through
+`JsonLinesChunkWriter` and a storage backend, and reports time spent in
+compressing and in saving the chunks. Only local filesystem backend is
+benchmarked by default, for example (from `scrapers` directory):
+
+    $ python benchmarks/bench_storage_backend.py --root-dir /tmp/reviews_store --fsync-every 0 1 10
+"""
+import argparse
+import os
+import random
+import shutil
+import string
+import sys
+from time import perf_counter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from yelp_scraper.exporters import JsonLinesChunkWriter
+from yelp_scraper.storage import LocalFSStorageBackend
+
+
+def fake_review(i : int) -> dict:
+    words = ["".join(random.choices(string.ascii_lowercase, k=random.randint(2, 9)))
+             for _ in range(random.randint(20, 200))]
+    return {"review_id" : f"review-{i}",
+            "review" : " ".join(words),
+            "date" : "2020-08-01",
+            "rating" : random.randint(1, 5),
+            "business_name" : "Brenda's French Soul Food",
+            "business_id" : f"business-{i // 100}",
+            "business_location" : "San Francisco, CA",
+            "business_alias" : "brendas-french-soul-food-san-francisco-5",
+            "sentiment" : None}
+
+
+def main(args):
+    random.seed(0)
+    reviews = [fake_review(i) for i in range(args.reviews)]
+
+    for fsync_every in args.fsync_every:
+        root_dir = os.path.join(args.root_dir, f"fsync_{fsync_every}")
+        shutil.rmtree(root_dir, ignore_errors=True)
+        backend = LocalFSStorageBackend(root_dir, fsync_every)
+
+        compress_time = 0
+        upload_time = 0
+        total_bytes = 0
+        for chunk in range(0, len(reviews), args.chunk_size):
+            start = perf_counter()
+            writer = JsonLinesChunkWriter()
+            for review in reviews[chunk:chunk + args.chunk_size]:
+                writer.write(review)
+            [(_, f)] = writer.finish()
+            compress_time += perf_counter() - start
+            total_bytes += len(f.getvalue())
+
+            start = perf_counter()
+            backend.upload(f"reviews/San Francisco, CA/{chunk}.jl.gz", f)
+            upload_time += perf_counter() - start
+
+        start = perf_counter()
+        backend.close()
+        upload_time += perf_counter() - start
+
+        print(f"fsync every {fsync_every:>3} chunks : "
+              f"compress {len(reviews) / compress_time:9.0f} reviews/s, "
+              f"save {total_bytes / 1e6 / upload_time:8.1f} MB/s "
+              f"({total_bytes / 1e6:.1f} MB)")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument("--root-dir",
+                        type=str,
+                        required=True,
+                        help="Directory to write chunks in (its contents are removed)")
+
+    parser.add_argument("--reviews",
+                        type=int,
+                        default=50000,
+                        help="Number of reviews to write")
+
+    parser.add_argument("--chunk-size",
+                        type=int,
+                        default=1000,
+                        help="Number of reviews in a chunk")
+
+    parser.add_argument("--fsync-every",
+                        type=int,
+                        nargs="+",
+                        default=[0, 1, 10],
+                        help="fsync batch sizes to compare")
+
+    main(parser.parse_args())
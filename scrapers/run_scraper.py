@@ -15,6 +15,51 @@ from yelp_scraper.spiders.yelp_reviews_spider import ReviewsSpider
 from yelp_scraper.spiders.yelp_menu_items_spider import MenuSpider
 
 
+def get_location_settings(settings, max_parallel_locations):
+    """Settings for crawlers of a single location pipeline
+
+    `max_parallel_locations` crawlers can run at the same time, therefore
+    request budget from `settings` is divided among them.
+
+    NOTE: this is a static split, every crawler gets its share up front and
+    crawlers do not share a global limit. When fewer crawlers are running
+    (last locations, or a menus crawler after its reviews crawler), the
+    unused share is not given to the others, so pass the number of
+    locations actually running in parallel.
+
+    Parameters
+    ----------
+    settings : Settings
+        Project settings
+    max_parallel_locations : int
+        Number of location pipelines running at the same time
+
+    Returns
+    -------
+    Settings
+        Copy of `settings` with request budget of one location pipeline
+    """
+    location_settings = settings.copy()
+
+    if max_parallel_locations > 1:
+        for name in ['CONCURRENT_REQUESTS', 
+                     'CONCURRENT_REQUESTS_PER_DOMAIN',
+                     'CONCURRENT_REQUESTS_PER_IP']:
+            value = settings.getint(name)
+            if value:
+                location_settings.set(name, 
+                                      max(1, value // max_parallel_locations), 
+                                      priority='cmdline')
+
+        # every crawler has its own download slots, so delay between requests
+        # needs to be scaled to keep the same request rate
+        location_settings.set('DOWNLOAD_DELAY', 
+                              settings.getfloat('DOWNLOAD_DELAY') * max_parallel_locations,
+                              priority='cmdline')
+
+    return location_settings
+
+
 def main(args):
     location_list = read_csv(args.locations_file_path).location.to_list()
 
@@ -22,27 +67,57 @@ def main(args):
     # `settings` should have crawlera key, Adding key from credentials
     settings.attributes['CRAWLERA_APIKEY'] = SettingsAttribute(Crawlera.CRAWLERA_APIKEY, 20)
 
+    # Location pipelines write to the database at the same time, the pool of
+    # connections (shared by all the crawlers) grows with them. Writes wait
+    # for a free connection in reactor's threads, which DNS lookups use too,
+    # so there are more threads than connections.
+    max_parallel_locations = max(1, min(args.max_parallel_locations, len(location_list)))
+    db_connections = max(settings.getint('DB_POOL_MAX_CONNECTIONS'),
+                         settings.getint('DB_POOL_CONNECTIONS_PER_LOCATION') * max_parallel_locations)
+    settings.set('DB_POOL_MAX_CONNECTIONS', db_connections, priority='cmdline')
+    reactor.suggestThreadPoolSize(max(settings.getint('REACTOR_THREADPOOL_MAXSIZE'), 
+                                      db_connections + 10))
+
     runner = CrawlerRunner(settings=settings)
 
+    # Location pipelines running side by side split one request budget up
+    # front (see `get_location_settings`), so the load on the proxy is not
+    # more than with a single location. It is not split among more pipelines
+    # than there are locations.
+    location_runner = CrawlerRunner(settings=get_location_settings(settings,
+                                                                   max_parallel_locations))
+
+    @defer.inlineCallbacks
+    def crawl_location(location):
+        # reviews crawler must finish before menus crawler (menu urls are
+        # scraped by reviews crawler)
+        print(f'Scraping reviews/top menu items/menu urls for location - {location}')
+        yield location_runner.crawl(ReviewsSpider,
+                                    location=location,
+                                    pages=args.reviews_pages,
+                                    scrape_reviews=args.scrape_reviews,
+                                    conditional_crawl=args.conditional_crawl,
+                                    max_staleness_days=args.max_staleness_days)
+
+        print(f'Scraping menus for location - {location}')
+        yield location_runner.crawl(MenuSpider,
+                                    location=location,
+                                    refresh_menus=args.refresh_menus,
+                                    refresh_days=args.menu_refresh_days)
+
     @defer.inlineCallbacks
     def crawl():
-        for sortby in ['recommended', 'review_count', 'rating']:
-            yield runner.crawl(BusinessSpider,
-                                location_list=location_list,
-                                # location=location,
-                                sortby=sortby,
-                                pages=args.business_pages)
-
-        for location in location_list:
-            print(f'Scraping reviews/top menu items/menu urls for location - {location}')
-            yield runner.crawl(ReviewsSpider,
-                               location=location,
-                               pages=args.reviews_pages,
-                               scrape_reviews=args.scrape_reviews)
-
-            print(f'Scraping menus for location - {location}')
-            yield runner.crawl(MenuSpider,
-                               location=location)
+        # all sort orders are crawled in one run, sharing scraped businesses
+        yield runner.crawl(BusinessSpider,
+                           location_list=location_list,
+                           sortby_list=['recommended', 'review_count', 'rating'],
+                           pages=args.business_pages)
+
+        # keep `max_parallel_locations` location pipelines in flight at once
+        semaphore = defer.DeferredSemaphore(max_parallel_locations)
+        yield defer.DeferredList([semaphore.run(crawl_location, location)
+                                  for location
+                                  in location_list])
 
         reactor.stop()
 
@@ -72,6 +147,31 @@ if __name__ == '__main__':
                         default=None,
                         help="number of pages of reviews to scrape for each business (> 0)")
 
+    parser.add_argument("--conditional-crawl",
+                        default=None,
+                        type=lambda x: (str(x).lower() in ['true', '1', 'yes']),
+                        help="Skip businesses with no new reviews? (yes/no)")
+
+    parser.add_argument("--max-staleness-days",
+                        type=int,
+                        default=None,
+                        help="With conditional crawl, scrape business details again after these many days (> 0)")
+
+    parser.add_argument("--refresh-menus",
+                        default=None,
+                        type=lambda x: (str(x).lower() in ['true', '1', 'yes']),
+                        help="Check already scraped menus for changes? (yes/no)")
+
+    parser.add_argument("--menu-refresh-days",
+                        type=int,
+                        default=None,
+                        help="With menus refresh, check a menu for changes after these many days (> 0)")
+
+    parser.add_argument("--max-parallel-locations",
+                        type=int,
+                        default=1,
+                        help="Number of locations to scrape reviews/menus for at the same time (> 0)")
+
     args = parser.parse_args()
 
     if args.business_pages is not None:
@@ -82,4 +182,15 @@ if __name__ == '__main__':
         if args.reviews_pages < 1:
             parser.error("Number of pages must be > 0")
 
+    if args.max_staleness_days is not None:
+        if args.max_staleness_days < 1:
+            parser.error("Number of days must be > 0")
+
+    if args.menu_refresh_days is not None:
+        if args.menu_refresh_days < 1:
+            parser.error("Number of days must be > 0")
+
+    if args.max_parallel_locations < 1:
+        parser.error("Number of parallel locations must be > 0")
+
     main(args)
@@ -0,0 +1,238 @@
+"""Compact review chunks of a location
+
+Every run of reviews crawler leaves many small chunks (`CSPipeline`) for a
+location, and the same review can be in several of them (overlapping ranges
+of reviews are scraped again, see `crc` NOTE in
+`ReviewsSpider.get_error_requests`). This job merges all json lines chunks
+under a prefix into a few large files, sorted by business_id and date of
+review, keeping only the newest copy (from the most recently saved chunk) of
+every review_id.
+
+Chunks are downloaded and parsed in parallel. Memory is bounded by an
+external merge sort, sorted runs of `--run-size` reviews are written to
+temporary files and merged.
+
+Run from `scrapers` directory, storage backend and codec are taken from
+`settings.py`, for example:
+
+    $ python scripts/compact_reviews.py --prefix "reviews/Chicago, IL/" \\
+        --output-key "reviews_compacted/Chicago, IL/part-{part:05d}.jl{ext}"
+"""
+import argparse
+import gzip
+import heapq
+import json
+import os
+import sys
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from itertools import groupby
+from time import perf_counter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from scrapy.utils.misc import load_object
+from scrapy.utils.project import get_project_settings
+
+from yelp_scraper.exporters import JsonLinesChunkWriter
+from yelp_scraper.exporters import load_zstd_dictionary
+
+
+def decompress(object_key : str, data : bytes, zstd_dict=None) -> bytes:
+    if object_key.endswith(".gz"):
+        return gzip.decompress(data)
+    elif object_key.endswith(".zst"):
+        import zstandard
+        return zstandard.ZstdDecompressor(dict_data=zstd_dict).stream_reader(data).read()
+    else:
+        return data
+
+
+def read_chunk(storage, object_key : str, rank : int, zstd_dict=None) -> list:
+    """Reviews of a chunk as (business_id, review_id, -rank, json line),
+    newer chunks have higher rank"""
+    records = []
+    for line in decompress(object_key, storage.read(object_key), zstd_dict).splitlines():
+        if not line.strip():
+            continue
+        review = json.loads(line)
+        records.append((review.get("business_id") or "",
+                        review.get("review_id") or "",
+                        -rank,
+                        line.decode("utf-8")))
+
+    return records
+
+
+def read_chunks_parallel(storage, object_keys : list, workers : int, zstd_dict=None):
+    """Yield records of chunks, reading at most `2 * workers` chunks ahead"""
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = []
+        for rank, object_key in enumerate(object_keys):
+            futures.append(executor.submit(read_chunk, storage, object_key, rank, zstd_dict))
+            if len(futures) >= 2 * workers:
+                yield from futures.pop(0).result()
+
+        for future in futures:
+            yield from future.result()
+
+
+def write_run(records : list, tmp_dir : str) -> str:
+    records.sort()
+    fd, path = tempfile.mkstemp(suffix=".run.gz", dir=tmp_dir)
+    with gzip.open(os.fdopen(fd, "wb"), "wt", compresslevel=1, encoding="utf-8") as f:
+        for record in records:
+            f.write(json.dumps(record) + "\n")
+    return path
+
+
+def read_run(path : str):
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        for line in f:
+            yield tuple(json.loads(line))
+
+
+def dedupe(records):
+    """Keep first (newest) record of every (business_id, review_id), records
+    are sorted"""
+    last_key = None
+    for record in records:
+        if record[:2] != last_key:
+            last_key = record[:2]
+            yield record
+
+
+def main(args):
+    settings = get_project_settings()
+    storage = load_object(args.backend or settings.get('REVIEWS_STORAGE_BACKEND')).from_settings(settings)
+
+    codec = settings.get('BUCKET_COMPRESSION') or 'gzip'
+    zstd_dict = (load_zstd_dictionary(settings.get('BUCKET_ZSTD_DICTIONARY'))
+                 if (codec == 'zstd') and settings.get('BUCKET_ZSTD_DICTIONARY')
+                 else None)
+
+    # oldest first, so newer chunks get higher rank
+    chunks = sorted(((modified_at, object_key)
+                     for object_key, modified_at
+                     in storage.list(args.prefix)
+                     if object_key.endswith((".jl", ".jl.gz", ".jl.zst"))))
+    object_keys = [object_key for _, object_key in chunks]
+    if not object_keys:
+        sys.exit(f"No chunks under {args.prefix}")
+    print(f"{len(object_keys)} chunks under {args.prefix}")
+
+    start = perf_counter()
+    with tempfile.TemporaryDirectory(dir=args.tmp_dir) as tmp_dir:
+        # 1. sorted runs of (business_id, review_id, newest first)
+        run_paths = []
+        records = []
+        num_read = 0
+        for record in read_chunks_parallel(storage, object_keys, args.workers, zstd_dict):
+            records.append(record)
+            num_read += 1
+            if len(records) >= args.run_size:
+                run_paths.append(write_run(records, tmp_dir))
+                records = []
+        if records:
+            run_paths.append(write_run(records, tmp_dir))
+        print(f"{num_read} reviews read into {len(run_paths)} sorted runs "
+              f"in {perf_counter() - start:.1f} s")
+
+        # 2. merge runs, drop duplicates, sort reviews of a business by date
+        merged = dedupe(heapq.merge(*[read_run(path) for path in run_paths]))
+
+        part = 0
+        num_written = 0
+        writer = None
+        output_keys = []
+
+        def upload(writer, part):
+            [(partition_params, f)] = writer.finish()
+            object_key = args.output_key.format(part=part, **partition_params)
+            storage.upload(object_key, f)
+            output_keys.append(object_key)
+            print(f"{object_key} - {writer.count} reviews")
+
+        for business_id, business_records in groupby(merged, key=lambda record: record[0]):
+            reviews = [json.loads(record[3]) for record in business_records]
+            reviews.sort(key=lambda review: (review.get("date") or "", review.get("review_id") or ""))
+
+            if writer is None:
+                writer = JsonLinesChunkWriter(codec,
+                                              settings.getint('BUCKET_COMPRESSION_LEVEL')
+                                              if settings.get('BUCKET_COMPRESSION_LEVEL') is not None
+                                              else None,
+                                              zstd_dict)
+            for review in reviews:
+                writer.write(review)
+            num_written += len(reviews)
+
+            # all reviews of a business are in the same file
+            if writer.count >= args.part_size:
+                upload(writer, part)
+                writer = None
+                part += 1
+
+        if writer is not None:
+            upload(writer, part)
+
+    storage.close()
+    print(f"{num_written} reviews ({num_read - num_written} duplicates dropped) "
+          f"written to {len(output_keys)} files in {perf_counter() - start:.1f} s")
+
+    if args.delete_chunks:
+        for object_key in object_keys:
+            if object_key not in output_keys:
+                storage.delete(object_key)
+        print(f"{len(object_keys)} chunks deleted")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument("--prefix",
+                        type=str,
+                        required=True,
+                        help="Prefix of chunks to compact, like, 'reviews/Chicago, IL/'")
+
+    parser.add_argument("--output-key",
+                        type=str,
+                        required=True,
+                        help="Template of compacted file keys with {part} (and {ext} - extension of codec)")
+
+    parser.add_argument("--backend",
+                        type=str,
+                        default=None,
+                        help="Storage backend class (default REVIEWS_STORAGE_BACKEND)")
+
+    parser.add_argument("--workers",
+                        type=int,
+                        default=8,
+                        help="Number of chunks downloaded and parsed at the same time")
+
+    parser.add_argument("--run-size",
+                        type=int,
+                        default=200000,
+                        help="Reviews sorted in memory at a time")
+
+    parser.add_argument("--part-size",
+                        type=int,
+                        default=500000,
+                        help="Reviews in a compacted file (about)")
+
+    parser.add_argument("--tmp-dir",
+                        type=str,
+                        default=None,
+                        help="Directory for sorted runs")
+
+    parser.add_argument("--delete-chunks",
+                        default=False,
+                        type=lambda x: (str(x).lower() in ['true', '1', 'yes']),
+                        help="Delete compacted chunks? (yes/no)")
+
+    args = parser.parse_args()
+
+    if (args.workers < 1) or (args.run_size < 1) or (args.part_size < 1):
+        parser.error("Number of workers, run size and part size must be > 0")
+
+    main(args)
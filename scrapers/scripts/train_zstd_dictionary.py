@@ -0,0 +1,122 @@
+"""Train zstd dictionary for review chunks
+
+Samples json lines (one review each) from saved chunks (`*.jl`, `*.jl.gz`,
+`*.jl.zst` files, for example under `LOCAL_STORAGE_ROOT` of
+`LocalFSStorageBackend`), trains a zstd dictionary on them and compares
+compression of chunks with and without the dictionary. Set the output path
+as `BUCKET_ZSTD_DICTIONARY` with `BUCKET_COMPRESSION = 'zstd'`.
+
+Run from `scrapers` directory, for example:
+
+    $ python scripts/train_zstd_dictionary.py --chunks-dir reviews_store --output reviews.zdict
+"""
+import argparse
+import gzip
+import os
+import random
+import sys
+from glob import glob
+from time import perf_counter
+
+import zstandard
+
+
+def read_lines(path : str) -> list:
+    with open(path, "rb") as f:
+        data = f.read()
+
+    if path.endswith(".gz"):
+        data = gzip.decompress(data)
+    elif path.endswith(".zst"):
+        data = zstandard.ZstdDecompressor().stream_reader(data).read()
+
+    return [line + b"\n" for line in data.splitlines() if line]
+
+
+class GzipCompressor:
+    def __init__(self, level : int):
+        self.level = level
+
+    def compress(self, data : bytes) -> bytes:
+        return gzip.compress(data, self.level)
+
+
+def compress_chunks(lines : list, chunk_size : int, compressor) -> tuple:
+    raw_size = 0
+    compressed_size = 0
+    start = perf_counter()
+    for i in range(0, len(lines), chunk_size):
+        chunk = b"".join(lines[i:i + chunk_size])
+        raw_size += len(chunk)
+        compressed_size += len(compressor.compress(chunk))
+
+    return raw_size / max(compressed_size, 1), perf_counter() - start
+
+
+def main(args):
+    paths = [path 
+             for pattern in ("*.jl", "*.jl.gz", "*.jl.zst")
+             for path in glob(os.path.join(args.chunks_dir, "**", pattern), recursive=True)]
+    if not paths:
+        sys.exit(f"No chunks in {args.chunks_dir}")
+
+    lines = [line for path in paths for line in read_lines(path)]
+    random.seed(0)
+    random.shuffle(lines)
+
+    # keep some reviews aside to check the dictionary on
+    held_out = lines[:len(lines) // 10]
+    samples = lines[len(lines) // 10:][:args.max_samples]
+    print(f"{len(paths)} chunks, {len(samples)} reviews to train on, {len(held_out)} to test on")
+
+    start = perf_counter()
+    dictionary = zstandard.train_dictionary(args.dict_size, samples, level=args.level)
+    print(f"dictionary of {len(dictionary.as_bytes()) / 1024:.0f} KB trained in {perf_counter() - start:.1f} s")
+
+    with open(args.output, "wb") as f:
+        f.write(dictionary.as_bytes())
+
+    for chunk_size in args.chunk_sizes:
+        for name, compressor in [("gzip 6", GzipCompressor(6)),
+                                 (f"zstd {args.level}", zstandard.ZstdCompressor(level=args.level)),
+                                 (f"zstd {args.level} + dict", zstandard.ZstdCompressor(level=args.level,
+                                                                                         dict_data=dictionary))]:
+            ratio, elapsed = compress_chunks(held_out, chunk_size, compressor)
+            print(f"{chunk_size:>6} reviews/chunk, {name:<16}: ratio {ratio:5.2f}, {elapsed:.2f} s")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument("--chunks-dir",
+                        type=str,
+                        required=True,
+                        help="Directory containing saved review chunks")
+
+    parser.add_argument("--output",
+                        type=str,
+                        required=True,
+                        help="File to save the dictionary to")
+
+    parser.add_argument("--dict-size",
+                        type=int,
+                        default=112640,
+                        help="Size of dictionary in bytes")
+
+    parser.add_argument("--level",
+                        type=int,
+                        default=3,
+                        help="zstd compression level")
+
+    parser.add_argument("--max-samples",
+                        type=int,
+                        default=100000,
+                        help="Maximum number of reviews to train on")
+
+    parser.add_argument("--chunk-sizes",
+                        type=int,
+                        nargs="+",
+                        default=[100, 1000],
+                        help="Reviews per chunk to compare compression for")
+
+    main(parser.parse_args())
@@ -0,0 +1,165 @@
+import json
+import os
+from time import time
+
+import pytest
+
+from scrapy.signalmanager import SignalManager
+
+from twisted.internet.defer import Deferred
+from twisted.internet.defer import maybeDeferred
+
+from yelp_scraper import checkpoint
+from yelp_scraper.checkpoint import ReviewsCheckpointer
+from yelp_scraper.signals import upload_pending_items
+
+
+class FakeCrawler:
+    def __init__(self):
+        self.signals = SignalManager(self)
+
+
+class FakeSpider:
+    location = "San Francisco, CA"
+
+    def __init__(self, business_ids=()):
+        self.crawler = FakeCrawler()
+        self.business_data = {business_id : {} for business_id in business_ids}
+        self.uploaded = []
+        self.upload_result = True
+
+    def get_db_row(self, business_id):
+        return {"business_id" : business_id}
+
+    def upload_to_db(self, rows):
+        if self.upload_result:
+            self.uploaded.extend(row["business_id"] for row in rows)
+        return self.upload_result
+
+
+class FakePipeline:
+    """Uploads pending items when `upload` is fired"""
+
+    def __init__(self, spider):
+        self.upload = None
+        spider.crawler.signals.connect(self.upload_pending_items,
+                                       signal=upload_pending_items)
+
+    def upload_pending_items(self, spider):
+        self.upload = Deferred()
+        return self.upload
+
+
+@pytest.fixture(autouse=True)
+def flush_inline(monkeypatch):
+    # write in the calling thread instead of the reactor thread pool
+    monkeypatch.setattr(checkpoint, "run_flush",
+                        lambda fn, *args: maybeDeferred(fn, *args))
+
+
+def make_checkpointer(tmp_path, spider, **kwargs):
+    return ReviewsCheckpointer(spider, checkpoint_dir=str(tmp_path), **kwargs)
+
+
+def test_flush_waits_for_pipeline_uploads(tmp_path):
+    spider = FakeSpider(["a", "b"])
+    pipeline = FakePipeline(spider)
+    checkpointer = make_checkpointer(tmp_path, spider, batch_size=2)
+
+    checkpointer.business_finished("a")
+    assert pipeline.upload is None
+
+    checkpointer.business_finished("b")
+    # reviews of the businesses are not uploaded yet
+    assert spider.uploaded == []
+    assert not os.path.exists(checkpointer.checkpoint_path)
+
+    pipeline.upload.callback(None)
+    assert spider.uploaded == ["a", "b"]
+    assert spider.business_data == {}
+    assert checkpointer.flushed == {"a", "b"}
+    assert not checkpointer.pending_flushes
+
+    with open(checkpointer.checkpoint_path) as f:
+        assert json.load(f)["flushed"] == ["a", "b"]
+
+
+def test_failed_pipeline_upload_is_not_flushed(tmp_path):
+    spider = FakeSpider(["a"])
+    pipeline = FakePipeline(spider)
+    checkpointer = make_checkpointer(tmp_path, spider, batch_size=1)
+
+    checkpointer.business_finished("a")
+    pipeline.upload.errback(RuntimeError("upload failed"))
+
+    assert spider.uploaded == []
+    assert checkpointer.finished == ["a"]
+    assert "a" in spider.business_data
+
+
+def test_failed_db_write_is_retried_with_next_batch(tmp_path):
+    spider = FakeSpider(["a", "b"])
+    checkpointer = make_checkpointer(tmp_path, spider, batch_size=1)
+
+    spider.upload_result = False
+    checkpointer.business_finished("a")
+    assert checkpointer.finished == ["a"]
+    assert checkpointer.flushed == set()
+    assert not os.path.exists(checkpointer.checkpoint_path)
+
+    spider.upload_result = True
+    checkpointer.business_finished("b")
+    assert spider.uploaded == ["a", "b"]
+    assert checkpointer.flushed == {"a", "b"}
+
+
+def test_resume_skips_flushed_businesses(tmp_path):
+    spider = FakeSpider(["a", "b"])
+    checkpointer = make_checkpointer(tmp_path, spider, batch_size=1)
+    checkpointer.business_finished("a")
+
+    # crawl is killed, restarted crawl loads the checkpoint
+    resumed = make_checkpointer(tmp_path, FakeSpider())
+    assert resumed.is_flushed("a")
+    assert not resumed.is_flushed("b")
+
+
+def test_stale_checkpoint_is_ignored(tmp_path):
+    checkpointer = make_checkpointer(tmp_path, FakeSpider(), max_age=60)
+
+    with open(checkpointer.checkpoint_path, "w") as f:
+        json.dump({"location" : FakeSpider.location,
+                   "saved_at" : time() - 120,
+                   "flushed" : ["a"]}, f)
+    assert not make_checkpointer(tmp_path, FakeSpider(), max_age=60).is_flushed("a")
+    assert make_checkpointer(tmp_path, FakeSpider(), max_age=600).is_flushed("a")
+
+    # saved before `saved_at` was added
+    with open(checkpointer.checkpoint_path, "w") as f:
+        json.dump({"location" : FakeSpider.location, "flushed" : ["a"]}, f)
+    assert not make_checkpointer(tmp_path, FakeSpider()).is_flushed("a")
+
+
+def test_close_flushes_remaining_and_removes_checkpoint(tmp_path):
+    spider = FakeSpider(["a", "b", "c"])
+    checkpointer = make_checkpointer(tmp_path, spider, batch_size=1)
+    checkpointer.business_finished("a")
+    assert os.path.exists(checkpointer.checkpoint_path)
+
+    # "c" is not finished, it is still written with its errors
+    checkpointer.finished.append("b")
+    checkpointer.close("finished")
+
+    assert spider.uploaded == ["a", "b", "c"]
+    assert not os.path.exists(checkpointer.checkpoint_path)
+
+
+def test_interrupted_crawl_keeps_checkpoint(tmp_path):
+    spider = FakeSpider(["a", "b"])
+    checkpointer = make_checkpointer(tmp_path, spider, batch_size=1)
+    checkpointer.business_finished("a")
+
+    checkpointer.close("shutdown")
+
+    assert spider.uploaded == ["a", "b"]
+    assert os.path.exists(checkpointer.checkpoint_path)
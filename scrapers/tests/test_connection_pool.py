@@ -0,0 +1,198 @@
+from threading import Thread
+from time import sleep
+from time import time
+
+import psycopg2
+from psycopg2.extensions import TRANSACTION_STATUS_IDLE
+from psycopg2.extensions import TRANSACTION_STATUS_INTRANS
+from psycopg2.pool import PoolError
+import pytest
+
+from yelp_scraper import db
+from yelp_scraper.db import ConnectionPool
+
+
+class FakeCursor:
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+    def execute(self, query, params=None):
+        if self.conn.broken:
+            raise psycopg2.OperationalError("server closed the connection unexpectedly")
+        self.conn.info.transaction_status = TRANSACTION_STATUS_INTRANS
+
+
+class FakeInfo:
+    transaction_status = TRANSACTION_STATUS_IDLE
+
+
+class FakeConnection:
+    """Connection to a database server which is not there"""
+
+    def __init__(self):
+        self.closed = 0
+        self.broken = False
+        self.info = FakeInfo()
+        self.commits = 0
+        self.rollbacks = 0
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def commit(self):
+        self.commits += 1
+        self.info.transaction_status = TRANSACTION_STATUS_IDLE
+
+    def rollback(self):
+        if self.broken:
+            raise psycopg2.InterfaceError("connection already closed")
+        self.rollbacks += 1
+        self.info.transaction_status = TRANSACTION_STATUS_IDLE
+
+    def close(self):
+        self.closed = 1
+
+
+class FakeThreadedPool:
+    """Keeps idle connections like `ThreadedConnectionPool`"""
+
+    def __init__(self, failures=0):
+        self.idle = []
+        self.opened = []
+        self.failures = failures
+
+    def getconn(self):
+        if self.failures:
+            self.failures -= 1
+            raise psycopg2.OperationalError("could not connect to server")
+        if self.idle:
+            return self.idle.pop()
+        conn = FakeConnection()
+        self.opened.append(conn)
+        return conn
+
+    def putconn(self, conn, close=False):
+        if close:
+            conn.close()
+        else:
+            self.idle.append(conn)
+
+    def closeall(self):
+        for conn in self.idle:
+            conn.close()
+
+
+def make_pool(max_connections=2, failures=0, **kwargs):
+    pool = ConnectionPool(max_connections=max_connections, **kwargs)
+    pool.pool = FakeThreadedPool(failures)
+    return pool
+
+
+@pytest.fixture(autouse=True)
+def worker_thread(monkeypatch):
+    monkeypatch.setattr(db, "isInIOThread", lambda: False)
+    monkeypatch.setattr(db, "sleep", lambda seconds: None)
+
+
+def test_connection_is_reused():
+    pool = make_pool()
+    conn = pool.getconn()
+    pool.putconn(conn)
+    assert pool.getconn() is conn
+    assert len(pool.pool.opened) == 1
+
+
+def test_uncommitted_changes_are_rolled_back():
+    pool = make_pool()
+    with pytest.raises(ValueError):
+        with pool.connection() as conn:
+            # new connection was checked (and rolled back) before use
+            rollbacks = conn.rollbacks
+            with conn.cursor() as cursor:
+                cursor.execute("UPDATE restaurants_info SET menu_url = NULL")
+            raise ValueError()
+
+    assert (conn.commits, conn.rollbacks) == (0, rollbacks + 1)
+
+    with pool.connection() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute("UPDATE restaurants_info SET menu_url = NULL")
+    assert conn.commits == 1
+
+
+def test_idle_broken_connection_is_replaced():
+    pool = make_pool(check_interval=30)
+    conn = pool.getconn()
+    pool.putconn(conn)
+
+    # server restarted while the connection was idle
+    conn.broken = True
+    pool.last_used[conn] = time() - 60
+
+    new_conn = pool.getconn()
+    assert new_conn is not conn
+    assert conn.closed
+    assert not new_conn.broken
+
+
+def test_recently_used_connection_is_not_checked():
+    pool = make_pool(check_interval=30)
+    conn = pool.getconn()
+    pool.putconn(conn)
+    conn.broken = True
+    assert pool.getconn() is conn
+
+
+def test_connecting_is_retried():
+    pool = make_pool(failures=2, connect_retries=3)
+    assert pool.getconn() is not None
+
+    pool = make_pool(failures=2, connect_retries=1)
+    with pytest.raises(psycopg2.OperationalError):
+        pool.getconn()
+    # slot is given back when connecting fails
+    pool.pool.failures = 0
+    pool.getconn()
+    pool.getconn()
+
+
+def test_reactor_thread_does_not_wait(monkeypatch):
+    monkeypatch.setattr(db, "isInIOThread", lambda: True)
+    pool = make_pool(max_connections=1)
+    conn = pool.getconn()
+
+    with pytest.raises(PoolError):
+        pool.getconn()
+
+    pool.putconn(conn)
+    assert pool.getconn() is conn
+
+
+def test_worker_thread_waits_for_free_connection():
+    pool = make_pool(max_connections=1)
+    conn = pool.getconn()
+    got = []
+
+    waiting = Thread(target=lambda: got.append(pool.getconn()))
+    waiting.start()
+    sleep(0.1)
+    assert not got
+
+    pool.putconn(conn)
+    waiting.join(5)
+    assert got == [conn]
+
+
+def test_connection_given_back_after_closeall():
+    pool = make_pool()
+    conn = pool.getconn()
+    pool.closeall()
+
+    pool.putconn(conn)
+    assert conn.closed
@@ -0,0 +1,139 @@
+from datetime import date
+from datetime import datetime
+from datetime import timezone
+
+from psycopg2 import sql
+from psycopg2.extras import Json
+
+from yelp_scraper.db import _CopyReader
+from yelp_scraper.db import fetch_in_batches
+from yelp_scraper.db import get_columns
+from yelp_scraper.db import keep_non_empty
+from yelp_scraper.db import to_copy_value
+
+
+def test_to_copy_value_scalars():
+    assert to_copy_value(None) == "\\N"
+    assert to_copy_value(True) == "t"
+    assert to_copy_value(False) == "f"
+    assert to_copy_value(0) == "0"
+    assert to_copy_value(4.5) == "4.5"
+    assert to_copy_value("") == ""
+    assert to_copy_value("Brenda's") == "Brenda's"
+
+
+def test_to_copy_value_escapes_text_format():
+    assert to_copy_value("a\tb") == "a\\tb"
+    assert to_copy_value("line 1\nline 2\r\n") == "line 1\\nline 2\\r\\n"
+    assert to_copy_value("C:\\menu") == "C:\\\\menu"
+    # "\N" in text is not NULL
+    assert to_copy_value("\\N") == "\\\\N"
+
+
+def test_to_copy_value_json():
+    assert to_copy_value(Json({"a" : [1, None]})) == '{"a": [1, null]}'
+    assert to_copy_value({"a" : "x\ty"}) == '{"a": "x\\\\ty"}'
+    assert to_copy_value(Json({"name" : "line\nbreak"})) == '{"name": "line\\\\nbreak"}'
+    assert to_copy_value({}) == "{}"
+
+
+def test_to_copy_value_arrays():
+    assert to_copy_value(["Pizza", "Bars"]) == '{"Pizza","Bars"}'
+    assert to_copy_value(("Pizza",)) == '{"Pizza"}'
+    assert to_copy_value([]) == "{}"
+    assert to_copy_value(["a", None]) == '{"a",NULL}'
+    assert to_copy_value([[1, 2], [3, 4]]) == '{{"1","2"},{"3","4"}}'
+    # quotes and backslashes are escaped for the array literal, and then
+    # backslashes again for COPY
+    assert to_copy_value(['say "hi"']) == '{"say \\\\"hi\\\\""}'
+    assert to_copy_value(["a\\b"]) == '{"a\\\\\\\\b"}'
+
+
+def test_to_copy_value_dates():
+    assert to_copy_value(date(2020, 8, 1)) == "2020-08-01"
+    assert to_copy_value(datetime(2020, 8, 1, 10, 30, tzinfo=timezone.utc)) == "2020-08-01T10:30:00+00:00"
+
+
+def test_copy_reader():
+    lines = ["a\t1\n", "b\t2\n", "c\t3\n"]
+    reader = _CopyReader(iter(lines))
+    assert reader.read(3) == "a\t1"
+    assert reader.read(5) == "\nb\t2\n"
+    assert reader.read(-1) == "c\t3\n"
+    assert reader.read(10) == ""
+
+    assert _CopyReader(iter(lines)).read() == "".join(lines)
+
+
+def test_get_columns():
+    rows = [{"business_id" : "a", "menu" : None},
+            {"business_id" : "b", "menu_url" : "/menu/b"},
+            {"num_reviews" : 3, "business_id" : "c"}]
+    assert get_columns(rows) == ["business_id", "menu", "menu_url", "num_reviews"]
+    assert get_columns([]) == []
+
+
+def test_keep_non_empty():
+    expression = sql.SQL(keep_non_empty("top_food_items")).format(
+        table=sql.SQL('"restaurants_info"')).as_string(None)
+
+    empty = "in ('', '0', 'false', '{}', '[]', 'null'), true)"
+    assert expression == (
+        f'case when coalesce(excluded."top_food_items"::text {empty} '
+        f'and not coalesce("restaurants_info"."top_food_items"::text {empty} '
+        f'then "restaurants_info"."top_food_items" '
+        f'else excluded."top_food_items" end')
+
+
+def test_keep_non_empty_quotes_column():
+    expression = sql.SQL(keep_non_empty('odd"name')).format(
+        table=sql.SQL('"t"')).as_string(None)
+    assert 'excluded."odd""name"' in expression
+    assert '"t"."odd""name"' in expression
+
+
+class FakeCursor:
+    """Runs the keyset condition of `fetch_in_batches` on a list of rows"""
+
+    def __init__(self, rows):
+        self.rows = sorted(rows, key=lambda row: row["business_id"])
+        self.queries = []
+
+    def execute(self, query, params):
+        self.queries.append((query, params))
+        rows = self.rows
+        if "_last_key" in query:
+            rows = [row for row in rows if row["business_id"] > params["_last_key"]]
+        self.result = rows[:params["_batch_size"]]
+
+    def fetchall(self):
+        return self.result
+
+
+def test_fetch_in_batches():
+    rows = [{"business_id" : f"b{i:03d}"} for i in range(10)]
+    cursor = FakeCursor(rows)
+    fetched = fetch_in_batches(cursor, "select business_id from t where location = %(location)s",
+                               {"location" : "Chicago, IL"}, batch_size=4)
+    assert list(fetched) == rows
+    assert len(cursor.queries) == 3
+
+    first_query, first_params = cursor.queries[0]
+    assert first_query == ("select business_id from t where location = %(location)s "
+                           "order by business_id limit %(_batch_size)s")
+    assert first_params["location"] == "Chicago, IL"
+
+    last_query, last_params = cursor.queries[-1]
+    assert "and business_id > %(_last_key)s order by business_id" in last_query
+    assert last_params["_last_key"] == "b007"
+
+
+def test_fetch_in_batches_exact_multiple():
+    rows = [{"business_id" : f"b{i}"} for i in range(4)]
+    cursor = FakeCursor(rows)
+    assert list(fetch_in_batches(cursor, "select * from t where true", {}, batch_size=2)) == rows
+    # last query finds nothing
+    assert len(cursor.queries) == 3
+
+    cursor = FakeCursor([])
+    assert list(fetch_in_batches(cursor, "select * from t where true", {})) == []
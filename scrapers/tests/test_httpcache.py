@@ -0,0 +1,94 @@
+from scrapy.http import HtmlResponse
+from scrapy.http import Request
+from scrapy.settings import Settings
+from scrapy.utils.test import get_crawler
+
+from yelp_scraper import httpcache
+from yelp_scraper.httpcache import SqliteCacheStorage
+
+
+class FakeSpider:
+    crawler = get_crawler()
+
+
+def make_storage(tmp_path, **settings):
+    storage = SqliteCacheStorage(Settings({"HTTPCACHE_DIR" : str(tmp_path),
+                                           "HTTPCACHE_EXPIRATION_SECS" : 0,
+                                           **settings}))
+    return storage
+
+
+def store(storage, url, body=b"<html>page</html>"):
+    request = Request(url)
+    storage.store_response(FakeSpider, request, HtmlResponse(url, body=body))
+    return request
+
+
+def test_spiders_share_one_connection(tmp_path):
+    first = make_storage(tmp_path)
+    second = make_storage(tmp_path)
+    first.open_spider(FakeSpider)
+    second.open_spider(FakeSpider)
+    assert first.cache is second.cache
+
+    request = store(first, "https://www.yelp.com/biz/a")
+    assert second.retrieve_response(FakeSpider, request).body == b"<html>page</html>"
+    size = first.cache.size
+    store(second, "https://www.yelp.com/biz/b")
+    assert first.cache.size > size
+
+    first.close_spider(FakeSpider)
+    # still open for the second spider
+    assert second.retrieve_response(FakeSpider, request) is not None
+    second.close_spider(FakeSpider)
+    assert not httpcache._caches
+
+
+def test_size_and_eviction_with_shared_file(tmp_path):
+    first = make_storage(tmp_path, HTTPCACHE_SQLITE_TOUCH_EVERY=1000)
+    second = make_storage(tmp_path, HTTPCACHE_SQLITE_TOUCH_EVERY=1000)
+    first.open_spider(FakeSpider)
+    second.open_spider(FakeSpider)
+
+    body = bytes(range(256)) * 40 # does not compress
+    requests = [store(first if i % 2 else second, f"https://www.yelp.com/biz/{i}", body)
+                for i in range(10)]
+    db_size = first.cache.db.execute("SELECT sum(size) FROM responses").fetchone()[0]
+    assert first.cache.size == db_size
+
+    # first page was used last, so it is not evicted
+    assert first.retrieve_response(FakeSpider, requests[0]) is not None
+    first.max_size = second.max_size = db_size
+    store(second, "https://www.yelp.com/biz/new", body)
+
+    assert first.cache.size <= db_size
+    assert first.retrieve_response(FakeSpider, requests[0]) is not None
+    assert first.retrieve_response(FakeSpider, requests[1]) is None
+
+    first.close_spider(FakeSpider)
+    second.close_spider(FakeSpider)
+
+
+def test_expired_page(tmp_path):
+    storage = make_storage(tmp_path, HTTPCACHE_PAGE_TYPE_TTLS={"homepage" : 1})
+    storage.open_spider(FakeSpider)
+    request = store(storage, "https://www.yelp.com/biz/a")
+    storage.cache.db.execute("UPDATE responses SET stored_at = stored_at - 10")
+    assert storage.retrieve_response(FakeSpider, request) is None
+    storage.close_spider(FakeSpider)
+
+
+def test_page_is_cached_per_version(tmp_path):
+    storage = make_storage(tmp_path)
+    storage.open_spider(FakeSpider)
+    url = "https://www.yelp.com/biz/a/review_feed?rl=en&sort_by=date_desc&q=&start=0"
+    storage.store_response(FakeSpider,
+                           Request(url, meta={"httpcache_version" : 40}),
+                           HtmlResponse(url, body=b"old reviews"))
+
+    cached = storage.retrieve_response(FakeSpider, Request(url, meta={"httpcache_version" : 40}))
+    assert cached.body == b"old reviews"
+    # new reviews were posted, offsets point to other reviews now
+    assert storage.retrieve_response(FakeSpider, Request(url, meta={"httpcache_version" : 45})) is None
+    assert storage.retrieve_response(FakeSpider, Request(url)) is None
+    storage.close_spider(FakeSpider)
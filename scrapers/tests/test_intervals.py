@@ -0,0 +1,101 @@
+from yelp_scraper.intervals import IntervalSet
+
+
+def test_overlapping_and_adjacent_ranges_are_coalesced():
+    assert IntervalSet([(40, 60), (0, 20), (10, 25)]).ranges == [(0, 25), (40, 60)]
+    # half open, (0, 20) and (20, 40) have no gap between them
+    assert IntervalSet([(20, 40), (0, 20)]).ranges == [(0, 40)]
+    assert IntervalSet([(0, 20), (21, 40)]).ranges == [(0, 20), (21, 40)]
+    assert IntervalSet([(0, 50), (10, 20)]).ranges == [(0, 50)]
+
+
+def test_empty_ranges_are_dropped():
+    assert IntervalSet([(5, 5), (7, 3)]).ranges == []
+    assert not IntervalSet()
+    assert len(IntervalSet()) == 0
+    assert IntervalSet().to_pg() == "{}"
+    assert IntervalSet.from_pg("{}") == IntervalSet()
+    assert IntervalSet.from_pg(None) == IntervalSet()
+    assert IntervalSet.from_pg("empty") == IntervalSet()
+
+
+def test_len_counts_integers():
+    assert len(IntervalSet([(0, 20), (40, 48)])) == 28
+    assert len(IntervalSet([(0, 1)])) == 1
+
+
+def test_inclusive_conversions():
+    interval_set = IntervalSet.from_inclusive([(0, 19), (40, 47)])
+    assert interval_set.ranges == [(0, 20), (40, 48)]
+    assert interval_set.to_inclusive() == [(0, 19), (40, 47)]
+    # single review
+    assert IntervalSet.from_inclusive([(7, 7)]).ranges == [(7, 8)]
+    assert IntervalSet([(7, 8)]).to_inclusive() == [(7, 7)]
+    # inclusive ranges next to each other are adjacent
+    assert IntervalSet.from_inclusive([(0, 19), (20, 39)]).ranges == [(0, 40)]
+
+
+def test_pg_round_trip():
+    for text in ["{}", "{[0,20)}", "{[0,20),[40,48)}", "{[-5,3),[10,11)}"]:
+        assert IntervalSet.from_pg(text).to_pg() == text
+
+
+def test_from_pg_bounds():
+    # postgres outputs canonical [a,b) for int4, other bounds are accepted
+    assert IntervalSet.from_pg("{[0,19],(39,47]}").ranges == [(0, 20), (40, 48)]
+    assert IntervalSet.from_pg("[0,20)").ranges == [(0, 20)]
+    assert IntervalSet.from_pg("{[0, 20), [20, 30)}").ranges == [(0, 30)]
+
+
+def test_shift():
+    assert IntervalSet([(0, 20), (40, 48)]).shift(5).ranges == [(5, 25), (45, 53)]
+    assert IntervalSet().shift(5) == IntervalSet()
+
+
+def test_add():
+    interval_set = IntervalSet()
+    interval_set.add(20, 40)
+    interval_set.add(0, 20)
+    interval_set.add(60, 60)
+    assert interval_set.ranges == [(0, 40)]
+
+
+def test_union():
+    assert (IntervalSet([(0, 10)]) | IntervalSet([(10, 20), (30, 40)])).ranges == [(0, 20), (30, 40)]
+
+
+def test_subtract():
+    errors_at = IntervalSet([(0, 100)])
+    assert (errors_at - IntervalSet([(0, 20)])).ranges == [(20, 100)]
+    assert (errors_at - IntervalSet([(80, 100)])).ranges == [(0, 80)]
+    assert (errors_at - IntervalSet([(20, 40), (60, 80)])).ranges == [(0, 20), (40, 60), (80, 100)]
+    assert (errors_at - IntervalSet([(0, 100)])) == IntervalSet()
+    assert (errors_at - IntervalSet([(-10, 200)])) == IntervalSet()
+    assert (errors_at - IntervalSet()) == errors_at
+    assert (IntervalSet() - errors_at) == IntervalSet()
+    # `other` range covering the end of one range and the start of the next
+    assert (IntervalSet([(0, 20), (40, 60)]) - IntervalSet([(10, 50)])).ranges == [(0, 10), (50, 60)]
+    # single integers at the edges
+    assert (IntervalSet([(0, 20)]) - IntervalSet([(0, 1), (19, 20)])).ranges == [(1, 19)]
+
+
+def test_intersection():
+    a = IntervalSet([(0, 20), (40, 60)])
+    b = IntervalSet([(10, 50), (55, 70)])
+    assert (a & b).ranges == [(10, 20), (40, 50), (55, 60)]
+    assert (a & IntervalSet()) == IntervalSet()
+    # adjacent ranges do not intersect
+    assert (IntervalSet([(0, 20)]) & IntervalSet([(20, 40)])) == IntervalSet()
+
+
+def test_subtract_matches_python_sets():
+    a = IntervalSet([(0, 7), (9, 15), (20, 21), (30, 45)])
+    b = IntervalSet([(3, 10), (14, 31), (40, 41)])
+
+    def to_set(interval_set):
+        return {i for start, stop in interval_set for i in range(start, stop)}
+
+    assert to_set(a - b) == to_set(a) - to_set(b)
+    assert to_set(b - a) == to_set(b) - to_set(a)
+    assert to_set(a & b) == to_set(a) & to_set(b)
+    assert to_set(a | b) == to_set(a) | to_set(b)
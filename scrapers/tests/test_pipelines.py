@@ -0,0 +1,151 @@
+import json
+from time import sleep
+from time import time
+
+import pytest
+
+from scrapy.settings import Settings
+
+from twisted.internet import reactor
+from twisted.python.failure import Failure
+
+from yelp_scraper import pipelines
+from yelp_scraper.pipelines import CSPipeline
+
+
+def use_settings(monkeypatch, tmp_path, **settings):
+    monkeypatch.setattr(pipelines, "settings",
+                        Settings({"REVIEWS_STORAGE_BACKEND" : "yelp_scraper.storage.LocalFSStorageBackend",
+                                  "LOCAL_STORAGE_ROOT" : str(tmp_path),
+                                  "REVIEWS_FILE_URL" : "reviews/{city}/{time}_{chunk}.jl{ext}",
+                                  **settings}))
+    monkeypatch.setattr(pipelines.GCP, "FILE_URL", None)
+
+
+@pytest.mark.parametrize("codec, template", [("gzip", "reviews/{city}/{chunk}.jl{ext}"),
+                                             ("zstd", "reviews/{city}/{chunk}.jl{ext}"),
+                                             ("gzip", "reviews/{city}/{chunk}.jl.gz"),
+                                             ("zstd", "reviews/{city}/{chunk}.jl.zst"),
+                                             ("none", "reviews/{city}/{chunk}.jl")])
+def test_object_key_template_matches_codec(monkeypatch, tmp_path, codec, template):
+    use_settings(monkeypatch, tmp_path, BUCKET_COMPRESSION=codec, REVIEWS_FILE_URL=template)
+    assert CSPipeline().codec == codec
+
+
+@pytest.mark.parametrize("codec, template", [("zstd", "reviews/{city}/{chunk}.jl.gz"),
+                                             ("gzip", "reviews/{city}/{chunk}.jl.zst"),
+                                             ("gzip", "reviews/{city}/{chunk}.jl"),
+                                             ("none", "reviews/{city}/{chunk}.jl.gz")])
+def test_object_key_template_with_other_extension(monkeypatch, tmp_path, codec, template):
+    use_settings(monkeypatch, tmp_path, BUCKET_COMPRESSION=codec, REVIEWS_FILE_URL=template)
+    with pytest.raises(ValueError):
+        CSPipeline()
+
+
+class FakeSpider:
+    name = "Reviews_"
+
+
+def wait(d, timeout=5):
+    """Run calls from the upload threads till `d` fires, reactor is not 
+    running in tests"""
+    results = []
+    d.addBoth(results.append)
+
+    deadline = time() + timeout
+    while not results:
+        assert time() < deadline, "Deferred did not fire"
+        sleep(0.01)
+        reactor.runUntilCurrent()
+
+    if isinstance(results[0], Failure):
+        results[0].raiseException()
+    return results[0]
+
+
+def review(location, number, text="good food"):
+    return {"review_id" : f"{location}-{number}",
+            "review" : text,
+            "business_id" : "b",
+            "business_location" : location}
+
+
+def stored_reviews(tmp_path):
+    reviews = {}
+    for path in sorted(tmp_path.rglob("*.jl")):
+        city = path.parent.name
+        reviews.setdefault(city, []).extend(json.loads(line)["review_id"]
+                                            for line
+                                            in path.read_text().splitlines())
+    return reviews
+
+
+@pytest.fixture
+def pipeline(monkeypatch, tmp_path):
+    use_settings(monkeypatch, tmp_path,
+                 BUCKET_COMPRESSION="none",
+                 BUCKET_MAX_CHUNK_SIZE=3,
+                 BUCKET_MAX_CHUNK_BYTES=0,
+                 BUCKET_MAX_BUFFER_BYTES=0,
+                 BUCKET_MAX_CHUNK_AGE=0,
+                 LOCAL_STORAGE_FSYNC_EVERY=0)
+    pipeline = CSPipeline()
+    pipeline.open_spider(FakeSpider)
+    yield pipeline
+    if pipeline.upload_pool.started:
+        pipeline.upload_pool.stop()
+
+
+def test_items_are_buffered_per_location(pipeline, tmp_path):
+    for i in range(3):
+        pipeline.process_item(review("Chicago, IL", i), FakeSpider)
+    for i in range(2):
+        pipeline.process_item(review("Boston, MA", i), FakeSpider)
+
+    # chunk of Chicago is full, Boston's is still buffered
+    assert list(pipeline.writers) == [("Boston, MA", None)]
+    assert pipeline.chunk_numbers == {("Chicago, IL", None) : 3}
+
+    wait(pipeline.upload_pending_items(FakeSpider))
+    assert stored_reviews(tmp_path) == {"Boston, MA" : ["Boston, MA-0", "Boston, MA-1"],
+                                        "Chicago, IL" : ["Chicago, IL-0", 
+                                                         "Chicago, IL-1", 
+                                                         "Chicago, IL-2"]}
+    assert not pipeline.writers
+    assert not pipeline.uploads
+
+
+def test_largest_buffers_are_uploaded_over_memory_cap(pipeline, tmp_path):
+    pipeline.max_chunk_size = 100
+    pipeline.process_item(review("Boston, MA", 0), FakeSpider)
+    pipeline.process_item(review("Chicago, IL", 0, "long review " * 20), FakeSpider)
+    pipeline.process_item(review("Austin, TX", 0), FakeSpider)
+    small_buffer = pipeline.writers[("Boston, MA", None)].size
+
+    pipeline.max_buffer_bytes = 3 * small_buffer
+    pipeline.process_item(review("Boston, MA", 1), FakeSpider)
+
+    # only the largest buffer had to go to fit in the cap
+    assert set(pipeline.writers) == {("Boston, MA", None), ("Austin, TX", None)}
+    assert pipeline.chunk_numbers == {("Chicago, IL", None) : 1}
+
+    wait(pipeline.close_spider(FakeSpider))
+    assert stored_reviews(tmp_path) == {"Austin, TX" : ["Austin, TX-0"],
+                                        "Boston, MA" : ["Boston, MA-0", "Boston, MA-1"],
+                                        "Chicago, IL" : ["Chicago, IL-0"]}
+    assert not pipeline.upload_pool.started
+
+
+def test_failed_upload_is_saved_locally(pipeline, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+
+    def upload(object_key, fileobj):
+        raise OSError("no space left on device")
+
+    monkeypatch.setattr(pipeline.storage, "upload", upload)
+    for i in range(3):
+        pipeline.process_item(review("Chicago, IL", i), FakeSpider)
+    wait(pipeline.close_spider(FakeSpider))
+
+    failed_file, = tmp_path.glob("cs_pipeline_failed_*")
+    assert len(failed_file.read_text().splitlines()) == 3
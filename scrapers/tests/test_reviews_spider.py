@@ -0,0 +1,140 @@
+import json
+
+import pytest
+
+from scrapy.http import Request
+from scrapy.http import TextResponse
+
+from yelp_scraper.intervals import IntervalSet
+from yelp_scraper.spiders.yelp_reviews_spider import ReviewsSpider
+
+BUSINESS_URL = "https://www.yelp.com/biz/brendas-french-soul-food-san-francisco-5"
+
+
+class FakeFailure:
+    def __init__(self, request):
+        self.request = request
+
+
+@pytest.fixture
+def spider(tmp_path, monkeypatch):
+    # no checkpoint of other runs is loaded
+    monkeypatch.chdir(tmp_path)
+    return ReviewsSpider(location="San Francisco, CA", scrape_reviews=True)
+
+
+def add_business(spider, last_reviews_count, current_reviews_count, errors_at=()):
+    spider.business_data["b"] = {"num_reviews" : current_reviews_count,
+                                 "last_reviews_count" : last_reviews_count,
+                                 "errors_at" : IntervalSet.from_inclusive(errors_at),
+                                 "scraped_reviews" : IntervalSet(),
+                                 "pending_requests" : 0,
+                                 "current_reviews_count" : current_reviews_count}
+
+
+def get_requests(spider):
+    requests = list(spider.get_error_requests(BUSINESS_URL, "b"))
+    spider.business_data["b"]["pending_requests"] = len(requests)
+    return requests
+
+
+def pages(requests):
+    return [(request.meta["page_start"], request.meta["review_ranges"])
+            for request
+            in requests]
+
+
+def review_feed_response(request, num_reviews):
+    start = request.meta["page_start"]
+    reviews = [{"id" : f"r{i}",
+                "comment" : {"text" : f"review {i}"},
+                "localizedDate" : "8/1/2020",
+                "rating" : 5,
+                "business" : {"name" : "Brenda's", "id" : "b", "alias" : "brendas"}}
+               for i
+               in range(start, min(start + 20, num_reviews))]
+    body = json.dumps({"pagination" : {"totalResults" : num_reviews,
+                                       "startResult" : start,
+                                       "resultsPerPage" : 20},
+                       "reviews" : reviews})
+    return TextResponse(request.url, body=body, encoding="utf-8", request=request)
+
+
+def test_first_scrape_requests_all_pages(spider):
+    add_business(spider, -1, 45)
+
+    assert pages(get_requests(spider)) == [(0, [(0, 19)]),
+                                           (20, [(20, 39)]),
+                                           (40, [(40, 44)])]
+    assert spider.business_data["b"]["errors_at"] == IntervalSet([(0, 45)])
+
+
+def test_ranges_not_on_page_boundaries(spider):
+    add_business(spider, 100, 100, [(5, 12), (15, 47), (65, 65)])
+
+    # (5, 12) and (15, 19) share the first page, it is requested once
+    assert pages(get_requests(spider)) == [(0, [(5, 12), (15, 19)]),
+                                           (20, [(20, 39)]),
+                                           (40, [(40, 47)]),
+                                           (60, [(65, 65)])]
+
+
+def test_new_reviews_shift_errors(spider):
+    add_business(spider, 100, 103, [(0, 4), (50, 52)])
+
+    # 3 new reviews, error at the start joins them
+    assert pages(get_requests(spider)) == [(0, [(0, 7)]),
+                                           (40, [(53, 55)])]
+    assert spider.business_data["b"]["errors_at"] == IntervalSet([(0, 8), (53, 56)])
+
+
+def test_no_errors_no_requests(spider):
+    add_business(spider, 100, 100)
+    assert get_requests(spider) == []
+
+
+def test_child_parse_yields_only_reviews_of_ranges(spider):
+    add_business(spider, 100, 100, [(5, 12), (15, 19)])
+    request, = get_requests(spider)
+
+    items = list(spider.child_parse(review_feed_response(request, 100)))
+
+    assert [item["review_id"] for item in items] == ([f"r{i}" for i in range(5, 13)]
+                                                     + [f"r{i}" for i in range(15, 20)])
+    assert items[0]["business_location"] == "San Francisco, CA"
+    assert spider.business_data["b"]["scraped_reviews"] == IntervalSet([(5, 13), (15, 20)])
+    assert spider.checkpointer.finished == ["b"]
+
+
+def test_last_page_with_less_reviews(spider):
+    add_business(spider, -1, 45)
+    requests = get_requests(spider)
+
+    items = list(spider.child_parse(review_feed_response(requests[-1], 43)))
+
+    assert [item["review_id"] for item in items] == ["r40", "r41", "r42"]
+    # see NOTE on crc in `get_error_requests`
+    assert spider.business_data["b"]["scraped_reviews"] == IntervalSet([(40, 45)])
+
+
+def test_failed_page_stays_in_errors_at(spider):
+    add_business(spider, 100, 103, [(30, 47)])
+    requests = get_requests(spider)
+    assert pages(requests) == [(0, [(0, 2)]), (20, [(33, 39)]), (40, [(40, 50)])]
+
+    list(spider.child_parse(review_feed_response(requests[0], 103)))
+    spider.request_error_handler(FakeFailure(requests[1]))
+    assert spider.checkpointer.finished == []
+    list(spider.child_parse(review_feed_response(requests[2], 103)))
+    assert spider.checkpointer.finished == ["b"]
+
+    row = spider.get_db_row("b")
+    assert row["errors_at"] == "{[33,40)}"
+    assert row["last_reviews_count"] == 103
+    assert "scraped_reviews" not in row
+    assert "pending_requests" not in row
+
+
+def test_review_feed_requests_are_cached_per_reviews_count(spider):
+    add_business(spider, -1, 45)
+    assert {request.meta["httpcache_version"] for request in get_requests(spider)} == {45}
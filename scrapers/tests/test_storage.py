@@ -0,0 +1,78 @@
+from io import BytesIO
+import os
+
+import pytest
+
+from yelp_scraper import storage
+from yelp_scraper.storage import LocalFSStorageBackend
+
+
+@pytest.fixture
+def fsyncs(monkeypatch):
+    """Paths of fsynced files and directories (read from /proc, linux only)"""
+    synced = []
+    real_fsync = os.fsync
+
+    def fsync(fd):
+        synced.append(os.readlink(f"/proc/self/fd/{fd}"))
+        real_fsync(fd)
+
+    monkeypatch.setattr(storage.os, "fsync", fsync)
+    return synced
+
+
+def test_upload_list_read_delete(tmp_path):
+    backend = LocalFSStorageBackend(str(tmp_path / "store"))
+    backend.upload("reviews/Chicago, IL/0_a.jl.gz", BytesIO(b"chunk 0"))
+    backend.upload("reviews/Chicago, IL/1000_b.jl.gz", BytesIO(b"chunk 1"))
+    backend.upload("reviews/Boston, MA/0_c.jl.gz", BytesIO(b"chunk 2"))
+
+    assert [key for key, _ in backend.list("reviews/Chicago")] == ["reviews/Chicago, IL/0_a.jl.gz",
+                                                                   "reviews/Chicago, IL/1000_b.jl.gz"]
+    assert [key for key, _ in backend.list("reviews/Chicago, IL/1")] == ["reviews/Chicago, IL/1000_b.jl.gz"]
+    assert backend.read("reviews/Chicago, IL/1000_b.jl.gz") == b"chunk 1"
+
+    backend.delete("reviews/Chicago, IL/0_a.jl.gz")
+    assert len(backend.list("reviews/")) == 2
+
+
+def test_upload_leaves_no_temporary_files(tmp_path):
+    backend = LocalFSStorageBackend(str(tmp_path))
+    backend.upload("reviews/Chicago, IL/0_a.jl", BytesIO(b"x" * (3 * 1024 * 1024)))
+
+    assert os.listdir(tmp_path / "reviews" / "Chicago, IL") == ["0_a.jl"]
+    assert backend.read("reviews/Chicago, IL/0_a.jl") == b"x" * (3 * 1024 * 1024)
+
+
+def test_key_outside_root_is_rejected(tmp_path):
+    backend = LocalFSStorageBackend(str(tmp_path / "store"))
+    with pytest.raises(ValueError):
+        backend.upload("../outside.jl", BytesIO(b"chunk"))
+
+
+def test_files_are_fsynced_before_rename_directories_in_batches(tmp_path, fsyncs):
+    backend = LocalFSStorageBackend(str(tmp_path), fsync_every=3)
+    chicago = str(tmp_path / "reviews" / "Chicago, IL")
+    boston = str(tmp_path / "reviews" / "Boston, MA")
+
+    backend.upload("reviews/Chicago, IL/0.jl", BytesIO(b"chunk 0"))
+    backend.upload("reviews/Boston, MA/0.jl", BytesIO(b"chunk 1"))
+    # every file is synced (under its temporary name), no directory yet
+    assert len(fsyncs) == 2
+    assert all(path.endswith(".tmp") for path in fsyncs)
+
+    backend.upload("reviews/Chicago, IL/1.jl", BytesIO(b"chunk 2"))
+    assert sorted(fsyncs[3:]) == [boston, chicago]
+    assert backend.unsynced == 0
+
+    backend.upload("reviews/Boston, MA/1.jl", BytesIO(b"chunk 3"))
+    backend.close()
+    assert fsyncs[-1] == boston
+    assert not backend.unsynced_dirs
+
+
+def test_no_fsync(tmp_path, fsyncs):
+    backend = LocalFSStorageBackend(str(tmp_path), fsync_every=0)
+    backend.upload("reviews/Chicago, IL/0.jl", BytesIO(b"chunk 0"))
+    backend.close()
+    assert fsyncs == []
@@ -0,0 +1,274 @@
+from html import unescape
+import json
+from re import sub
+
+from bs4 import BeautifulSoup
+from lxml.html import fromstring as lxml_fromstring
+import pytest
+import unidecode
+
+from yelp_scraper.utils import extract_json_scripts
+from yelp_scraper.utils import get_menu
+from yelp_scraper.utils import get_menu_lxml
+from yelp_scraper.utils import menu_items_to_remove
+from yelp_scraper.utils import parse_menu_page
+from yelp_scraper.utils import refresh_menu
+from yelp_scraper.utils import preprocess_menu_item
+from yelp_scraper.utils import preprocess_menu_items
+from yelp_scraper.utils import remove_any_brackets
+
+
+HOMEPAGE = b'''<html><head>
+<script type="application/ld+json">{"@type": "Restaurant"}</script>
+<script type="application/json" data-hypernova-key="main"><!--{&quot;bizDetailsPageProps&quot;: {&quot;name&quot;: &quot;Brenda&#39;s &amp; Co&quot;}}--></script>
+<script>var notJson = 1;</script>
+</head><body>
+<SCRIPT TYPE='application/json' data-apollo-state="true"><!--{&quot;a&quot;: [1, 2, &quot;&lt;b&gt;&quot;]}--></SCRIPT>
+<script data-id="x" type="application/json">{"plain": "caf\xc3\xa9"}</script >
+</body></html>'''
+
+
+def bs4_json_scripts(body, encoding="utf-8"):
+    """Payloads the way they were found before `extract_json_scripts`, with
+    a full BeautifulSoup parse of the unescaped page"""
+    text = body.decode(encoding)
+    soup = BeautifulSoup(unescape(text.replace("<!--", "").replace("-->", "")), "html.parser")
+    return [script.string for script in soup.find_all('script', type="application/json")]
+
+
+def test_extract_json_scripts_matches_bs4():
+    payloads = extract_json_scripts(HOMEPAGE)
+    assert payloads == bs4_json_scripts(HOMEPAGE)
+    assert [json.loads(payload) for payload in payloads] == [
+        {"bizDetailsPageProps": {"name": "Brenda's & Co"}},
+        {"a": [1, 2, "<b>"]},
+        {"plain": "café"}]
+
+
+def test_extract_json_scripts_no_scripts():
+    assert extract_json_scripts(b"<html><body><p>closed</p></body></html>") == []
+    assert extract_json_scripts(b"") == []
+
+
+def test_extract_json_scripts_encoding():
+    body = '<script type="application/json">{"name": "café"}</script>'.encode("latin-1")
+    assert json.loads(extract_json_scripts(body, "latin-1")[0]) == {"name": "café"}
+
+
+def reference_preprocess_menu_item(item):
+    """`preprocess_menu_item` before patterns were precompiled and results
+    cached"""
+    item = remove_any_brackets(item).strip()
+    if (len(item) > 70) | (len(item) < 3):
+        return ""
+
+    item = unidecode.unidecode(item + " ")\
+                    .lower()\
+                    .replace(".", ". ")\
+                    .replace("&", "and")\
+                    .replace("-", " ")\
+                    .replace(" w/", " with ")
+    to_remove = [r'\*|\"|\$|#',
+                 r'\d+\s*(lb|pounds|pound|oz|ounces|ounce|inches|inch'
+                 r'|grams|gram|pcs|pieces|piece|each|cup'
+                 r'|bowl|scoops|scoop|pot|liters|liter'
+                 r'|or less|off)\s*((of)*)\.*\s+',
+                 r'\s*\S*[0-9]\S*']
+    for pattern in to_remove:
+        item = sub(pattern, ' ', item)
+
+    item = ' '.join(item.replace(".", "").split())
+    if (len(item) < 3) or (item in menu_items_to_remove):
+        return ""
+    return item
+
+
+MENU_ITEMS = ["Margherita Pizza",
+              "BBQ Chicken Wings (10 pcs)",
+              "Fish & Chips",
+              "Bacon-Wrapped Dates",
+              "Burger w/ Fries",
+              "12 oz. Ribeye Steak",
+              "1/2 lb of Shrimp",
+              "\"Famous\" Hot Dog*",
+              "Crème Brûlée",
+              "Jalapeño Poppers [spicy]",
+              "Soda",
+              "Can Coke",
+              "Lunch A",
+              "St. Louis Ribs",
+              "Combo #3 - Gyro Plate $12.99",
+              "Pho Tái (Rare Steak) 16oz bowl",
+              "ab",
+              "(only brackets)",
+              "  ",
+              "",
+              "x" * 71,
+              "Mac & Cheese w/bacon - 2 scoops of ice cream",
+              "Large 16 inch Pizza",
+              "2 pieces of fried chicken & biscuit"]
+
+
+def test_preprocess_menu_item_matches_reference():
+    for item in MENU_ITEMS:
+        assert preprocess_menu_item(item) == reference_preprocess_menu_item(item), item
+
+
+def test_preprocess_menu_item_examples():
+    assert preprocess_menu_item("Fish & Chips") == "fish and chips"
+    assert preprocess_menu_item("Burger w/ Fries") == "burger with fries"
+    assert preprocess_menu_item("BBQ Chicken Wings (10 pcs)") == "bbq chicken wings"
+    assert preprocess_menu_item("Crème Brûlée") == "creme brulee"
+    assert preprocess_menu_item("Can Coke") == ""
+    assert preprocess_menu_item("x" * 71) == ""
+
+
+def test_preprocess_menu_items_cached():
+    preprocess_menu_item.cache_clear()
+    assert preprocess_menu_items(MENU_ITEMS + MENU_ITEMS) == \
+        [reference_preprocess_menu_item(item) for item in MENU_ITEMS + MENU_ITEMS]
+    assert preprocess_menu_item.cache_info().hits >= len(MENU_ITEMS)
+
+
+MENU_PAGE = """<html><body>
+<div class="sub-menus"><ul>
+  <li><strong> Dinner Menu </strong></li>
+  <li><a href="/menu/brendas/lunch-menu">Lunch Menu</a></li>
+  <li><a href="/menu/brendas/drinks">Drinks</a></li>
+</ul></div>
+<div class="menu-sections">
+  <div class="u-space-b3"><p>Prices may vary</p></div>
+  <div class="section-header section-header--no-spacing"><h2> Starters </h2></div>
+  <div class="u-space-b3">
+    <div class="menu-item arrange">
+      <div class="arrange_unit arrange_unit--fill menu-item-details">
+        <h4>Fried Green Tomatoes</h4>
+        <p class="menu-item-details-description">With remoulade</p>
+      </div>
+      <div class="menu-item-prices arrange_unit">
+        <li class="menu-item-price-amount">\\n  $9.50 </li>
+      </div>
+    </div>
+    <div class="menu-item arrange">
+      <div class="arrange_unit arrange_unit--fill menu-item-details">
+        <h4><a href="/menu/brendas/item/beignets">Crawfish Beignets (3 pcs)</a></h4>
+      </div>
+      <div class="menu-item-prices arrange_unit">
+        <li class="menu-item-price-amount">$12.00</li>
+      </div>
+    </div>
+    <div class="menu-item arrange">
+      <div class="arrange_unit arrange_unit--fill menu-item-details">
+        <h4>Soda</h4>
+      </div>
+      <div class="menu-item-prices arrange_unit"></div>
+    </div>
+  </div>
+  <div class="section-header section-header--no-spacing"><h2>Mains &amp; Plates</h2></div>
+  <div class="u-space-b3">
+    <div class="menu-item arrange">
+      <div class="arrange_unit arrange_unit--fill menu-item-details">
+        <h4>Shrimp &amp; Grits</h4>
+        <p>Creamy <b>cheddar</b> grits</p>
+      </div>
+      <div class="menu-item-prices arrange_unit">
+        <table><tr><td class="menu-item-price-amount">$18</td></tr></table>
+      </div>
+    </div>
+    <div class="menu-item arrange">
+      <div class="arrange_unit arrange_unit--fill menu-item-details">
+        <p>No name</p>
+      </div>
+      <div class="menu-item-prices arrange_unit"></div>
+    </div>
+  </div>
+  <div class="section-header section-header--no-spacing"><h2>Sides</h2></div>
+  <div class="u-space-b3">
+    <div class="menu-item arrange">
+      <div class="arrange_unit arrange_unit--fill menu-item-details">
+        <h4>Can Coke</h4>
+      </div>
+      <div class="menu-item-prices arrange_unit"></div>
+    </div>
+  </div>
+</div>
+</body></html>"""
+
+
+def test_get_menu_lxml_matches_get_menu():
+    menu = get_menu(BeautifulSoup(MENU_PAGE, "html.parser"))
+    assert get_menu_lxml(lxml_fromstring(MENU_PAGE)) == menu
+    assert menu == {
+        "starters" : [{"name" : "fried green tomatoes",
+                       "processed_name" : "fried green tomatoes",
+                       "price" : "$9.50",
+                       "desc" : "With remoulade"},
+                      {"name" : "crawfish beignets (3 pcs)",
+                       "processed_name" : "crawfish beignets",
+                       "price" : "$12.00"}],
+        "mains & plates" : [{"name" : "shrimp & grits",
+                             "processed_name" : "shrimp and grits",
+                             "price" : "$18",
+                             "desc" : "Creamy cheddar grits"}]}
+
+
+def test_get_menu_lxml_matches_get_menu_without_leading_block():
+    page = MENU_PAGE.replace('<div class="u-space-b3"><p>Prices may vary</p></div>', "")
+    menu = get_menu(BeautifulSoup(page, "html.parser"))
+    assert get_menu_lxml(lxml_fromstring(page)) == menu
+    assert list(menu) == ["starters", "mains & plates"]
+
+
+def test_get_menu_lxml_no_menu():
+    page = "<html><body><p>Menu not available</p></body></html>"
+    with pytest.raises(IndexError):
+        get_menu(BeautifulSoup(page, "html.parser"))
+    with pytest.raises(IndexError):
+        get_menu_lxml(lxml_fromstring(page))
+
+
+def test_parse_menu_page_parsers_match():
+    bs4_page = parse_menu_page(MENU_PAGE.encode("utf-8"), parser="bs4")
+    lxml_page = parse_menu_page(MENU_PAGE.encode("utf-8"), parser="lxml")
+    assert bs4_page == lxml_page
+    assert bs4_page["sub_menu_name"] == "dinner-menu"
+    assert bs4_page["sub_menu_urls"] == ["/menu/brendas/lunch-menu", "/menu/brendas/drinks"]
+
+
+@pytest.mark.parametrize("parser", ["bs4", "lxml"])
+def test_parse_menu_page_unchanged(parser):
+    content_hash = parse_menu_page(MENU_PAGE, parser=parser)["content_hash"]
+    assert content_hash is not None
+
+    # rest of the page does not change the fingerprint
+    page = MENU_PAGE.replace("<body>", "<body><script>var ad = 42;</script>")
+    unchanged = parse_menu_page(page, parser=parser, known_hash=content_hash)
+    assert unchanged["unchanged"] and (unchanged["menu"] is None)
+    assert unchanged["sub_menu_urls"] == ["/menu/brendas/lunch-menu", "/menu/brendas/drinks"]
+
+    changed = parse_menu_page(MENU_PAGE.replace("$18", "$19"), parser=parser, known_hash=content_hash)
+    assert not changed["unchanged"]
+    assert changed["menu"]["mains & plates"][0]["price"] == "$19"
+
+
+@pytest.mark.parametrize("parser", ["bs4", "lxml"])
+def test_parse_menu_page_without_menu(parser):
+    parsed_page = parse_menu_page(b"<html><body><p>Menu not available</p></body></html>", parser=parser)
+    assert parsed_page["menu"] is None
+    assert parsed_page["content_hash"] is None
+
+
+def test_refresh_menu_replaces_changed_and_drops_removed():
+    stored_menu = {"dinner-menu" : {"mains" : [1]}, 
+                   "lunch-menu" : {"mains" : [2]}, 
+                   "brunch" : {"mains" : [3]}}
+    scraped_menu = {"lunch-menu" : {"mains" : [4]}}
+
+    assert refresh_menu(stored_menu, scraped_menu, ["dinner-menu", "lunch-menu"]) == \
+        {"dinner-menu" : {"mains" : [1]}, "lunch-menu" : {"mains" : [4]}}
+    # new sub menu, and sub menu not in database (download failed)
+    assert refresh_menu(stored_menu, {"drinks" : {"beer" : [5]}}, ["dinner-menu", "drinks", "kids"]) == \
+        {"dinner-menu" : {"mains" : [1]}, "drinks" : {"beer" : [5]}}
+    # names not known, changed sub menus are merged
+    assert refresh_menu(stored_menu, scraped_menu, None) == {**stored_menu, **scraped_menu}
+    assert refresh_menu({}, scraped_menu, []) == scraped_menu
@@ -0,0 +1,204 @@
+import json
+import os
+from re import sub
+from time import time
+from traceback import print_exc
+
+from scrapy import Spider
+
+from twisted.internet.defer import Deferred
+from twisted.internet.defer import DeferredList
+from twisted.internet.defer import succeed
+from twisted.python.failure import Failure
+
+from yelp_scraper.db import run_flush
+from yelp_scraper.signals import upload_pending_items
+
+
+class ReviewsCheckpointer:
+    """
+    Flush state of finished businesses of `ReviewsSpider` to the database in
+    batches, instead of once when the spider closes.
+
+    A business is finished when its homepage is parsed and all the requests
+    for its reviews are processed. Finished businesses are flushed every
+    `batch_size` businesses or every `interval` seconds (whichever comes
+    first) and are removed from `spider.business_data`, so the memory does
+    not grow with the size of the location.
+
+    Reviews of a business are marked as scraped in the database, so they
+    must be saved before it is flushed. Every flush first sends 
+    `signals.upload_pending_items` and waits till item pipelines (`CSPipeline`)
+    have uploaded all the items received so far, a business is finished only
+    after its last items are yielded.
+
+    Ids of flushed businesses are saved in a checkpoint file. A restarted crawl
+    of the same location skips those businesses, if the file was saved within
+    `max_age` seconds (older files are of some long gone crawl and are 
+    ignored). The file is removed when the crawl finishes normally.
+
+    Flushes are written from a worker thread, so the crawl keeps 
+    downloading meanwhile.
+
+    Parameters
+    ----------
+    spider : Spider
+        Reviews spider, it should provide `business_data`, `get_db_row` and
+        `upload_to_db`
+    batch_size : int
+        Flush when these many businesses are finished
+    interval : float
+        Flush when these many seconds passed since the last flush
+    checkpoint_dir : str
+        Directory for checkpoint file
+    max_age : float
+        Checkpoint file older than these many seconds is ignored
+
+    Attributes
+    ----------
+    finished : list
+        Ids of finished businesses, not flushed yet
+    flushed : set
+        Ids of businesses flushed in this or interrupted previous runs
+    checkpoint_path : str
+        Path of the checkpoint file
+    pending_flushes : set
+        Deferreds of flushes being written
+    """
+
+    def __init__(self,
+                 spider : Spider,
+                 batch_size : int = 200,
+                 interval : float = 300,
+                 checkpoint_dir : str = ".",
+                 max_age : float = 24 * 60 * 60):
+        self.spider = spider
+        self.batch_size = batch_size
+        self.interval = interval
+        self.max_age = max_age
+        self.finished = []
+        self.pending_flushes = set()
+        self.last_flush_time = time()
+
+        location = sub(r'\W+', '_', str(spider.location)).strip('_').lower()
+        self.checkpoint_path = os.path.join(checkpoint_dir,
+                                            f"reviews_spider_checkpoint_{location}.json")
+        self.flushed = self._load_checkpoint()
+
+    def _load_checkpoint(self) -> set:
+        try:
+            with open(self.checkpoint_path) as f:
+                checkpoint = json.load(f)
+        except FileNotFoundError:
+            return set()
+        except:
+            print_exc()
+            return set()
+
+        # files without `saved_at` are from before it was added, stale too
+        age = time() - checkpoint.get("saved_at", 0)
+        if age > self.max_age:
+            print(f"Ignoring checkpoint saved {age / 3600:.1f} hours ago - "
+                  f"{self.checkpoint_path}")
+            return set()
+
+        flushed = set(checkpoint.get("flushed", []))
+        print(f"Resuming from checkpoint - {len(flushed)} businesses already done")
+        return flushed
+
+    def _save_checkpoint(self) -> None:
+        # write and rename, so that a kill in between do not corrupt the file
+        tmp_path = self.checkpoint_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"location" : self.spider.location,
+                       "saved_at" : time(),
+                       "flushed" : sorted(self.flushed)}, f)
+        os.replace(tmp_path, self.checkpoint_path)
+
+    def is_flushed(self, business_id : str) -> bool:
+        return business_id in self.flushed
+
+    def business_finished(self, business_id : str) -> None:
+        """Mark business as finished, flush if batch is full or it's time to"""
+        self.finished.append(business_id)
+
+        if ((len(self.finished) >= self.batch_size)
+                or ((time() - self.last_flush_time) >= self.interval)):
+            self.flush()
+
+    def flush(self) -> Deferred:
+        """Upload finished businesses to database, after their reviews are
+        uploaded by the pipelines, and drop them from memory
+
+        Returns
+        -------
+        Deferred
+            Fires when the businesses are written (or failed)
+        """
+        self.last_flush_time = time()
+        if not self.finished:
+            return DeferredList([])
+
+        business_ids, self.finished = self.finished, []
+        rows = [self.spider.get_db_row(business_id) for business_id in business_ids]
+
+        print(f"Checkpoint - saving {len(rows)} businesses to db")
+        d = self.spider.crawler.signals.send_catch_log_deferred(signal=upload_pending_items,
+                                                               spider=self.spider)
+        d.addCallback(self._upload_rows, rows)
+        d.addCallback(self._flushed, business_ids)
+
+        self.pending_flushes.add(d)
+        d.addBoth(self._flush_done, d)
+        return d
+
+    def _upload_rows(self, pipeline_results : list, rows : list) -> Deferred:
+        if any(isinstance(result, Failure) for _, result in pipeline_results):
+            # reviews may not be saved, so businesses are not either
+            return succeed(False)
+
+        return run_flush(self.spider.upload_to_db, rows)
+
+    def _flushed(self, uploaded : bool, business_ids : list) -> None:
+        if uploaded:
+            for business_id in business_ids:
+                self.spider.business_data.pop(business_id, None)
+
+            self.flushed.update(business_ids)
+            self._save_checkpoint()
+        else:
+            # retry with the next batch
+            self.finished = business_ids + self.finished
+
+    def _flush_done(self, result, d : Deferred):
+        self.pending_flushes.discard(d)
+        return result
+
+    def close(self, reason : str) -> Deferred:
+        """Flush all businesses left (finished or not) when spider closes
+
+        Returns
+        -------
+        Deferred
+            Fires when all the businesses are written
+        """
+        self.flush()
+
+        # businesses being flushed are still in `business_data`
+        d = DeferredList(list(self.pending_flushes))
+        d.addCallback(lambda _: self._flush_remaining(reason))
+        return d
+
+    def _flush_remaining(self, reason : str) -> Deferred:
+        remaining = list(self.spider.business_data)
+        rows = [self.spider.get_db_row(business_id)
+                for business_id
+                in remaining]
+
+        d = run_flush(self.spider.upload_to_db, rows)
+
+        def remove_checkpoint(_):
+            if (reason == "finished") and os.path.exists(self.checkpoint_path):
+                os.remove(self.checkpoint_path)
+
+        return d.addCallback(remove_checkpoint)
@@ -6,6 +6,7 @@ load_dotenv(find_dotenv())
 class GCP:
     BUCKET = getenv('GCP_BUCKET')
     FILE_URL = getenv('GCP_FILE_URL')
+    PARQUET_FILE_URL = getenv('GCP_PARQUET_FILE_URL')
 
 class Postgres:
     PG_DBNAME = getenv('PG_DBNAME', 'yelp')
@@ -14,6 +15,7 @@ class Postgres:
     PG_USER = getenv('PG_USER', 'postgres')
     PG_PWD = getenv('PG_PWD', 'postgres')
     PG_TABLE_NAME = getenv("PG_TABLE_NAME", 'restaurants_info')
+    PG_MENU_FINGERPRINTS_TABLE_NAME = getenv("PG_MENU_FINGERPRINTS_TABLE_NAME", 'menu_fingerprints')
 
 class Crawlera:
     CRAWLERA_APIKEY = getenv('CRAWLERA_APIKEY', 'paste your key here')
@@ -0,0 +1,540 @@
+from contextlib import contextmanager
+from datetime import date
+from datetime import datetime
+from hashlib import sha1
+import json
+from threading import BoundedSemaphore
+from threading import Lock
+from time import perf_counter
+from time import sleep
+from time import time
+from typing import Dict
+from typing import Iterable
+from typing import Iterator
+from typing import List
+from typing import Sequence
+from typing import Union
+from weakref import WeakKeyDictionary
+
+import psycopg2
+from psycopg2 import sql
+from psycopg2.extensions import TRANSACTION_STATUS_IDLE
+from psycopg2.extras import Json
+from psycopg2.pool import PoolError
+from psycopg2.pool import ThreadedConnectionPool
+
+from scrapy.settings import Settings
+
+from twisted.internet.defer import Deferred
+from twisted.internet.threads import deferToThread
+from twisted.python.threadable import isInIOThread
+
+from yelp_scraper.credentials import Postgres
+
+# (table, columns, conflict columns, update columns and expressions) -> statements
+_statements_cache = {}
+# connection -> names of prepared merge statements, they live as long as
+# the connection
+_prepared = WeakKeyDictionary()
+
+_pool = None
+_pool_users = 0
+_pool_lock = Lock()
+
+
+def _escape_copy_text(value : str) -> str:
+    return (value.replace("\\", "\\\\")
+                 .replace("\t", "\\t")
+                 .replace("\n", "\\n")
+                 .replace("\r", "\\r"))
+
+
+def _to_array_literal(values : Sequence) -> str:
+    """Text input of postgres array, like, '{"Pizza","Bars"}' """
+    elements = []
+    for value in values:
+        if value is None:
+            elements.append("NULL")
+        elif isinstance(value, (list, tuple)):
+            elements.append(_to_array_literal(value))
+        else:
+            value = str(value).replace("\\", "\\\\").replace('"', '\\"')
+            elements.append(f'"{value}"')
+
+    return "{" + ",".join(elements) + "}"
+
+
+def to_copy_value(value) -> str:
+    """Value in text format of `COPY`, `\\N` is NULL"""
+    if value is None:
+        return "\\N"
+    elif isinstance(value, bool):
+        return "t" if value else "f"
+    elif isinstance(value, Json):
+        value = value.dumps(value.adapted)
+    elif isinstance(value, dict):
+        value = json.dumps(value)
+    elif isinstance(value, (list, tuple)):
+        value = _to_array_literal(value)
+    elif isinstance(value, (datetime, date)):
+        value = value.isoformat()
+    else:
+        value = str(value)
+
+    return _escape_copy_text(value)
+
+
+class _CopyReader:
+    """File like object over lines of `COPY` data, so rows are streamed to
+    the server without building the whole payload in memory"""
+
+    def __init__(self, lines : Iterator[str]):
+        self.lines = lines
+        self.buffer = ""
+
+    def read(self, size : int = -1) -> str:
+        while (size < 0) or (len(self.buffer) < size):
+            line = next(self.lines, None)
+            if line is None:
+                break
+            self.buffer += line
+
+        if size < 0:
+            data, self.buffer = self.buffer, ""
+        else:
+            data, self.buffer = self.buffer[:size], self.buffer[size:]
+
+        return data
+
+    readline = read
+
+
+def get_columns(rows : Iterable[dict]) -> List[str]:
+    """Union of keys of all the rows, in order of first appearance"""
+    columns = {}
+    for row in rows:
+        for column in row:
+            columns.setdefault(column, None)
+
+    return list(columns)
+
+
+def keep_non_empty(column : str) -> str:
+    """Update expression (see `bulk_upsert`) which keeps the value in the 
+    table when the new value is empty and the old one is not, same as 
+    `utils.merge_two_dictionaries` does for dicts. 
+
+    Empty is NULL, '', 0, false, empty array or empty json (what evaluates 
+    to False in python)
+    """
+    column = '"' + column.replace('"', '""') + '"'
+
+    def is_empty(value : str) -> str:
+        return f"coalesce({value}::text in ('', '0', 'false', '{{{{}}}}', '[]', 'null'), true)"
+
+    return (f"case when {is_empty('excluded.' + column)} "
+                   f"and not {is_empty('{table}.' + column)} "
+              f"then {{table}}.{column} "
+              f"else excluded.{column} end")
+
+
+def connect(autocommit : bool = False):
+    """New connection to the database of `credentials.Postgres`, outside of
+    the pool, for connections used through the whole crawl (see 
+    `fetch_in_batches`), close it when done"""
+    conn = psycopg2.connect(**_connection_params())
+    conn.autocommit = autocommit
+    return conn
+
+
+def _connection_params() -> dict:
+    return dict(host = Postgres.PG_HOST,
+                port = Postgres.PG_PORT,
+                dbname = Postgres.PG_DBNAME,
+                user = Postgres.PG_USER,
+                password = Postgres.PG_PWD)
+
+
+def fetch_in_batches(cursor,
+                     query : str,
+                     params : dict,
+                     key : str = "business_id",
+                     batch_size : int = 2000) -> Iterator:
+    """
+    Rows of `query`, fetched `batch_size` at a time in order of `key` (keyset
+    pagination, `key > last key of previous batch`). Every batch is a short
+    query of its own, so no cursor or transaction is kept open while rows are
+    used, and with an autocommit connection (see `connect`) vacuum is not
+    held back however long a crawl takes.
+
+    Parameters
+    ----------
+    cursor : cursor
+        Cursor to fetch with, row type is of its cursor factory
+    query : str
+        Select with a where clause, condition on `key` is added to it, 
+        parameters are named (`%(name)s`)
+    params : dict
+        Parameters of `query`
+    key : str
+        Unique column, must be in select list of `query`
+    batch_size : int
+        Number of rows fetched at a time
+
+    Yields
+    ------
+    row
+        Rows of `query`, ordered by `key`
+    """
+    last_key = None
+    while True:
+        if last_key is None:
+            batch_query = f"{query} order by {key} limit %(_batch_size)s"
+        else:
+            batch_query = f"{query} and {key} > %(_last_key)s order by {key} limit %(_batch_size)s"
+
+        cursor.execute(batch_query, {**params,
+                                     "_last_key" : last_key,
+                                     "_batch_size" : batch_size})
+        rows = cursor.fetchall()
+
+        yield from rows
+
+        if len(rows) < batch_size:
+            break
+        last_key = rows[-1][key]
+
+
+def _get_statements(table : str,
+                    columns : Sequence[str],
+                    conflict_columns : Sequence[str],
+                    update_columns : Sequence[str],
+                    update_expressions : Dict[str, str]) -> dict:
+    key = (table,
+           tuple(columns),
+           tuple(conflict_columns),
+           tuple(update_columns),
+           tuple(sorted(update_expressions.items())))
+
+    if key not in _statements_cache:
+        signature = sha1(repr(key).encode("utf-8")).hexdigest()[:12]
+        staging_table = sql.Identifier(f"_upsert_{signature}")
+        column_identifiers = sql.SQL(", ").join(map(sql.Identifier, columns))
+
+        set_clauses = []
+        for column in update_columns:
+            if column in update_expressions:
+                expression = sql.SQL(update_expressions[column]).format(table=sql.Identifier(table))
+            else:
+                expression = sql.SQL("excluded.{}").format(sql.Identifier(column))
+            set_clauses.append(sql.SQL("{} = {}").format(sql.Identifier(column), expression))
+
+        if set_clauses:
+            on_conflict = sql.SQL("DO UPDATE SET {}").format(sql.SQL(", ").join(set_clauses))
+        else:
+            on_conflict = sql.SQL("DO NOTHING")
+
+        # staging table has the types of the target columns, without its
+        # constraints, and lives for the whole session (emptied on commit)
+        create = sql.SQL("CREATE TEMP TABLE IF NOT EXISTS {staging} "
+                         "ON COMMIT DELETE ROWS "
+                         "AS SELECT {columns}, 0::int8 AS _upsert_row_number FROM {table} "
+                         "WITH NO DATA").format(staging=staging_table,
+                                                columns=column_identifiers,
+                                                table=sql.Identifier(table))
+
+        copy = sql.SQL("COPY {staging} ({columns}, _upsert_row_number) "
+                       "FROM STDIN").format(staging=staging_table,
+                                            columns=column_identifiers)
+
+        # a row can be staged twice (same business scraped twice),
+        # ON CONFLICT can not update a row twice in a statement, last one wins
+        merge = sql.SQL("INSERT INTO {table} ({columns}) "
+                        "SELECT DISTINCT ON ({conflict}) {columns} "
+                        "FROM {staging} "
+                        "ORDER BY {conflict}, _upsert_row_number DESC "
+                        "ON CONFLICT ({conflict}) {on_conflict}").format(
+                            table=sql.Identifier(table),
+                            columns=column_identifiers,
+                            conflict=sql.SQL(", ").join(map(sql.Identifier, conflict_columns)),
+                            staging=staging_table,
+                            on_conflict=on_conflict)
+
+        _statements_cache[key] = {"name" : f"upsert_{signature}",
+                                  "create" : create,
+                                  "copy" : copy,
+                                  "truncate" : sql.SQL("TRUNCATE {}").format(staging_table),
+                                  "merge" : merge}
+
+    return _statements_cache[key]
+
+
+def bulk_upsert(cursor,
+                table : str,
+                rows : Sequence[Union[dict, Sequence]],
+                columns : Sequence[str] = None,
+                conflict_columns : Sequence[str] = ("business_id",),
+                update_columns : Sequence[str] = None,
+                update_expressions : Dict[str, str] = None) -> int:
+    """
+    Insert or update rows of a table, rows are streamed with `COPY` into a
+    temporary staging table and merged with a single
+    `INSERT ... SELECT ... ON CONFLICT`.
+
+    Statements are built once per column signature, and the merge is
+    prepared once per connection. The caller commits (or rolls back).
+
+    Parameters
+    ----------
+    cursor : cursor
+        Cursor of the connection to write with
+    table : str
+        Table to upsert into
+    rows : list of dict (or items) or list of tuples
+        Rows to upsert, missing keys of a dict are NULL
+    columns : list of str
+        Columns of the rows, default - keys of all the rows (see
+        `get_columns`), required if rows are tuples
+    conflict_columns : list of str
+        Columns of the unique constraint (default `business_id`)
+    update_columns : list of str
+        Columns updated on conflict, default - all the columns except
+        `conflict_columns`
+    update_expressions : dict
+        column -> SQL expression to update the column with on conflict,
+        instead of `excluded.column`, `{table}` is replaced by the quoted
+        table name, like,
+        `"coalesce({table}.menu, '{{}}'::jsonb) || excluded.menu"`
+
+    Returns
+    -------
+    int
+        Number of rows written (inserted or updated)
+    """
+    if not rows:
+        return 0
+
+    if columns is None:
+        columns = get_columns(rows)
+    columns = list(columns)
+    if update_columns is None:
+        update_columns = [column for column in columns if column not in conflict_columns]
+    statements = _get_statements(table,
+                                 columns,
+                                 conflict_columns,
+                                 update_columns,
+                                 update_expressions or {})
+
+    def copy_lines():
+        for row_number, row in enumerate(rows):
+            if isinstance(row, (list, tuple)):
+                values = row
+            else:
+                values = [row.get(column) for column in columns]
+            yield "\t".join([*map(to_copy_value, values), str(row_number)]) + "\n"
+
+    start = perf_counter()
+
+    cursor.execute(statements["create"])
+    # staging table is emptied on commit, but not on rollback
+    cursor.execute(statements["truncate"])
+    cursor.copy_expert(statements["copy"], _CopyReader(copy_lines()))
+
+    prepared = _prepared.setdefault(cursor.connection, set())
+    if statements["name"] not in prepared:
+        # PREPARE is not undone by rollback, so it is done once
+        cursor.execute(sql.SQL("PREPARE {} AS {}").format(sql.Identifier(statements["name"]),
+                                                          statements["merge"]))
+        prepared.add(statements["name"])
+    cursor.execute(sql.SQL("EXECUTE {}").format(sql.Identifier(statements["name"])))
+    num_rows = cursor.rowcount
+
+    elapsed = perf_counter() - start
+    print(f"Upserted {num_rows} rows into {table} in {elapsed:.2f} s "
+          f"({len(rows) / max(elapsed, 1e-6):.0f} rows/s)")
+
+    return num_rows
+
+
+class ConnectionPool:
+    """
+    Pool of long lived connections to the database of `credentials.Postgres`,
+    shared by all the crawlers (and threads) of the process, see
+    `get_pool` and `extensions.DatabasePool`.
+
+    Connections are opened when first needed. A connection idle for more than
+    `check_interval` seconds is checked (`SELECT 1`) before it is handed out,
+    a broken connection is closed and replaced by a new one. Connecting is
+    retried `connect_retries` times, so a restart of the database does not
+    fail the crawl.
+
+    Parameters
+    ----------
+    min_connections : int
+        Connections kept open when idle
+    max_connections : int
+        Maximum connections open at a time, `getconn` waits for a free one
+        (only in worker threads, see `getconn`)
+    check_interval : float
+        Seconds a connection can be idle before it is checked
+    connect_retries : int
+        Number of times connecting is retried
+    """
+
+    def __init__(self,
+                 min_connections : int = 1,
+                 max_connections : int = 4,
+                 check_interval : float = 30,
+                 connect_retries : int = 3):
+        self.min_connections = min_connections
+        self.max_connections = max_connections
+        self.check_interval = check_interval
+        self.connect_retries = connect_retries
+        self.pool = None
+        self.last_used = WeakKeyDictionary()
+        self._lock = Lock()
+        self._slots = BoundedSemaphore(max_connections)
+
+    @classmethod
+    def from_settings(cls, settings : Settings) -> "ConnectionPool":
+        return cls(min_connections=settings.getint('DB_POOL_MIN_CONNECTIONS', 1),
+                   max_connections=settings.getint('DB_POOL_MAX_CONNECTIONS', 4),
+                   check_interval=settings.getfloat('DB_POOL_CHECK_INTERVAL', 30),
+                   connect_retries=settings.getint('DB_POOL_CONNECT_RETRIES', 3))
+
+    def _get_pool(self) -> ThreadedConnectionPool:
+        with self._lock:
+            if self.pool is None:
+                self.pool = ThreadedConnectionPool(self.min_connections,
+                                                   self.max_connections,
+                                                   **_connection_params())
+            return self.pool
+
+    def _is_healthy(self, conn) -> bool:
+        if conn.closed:
+            return False
+
+        if (time() - self.last_used.get(conn, 0)) < self.check_interval:
+            return True
+
+        try:
+            if conn.info.transaction_status != TRANSACTION_STATUS_IDLE:
+                conn.rollback()
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            return False
+
+    def getconn(self):
+        """Healthy connection from the pool, give it back with `putconn`
+
+        In a worker thread it waits for a free connection. In the reactor 
+        thread it never waits, nothing could give a connection back while the
+        reactor is blocked, `PoolError` is raised if none is free. Database 
+        work should run in a worker thread, see `run_flush`.
+        """
+        if isInIOThread():
+            if not self._slots.acquire(blocking=False):
+                raise PoolError("No free connection in the pool, the reactor "
+                                "thread can not wait for one (use run_flush)")
+        else:
+            self._slots.acquire()
+
+        try:
+            return self._connect()
+        except:
+            self._slots.release()
+            raise
+
+    def _connect(self):
+        for attempt in range(self.connect_retries + 1):
+            try:
+                pool = self._get_pool()
+                conn = pool.getconn()
+                if self._is_healthy(conn):
+                    return conn
+
+                print("Database connection broken, reconnecting")
+                pool.putconn(conn, close=True)
+                return pool.getconn()
+            except psycopg2.OperationalError:
+                if attempt == self.connect_retries:
+                    raise
+                print(f"Could not connect to database, retrying ({attempt + 1}/{self.connect_retries})")
+                sleep(2 ** attempt)
+
+    def putconn(self, conn, close : bool = False) -> None:
+        """Give a connection back to the pool, uncommitted changes are
+        rolled back"""
+        close = close or bool(conn.closed)
+        if not close:
+            try:
+                if conn.info.transaction_status != TRANSACTION_STATUS_IDLE:
+                    conn.rollback()
+                self.last_used[conn] = time()
+            except (psycopg2.OperationalError, psycopg2.InterfaceError):
+                close = True
+
+        try:
+            if self.pool is None:
+                # pool closed while the connection was in use
+                conn.close()
+            else:
+                self.pool.putconn(conn, close=close)
+        finally:
+            self._slots.release()
+
+    @contextmanager
+    def connection(self):
+        """Connection from the pool, committed when the block ends, rolled
+        back if it raises"""
+        conn = self.getconn()
+        try:
+            yield conn
+            conn.commit()
+        finally:
+            self.putconn(conn)
+
+    def closeall(self) -> None:
+        with self._lock:
+            if self.pool is not None:
+                self.pool.closeall()
+                self.pool = None
+
+
+def get_pool(settings : Settings) -> ConnectionPool:
+    """Connection pool of the process, created on first call, closed when
+    every caller released it (`release_pool`)"""
+    global _pool, _pool_users
+
+    with _pool_lock:
+        if _pool is None:
+            _pool = ConnectionPool.from_settings(settings)
+        _pool_users += 1
+        return _pool
+
+
+def release_pool() -> None:
+    global _pool, _pool_users
+
+    with _pool_lock:
+        _pool_users -= 1
+        if (_pool_users <= 0) and (_pool is not None):
+            _pool.closeall()
+            _pool = None
+            _pool_users = 0
+
+
+def run_flush(fn, *args) -> Deferred:
+    """Run db write `fn(*args)` in a thread of reactor's pool, so the crawl 
+    keeps downloading while it is written, and waiting for a free connection
+    (see `ConnectionPool.getconn`) never blocks the reactor
+
+    Returns
+    -------
+    Deferred
+        Fires with the return value of `fn` in the reactor thread
+    """
+    return deferToThread(fn, *args)
@@ -0,0 +1,246 @@
+from collections import defaultdict
+import gzip
+from io import BytesIO
+from time import perf_counter
+from typing import List
+from typing import Tuple
+from typing import Union
+
+from scrapy.exporters import JsonLinesItemExporter
+
+# codec of json lines chunks -> file extension, chunks are decompressed by it
+# (see `scripts/compact_reviews.py`)
+CODEC_EXTENSIONS = {"gzip" : ".gz", "zstd" : ".zst", "none" : ""}
+
+
+def load_zstd_dictionary(path : str):
+    """Load zstd dictionary trained by `scripts/train_zstd_dictionary.py`"""
+    import zstandard
+
+    with open(path, "rb") as f:
+        return zstandard.ZstdCompressionDict(f.read())
+
+
+class _CountingWriter:
+    """File like wrapper counting bytes written (before compression)"""
+
+    def __init__(self, file):
+        self.file = file
+        self.size = 0
+
+    def write(self, data : bytes) -> int:
+        self.size += len(data)
+        return self.file.write(data)
+
+
+class JsonLinesChunkWriter:
+    """
+    Write items of a chunk as json lines into an in memory file, compressing
+    them as they arrive, instead of serializing and compressing the whole 
+    chunk at once when it is full.
+
+    Parameters
+    ----------
+    codec : str
+        "gzip", "zstd" (needs `zstandard`) or "none"
+    level : int or None
+        Compression level, None - default of the codec (gzip 6, zstd 3)
+    zstd_dict : ZstdCompressionDict or None
+        Dictionary for zstd, trained on reviews text it improves compression
+        of small chunks a lot
+
+    Attributes
+    ----------
+    count : int
+        Number of items written to the chunk
+    raw_size : int
+        Bytes of json lines written (before compression)
+    compress_time : float
+        Seconds spent in serializing and compressing items
+    extension : str
+        File extension of the codec, like, ".gz"
+    """
+
+    def __init__(self, 
+                 codec : str = "gzip", 
+                 level : Union[int, None] = None, 
+                 zstd_dict = None):
+        self.codec = codec
+        self.fileobj = BytesIO()
+
+        if codec == "gzip":
+            self.file = gzip.GzipFile(mode='wb', 
+                                      fileobj=self.fileobj, 
+                                      compresslevel=6 if level is None else level)
+        elif codec == "zstd":
+            # imported here, so that zstandard is needed only for zstd chunks
+            import zstandard
+
+            compressor = zstandard.ZstdCompressor(level=3 if level is None else level,
+                                                  dict_data=zstd_dict)
+            self.file = compressor.stream_writer(self.fileobj)
+        elif codec == "none":
+            self.file = self.fileobj
+        else:
+            raise ValueError(f"Unknown codec - {codec}")
+
+        self.extension = CODEC_EXTENSIONS[codec]
+
+        self.counting_file = _CountingWriter(self.file)
+        self.exporter = JsonLinesItemExporter(self.counting_file)
+        self.exporter.start_exporting()
+        self.count = 0
+        self.compress_time = 0
+
+    @property
+    def raw_size(self) -> int:
+        return self.counting_file.size
+
+    @property
+    def size(self) -> int:
+        """Compressed bytes of the chunk so far (compressors keep some bytes
+        buffered, so it is a bit less than the final size)"""
+        return self.fileobj.tell()
+
+    def write(self, item) -> None:
+        start = perf_counter()
+        self.exporter.export_item(item)
+        self.count += 1
+        self.compress_time += perf_counter() - start
+
+    def finish(self) -> List[Tuple[dict, BytesIO]]:
+        """Finish the chunk
+
+        Returns
+        -------
+        list of (dict, BytesIO)
+            Single file object (at position 0) to upload, partition 
+            parameter `ext` is extension of the codec
+        """
+        start = perf_counter()
+        self.exporter.finish_exporting()
+
+        if self.codec == "gzip":
+            self.file.close()  # writes gzip trailer
+        elif self.codec == "zstd":
+            # ends zstd frame, without closing `fileobj`
+            import zstandard
+            self.file.flush(zstandard.FLUSH_FRAME)
+
+        self.compress_time += perf_counter() - start
+
+        # Seek to the top of file
+        self.fileobj.seek(0)
+
+        return [({'ext' : self.extension}, self.fileobj)]
+
+
+class ParquetChunkWriter:
+    """
+    Buffer `Review` items of a chunk column wise and write them as Parquet
+    files, one file per (location, month of review) partition, so that
+    analytics jobs can read only the columns and partitions they need.
+
+    `business_id`, `business_alias`, `business_location` and `business_name`
+    are dictionary encoded, `date` is stored as date32. Needs `pyarrow`.
+
+    Parameters
+    ----------
+    compression : str
+        Parquet compression codec, like, "snappy", "gzip", "zstd"
+
+    Attributes
+    ----------
+    count : int
+        Number of items written to the chunk
+    raw_size : int
+        Approximate bytes of the items (length of text fields)
+    compress_time : float
+        Seconds spent in writing Parquet files
+    """
+
+    dictionary_columns = ['business_id', 
+                          'business_alias', 
+                          'business_location', 
+                          'business_name']
+
+    def __init__(self, compression : str = "snappy"):
+        # imported here, so that pyarrow is needed only for Parquet output
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        self.pa = pa
+        self.pq = pq
+        self.compression = compression
+        self.schema = pa.schema([('review_id', pa.string()),
+                                 ('review', pa.string()),
+                                 ('date', pa.date32()),
+                                 ('rating', pa.int8()),
+                                 ('sentiment', pa.int8()),
+                                 ('business_id', pa.string()),
+                                 ('business_alias', pa.string()),
+                                 ('business_location', pa.string()),
+                                 ('business_name', pa.string())])
+        self.columns = {name : [] for name in self.schema.names}
+        self.count = 0
+        self.raw_size = 0
+        self.compress_time = 0
+
+    @property
+    def size(self) -> int:
+        """Approximate size of the chunk, files are written only when chunk is
+        finished, so it is size of the items (Parquet files are smaller)"""
+        return self.raw_size
+
+    def write(self, item) -> None:
+        for name, values in self.columns.items():
+            value = item.get(name)
+            values.append(value)
+            if isinstance(value, str):
+                self.raw_size += len(value)
+        self.count += 1
+
+    def finish(self) -> List[Tuple[dict, BytesIO]]:
+        """Finish the chunk
+
+        Returns
+        -------
+        list of (dict, BytesIO)
+            File object (at position 0) for each partition, with partition
+            parameters `city` (location of business) and `month` (of 
+            review, like, 2020-08)
+        """
+        start = perf_counter()
+        pa = self.pa
+
+        partitions = defaultdict(list)
+        for i, (location, date) in enumerate(zip(self.columns['business_location'],
+                                                 self.columns['date'])):
+            month = date.strftime('%Y-%m') if date is not None else 'unknown'
+            partitions[(location, month)].append(i)
+
+        arrays = []
+        for field in self.schema:
+            array = pa.array(self.columns[field.name], type=field.type)
+            if field.name in self.dictionary_columns:
+                array = array.dictionary_encode()
+            arrays.append(array)
+
+        table = pa.Table.from_arrays(arrays, names=self.schema.names)
+
+        files = []
+        for (location, month), indices in partitions.items():
+            partition_table = (table.take(pa.array(indices)) 
+                               if len(partitions) > 1 
+                               else table)
+
+            fileobj = BytesIO()
+            self.pq.write_table(partition_table, 
+                                fileobj, 
+                                compression=self.compression,
+                                use_dictionary=self.dictionary_columns)
+            fileobj.seek(0)
+            files.append(({'city' : location, 'month' : month}, fileobj))
+
+        self.compress_time += perf_counter() - start
+        return files
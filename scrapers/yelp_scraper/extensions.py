@@ -0,0 +1,28 @@
+from scrapy import signals
+from scrapy.crawler import Crawler
+
+from yelp_scraper.db import get_pool
+from yelp_scraper.db import release_pool
+
+
+class DatabasePool:
+    """
+    Extension to share the process wide database connection pool (see
+    `db.ConnectionPool`) with spiders and pipelines as `crawler.db_pool`.
+
+    Crawlers of all the locations running in the process use the same pool,
+    it is closed when the last of them stops.
+    """
+
+    def __init__(self, crawler : Crawler):
+        self.crawler = crawler
+        crawler.db_pool = get_pool(crawler.settings)
+
+    @classmethod
+    def from_crawler(cls, crawler : Crawler) -> "DatabasePool":
+        extension = cls(crawler)
+        crawler.signals.connect(extension.engine_stopped, signal=signals.engine_stopped)
+        return extension
+
+    def engine_stopped(self) -> None:
+        release_pool()
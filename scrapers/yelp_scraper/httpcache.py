@@ -0,0 +1,286 @@
+import os
+import pickle
+import sqlite3
+from threading import Lock
+from time import time
+from typing import Union
+from urllib.parse import urlparse
+import zlib
+
+from scrapy import Spider
+from scrapy.http import Request
+from scrapy.http import Response
+from scrapy.http.headers import Headers
+from scrapy.responsetypes import responsetypes
+from scrapy.settings import Settings
+from scrapy.utils.project import data_path
+
+
+def get_page_type(url : str) -> str:
+    """Type of yelp page from its url, used to pick TTL of cached page
+
+    Returns
+    -------
+    str
+        one of "snippet" (search listing), "review_feed", "menu", "homepage"
+        or "other"
+    """
+    path = urlparse(url).path
+
+    if path.startswith("/search/snippet"):
+        return "snippet"
+    elif path.endswith("/review_feed"):
+        return "review_feed"
+    elif path.startswith("/menu/"):
+        return "menu"
+    elif path.startswith("/biz/"):
+        return "homepage"
+    else:
+        return "other"
+
+
+# path -> cache file open in the process, see `_SqliteCache`
+_caches = {}
+_caches_lock = Lock()
+
+
+class _SqliteCache:
+    """
+    Connection to a cache file, shared by storages of all the crawlers of the
+    process (see `SqliteCacheStorage.open_spider`), so crawlers of parallel
+    locations do not wait for each other's locks and size of the cache is
+    tracked once.
+
+    Every write is committed right away, so the write lock is held only for a
+    single statement. Accessed times of cache hits are only used to pick
+    responses to evict, they are kept in memory and written in batches of
+    `touch_every`.
+    """
+
+    def __init__(self, path : str, timeout : float, touch_every : int):
+        self.path = path
+        self.touch_every = touch_every
+        self.users = 0
+        self.accessed = {} # fingerprint -> accessed_at, not written yet
+
+        self.db = sqlite3.connect(path, timeout=timeout)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute("CREATE TABLE IF NOT EXISTS responses ("
+                            "fingerprint TEXT PRIMARY KEY, "
+                            "page_type TEXT NOT NULL, "
+                            "stored_at REAL NOT NULL, "
+                            "accessed_at REAL NOT NULL, "
+                            "size INTEGER NOT NULL, "
+                            "data BLOB NOT NULL)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS responses_accessed_at_idx "
+                        "ON responses (accessed_at)")
+        self.db.commit()
+
+        self.size = self.db.execute("SELECT coalesce(sum(size), 0) "
+                                    "FROM responses").fetchone()[0]
+
+    def touch(self, fingerprint : str, accessed_at : float) -> None:
+        self.accessed[fingerprint] = accessed_at
+        if len(self.accessed) >= self.touch_every:
+            self.write_accessed()
+
+    def write_accessed(self) -> None:
+        if not self.accessed:
+            return
+
+        accessed, self.accessed = self.accessed, {}
+        try:
+            self.db.executemany("UPDATE responses SET accessed_at = ? WHERE fingerprint = ?",
+                                [(accessed_at, fingerprint)
+                                 for fingerprint, accessed_at
+                                 in accessed.items()])
+            self.db.commit()
+        except sqlite3.OperationalError as e:
+            # file locked by another process, only order of eviction suffers
+            self.db.rollback()
+            print(f"HTTP cache - could not update accessed times ({e})")
+
+    def close(self) -> None:
+        self.write_accessed()
+        self.db.close()
+
+
+def _open_cache(path : str, timeout : float, touch_every : int) -> _SqliteCache:
+    with _caches_lock:
+        cache = _caches.get(path)
+        if cache is None:
+            cache = _caches[path] = _SqliteCache(path, timeout, touch_every)
+        cache.users += 1
+        return cache
+
+
+def _close_cache(cache : _SqliteCache) -> None:
+    with _caches_lock:
+        cache.users -= 1
+        if cache.users <= 0:
+            _caches.pop(cache.path, None)
+            cache.close()
+
+
+class SqliteCacheStorage:
+    """
+    HTTP cache storage which keeps all the responses zlib compressed in a
+    single SQLite file (`HTTPCACHE_DIR/httpcache.sqlite`), instead of a
+    directory per response like `FilesystemCacheStorage`.
+
+    Every page type (see `get_page_type`) has its own TTL, from
+    `HTTPCACHE_PAGE_TYPE_TTLS`, `HTTPCACHE_EXPIRATION_SECS` is used for types
+    not listed there (0 - never expires).
+
+    Size of the cache is bounded by `HTTPCACHE_SQLITE_MAX_SIZE` (bytes of
+    compressed responses, 0 - unbounded), least recently used responses are
+    evicted first.
+
+    Pages whose content changes while their url does not are cached under
+    the url and `request.meta["httpcache_version"]`, like, review_feed pages
+    (`start=20` are other reviews once new ones are posted) with the number
+    of reviews of the business. A cached page of another version is not
+    used.
+
+    All the spiders share the file, so the pages cached by one run are used
+    by the next runs of any spider. Spiders running in the same process
+    (parallel locations) share one connection to it (see `_SqliteCache`).
+    If the file is locked by another process for more than 
+    `HTTPCACHE_SQLITE_TIMEOUT` seconds, the page is not cached.
+    """
+
+    def __init__(self, settings : Settings):
+        self.cachedir = data_path(settings['HTTPCACHE_DIR'], createdir=True)
+        self.expiration_secs = settings.getint('HTTPCACHE_EXPIRATION_SECS')
+        self.page_type_ttls = settings.getdict('HTTPCACHE_PAGE_TYPE_TTLS')
+        self.max_size = settings.getint('HTTPCACHE_SQLITE_MAX_SIZE')
+        self.compression_level = settings.getint('HTTPCACHE_SQLITE_COMPRESSION_LEVEL', 6)
+        self.timeout = settings.getfloat('HTTPCACHE_SQLITE_TIMEOUT', 5)
+        self.touch_every = settings.getint('HTTPCACHE_SQLITE_TOUCH_EVERY', 100)
+        self.cache = None
+        self._fingerprint = None
+
+    def open_spider(self, spider : Spider) -> None:
+        dbpath = os.path.join(self.cachedir, "httpcache.sqlite")
+        self.cache = _open_cache(dbpath, self.timeout, self.touch_every)
+
+        fingerprinter = getattr(spider.crawler, 'request_fingerprinter', None)
+        if fingerprinter is not None:
+            self._fingerprint = lambda request: fingerprinter.fingerprint(request).hex()
+        else:
+            from scrapy.utils.request import request_fingerprint
+            self._fingerprint = request_fingerprint
+
+        print(f"HTTP cache - {dbpath} ({self.cache.size / 1024**2:.1f} MB)")
+
+    def close_spider(self, spider : Spider) -> None:
+        _close_cache(self.cache)
+        self.cache = None
+
+    def get_ttl(self, page_type : str) -> int:
+        return int(self.page_type_ttls.get(page_type, self.expiration_secs))
+
+    def get_key(self, request : Request) -> str:
+        key = self._fingerprint(request)
+        version = request.meta.get("httpcache_version")
+        if version is not None:
+            key = f"{key}:{version}"
+
+        return key
+
+    def retrieve_response(self,
+                          spider : Spider,
+                          request : Request) -> Union[Response, None]:
+        """Cached response of the request, None if not cached or expired"""
+        key = self.get_key(request)
+        try:
+            row = self.cache.db.execute("SELECT page_type, stored_at, data "
+                                        "FROM responses WHERE fingerprint = ?",
+                                        (key,)).fetchone()
+        except sqlite3.OperationalError as e:
+            print(f"HTTP cache - could not read {request.url} ({e})")
+            return None
+
+        if row is None:
+            return None
+
+        page_type, stored_at, data = row
+        ttl = self.get_ttl(page_type)
+        now = time()
+        if 0 < ttl < (now - stored_at):
+            return None # expired, overwritten by the fresh response
+
+        self.cache.touch(key, now)
+
+        data = pickle.loads(zlib.decompress(data))
+        url = data['url']
+        headers = Headers(data['headers'])
+        respcls = responsetypes.from_args(headers=headers, url=url)
+        return respcls(url=url,
+                       headers=headers,
+                       status=data['status'],
+                       body=data['body'])
+
+    def store_response(self,
+                       spider : Spider,
+                       request : Request,
+                       response : Response) -> None:
+        key = self.get_key(request)
+        data = {'status' : response.status,
+                'url' : response.url,
+                'headers' : dict(response.headers),
+                'body' : response.body}
+        data = zlib.compress(pickle.dumps(data, protocol=4), self.compression_level)
+
+        cache = self.cache
+        try:
+            old_size = cache.db.execute("SELECT size FROM responses WHERE fingerprint = ?",
+                                        (key,)).fetchone()
+            now = time()
+            cache.db.execute("INSERT OR REPLACE INTO responses "
+                             "(fingerprint, page_type, stored_at, accessed_at, size, data) "
+                             "VALUES (?, ?, ?, ?, ?, ?)",
+                             (key, get_page_type(response.url), now, now, len(data), data))
+            cache.db.commit()
+        except sqlite3.OperationalError as e:
+            # file locked by another process, the page is downloaded again
+            # next time
+            cache.db.rollback()
+            print(f"HTTP cache - could not store {response.url} ({e})")
+            return
+
+        cache.accessed.pop(key, None)
+        cache.size += len(data) - (old_size[0] if old_size else 0)
+
+        if 0 < self.max_size < cache.size:
+            self.evict()
+
+    def evict(self) -> None:
+        """Delete least recently used responses till the cache is 90% of its
+        max size"""
+        cache = self.cache
+        # order of eviction needs the latest accessed times
+        cache.write_accessed()
+
+        target_size = int(self.max_size * 0.9)
+        to_delete = []
+        freed = 0
+        for fingerprint, size in cache.db.execute("SELECT fingerprint, size "
+                                                  "FROM responses "
+                                                  "ORDER BY accessed_at"):
+            if (cache.size - freed) <= target_size:
+                break
+            to_delete.append((fingerprint,))
+            freed += size
+
+        try:
+            cache.db.executemany("DELETE FROM responses WHERE fingerprint = ?", to_delete)
+            cache.db.commit()
+        except sqlite3.OperationalError as e:
+            cache.db.rollback()
+            print(f"HTTP cache - could not evict responses ({e})")
+            return
+
+        cache.size -= freed
+        print(f"HTTP cache - evicted {len(to_delete)} responses ({freed / 1024**2:.1f} MB)")
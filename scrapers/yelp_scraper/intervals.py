@@ -0,0 +1,149 @@
+from re import compile
+from typing import Iterable
+from typing import Iterator
+from typing import List
+from typing import Tuple
+
+
+# one range of postgres range/multirange text output, like, "[0,20)"
+_PG_RANGE_PATTERN = compile(r'([\[\(])\s*(-?\d*)\s*,\s*(-?\d*)\s*([\]\)])')
+
+
+class IntervalSet:
+    """Set of integers stored as sorted, non overlapping half open ranges
+
+    Used to keep track of review indexes, like, reviews that need to be scraped
+    (`errors_at`) or reviews scraped in the current run. Ranges are half open
+    ie (start, stop) contains `start` till `stop - 1`, same as python's
+    `range`.
+
+    Parameters
+    ----------
+    ranges : iterable of (int, int)
+        Half open ranges, can be unsorted, overlapping or empty
+
+    Attributes
+    ----------
+    ranges : list of (int, int)
+        Sorted, non overlapping and non adjacent half open ranges
+
+    Example:
+    IntervalSet([(40, 60), (0, 20), (10, 25)]).ranges -> [(0, 25), (40, 60)]
+
+    In the database interval set is stored as postgres `int4multirange`, see
+    `from_pg` and `to_pg`.
+    """
+
+    def __init__(self, ranges : Iterable[Tuple[int, int]] = ()):
+        self.ranges = self._coalesce(ranges)
+
+    @staticmethod
+    def _coalesce(ranges : Iterable[Tuple[int, int]]) -> List[Tuple[int, int]]:
+        """Sort ranges and merge overlapping or adjacent ranges, empty ranges
+        are dropped"""
+        coalesced = []
+        for start, stop in sorted((start, stop)
+                                  for start, stop
+                                  in ranges
+                                  if start < stop):
+            if coalesced and start <= coalesced[-1][1]:
+                coalesced[-1] = (coalesced[-1][0], max(coalesced[-1][1], stop))
+            else:
+                coalesced.append((start, stop))
+
+        return coalesced
+
+    @classmethod
+    def from_inclusive(cls, ranges : Iterable[Tuple[int, int]]) -> "IntervalSet":
+        """Create interval set from ranges with inclusive end, like, `errors_at`
+        [(0, 19), (40, 47)]"""
+        return cls((start, end + 1) for start, end in ranges)
+
+    def to_inclusive(self) -> List[Tuple[int, int]]:
+        """Ranges with inclusive end, like, `errors_at` [(0, 19), (40, 47)]"""
+        return [(start, stop - 1) for start, stop in self.ranges]
+
+    @classmethod
+    def from_pg(cls, value : str) -> "IntervalSet":
+        """Create interval set from text output of postgres multirange (or 
+        range), like, "{[0,20),[40,48)}" or "{}"
+
+        Bounds can be inclusive or exclusive, unbounded ranges are not 
+        supported.
+        """
+        ranges = []
+        for lower_bound, lower, upper, upper_bound in _PG_RANGE_PATTERN.findall(value or ""):
+            start = int(lower) + (1 if lower_bound == "(" else 0)
+            stop = int(upper) + (1 if upper_bound == "]" else 0)
+            ranges.append((start, stop))
+
+        return cls(ranges)
+
+    def to_pg(self) -> str:
+        """Text input of postgres `int4multirange`, like, "{[0,20),[40,48)}" """
+        return "{" + ",".join(f"[{start},{stop})" 
+                              for start, stop 
+                              in self.ranges) + "}"
+
+    def shift(self, delta : int) -> "IntervalSet":
+        """Move all ranges by `delta`
+
+        New reviews are added at the start of the reviews list (sorted by
+        date), so indexes of old reviews move by number of new reviews.
+        """
+        return IntervalSet((start + delta, stop + delta) 
+                           for start, stop 
+                           in self.ranges)
+
+    def add(self, start : int, stop : int) -> None:
+        """Add half open range (start, stop) to the set"""
+        self.ranges = self._coalesce(self.ranges + [(start, stop)])
+
+    def union(self, other : "IntervalSet") -> "IntervalSet":
+        return IntervalSet(self.ranges + other.ranges)
+
+    def subtract(self, other : "IntervalSet") -> "IntervalSet":
+        """Integers in this set but not in `other`"""
+        remaining = []
+        other_ranges = other.ranges
+        i = 0
+        for start, stop in self.ranges:
+            # skip ranges of `other` which end before this range
+            while i < len(other_ranges) and other_ranges[i][1] <= start:
+                i += 1
+
+            j = i
+            while j < len(other_ranges) and other_ranges[j][0] < stop:
+                other_start, other_stop = other_ranges[j]
+                if other_start > start:
+                    remaining.append((start, other_start))
+                start = max(start, other_stop)
+                j += 1
+
+            if start < stop:
+                remaining.append((start, stop))
+
+        return IntervalSet(remaining)
+
+    def intersection(self, other : "IntervalSet") -> "IntervalSet":
+        return self.subtract(self.subtract(other))
+
+    __or__ = union
+    __sub__ = subtract
+    __and__ = intersection
+
+    def __iter__(self) -> Iterator[Tuple[int, int]]:
+        return iter(self.ranges)
+
+    def __len__(self) -> int:
+        """Number of integers in the set"""
+        return sum(stop - start for start, stop in self.ranges)
+
+    def __bool__(self) -> bool:
+        return bool(self.ranges)
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, IntervalSet) and self.ranges == other.ranges
+
+    def __repr__(self) -> str:
+        return f"IntervalSet({self.ranges})"
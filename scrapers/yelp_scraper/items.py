@@ -24,4 +24,4 @@ class Business(Item):
     location = Field()
     categories = Field()
     phone_number = Field()
-    # address_line1 = Field()
\ No newline at end of file
+    address_line1 = Field()
\ No newline at end of file
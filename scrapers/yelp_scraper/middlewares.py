@@ -0,0 +1,26 @@
+from scrapy import Spider
+from scrapy.exceptions import IgnoreRequest
+from scrapy.http import Request
+
+
+class ListingSaturationMiddleware:
+    """
+    Downloader middleware to drop pending search listing requests of a
+    listing (location, sortby) that stopped paging.
+
+    All the pages of a listing are requested at once by `BusinessSpider`,
+    when the listing saturates (recent pages have only already scraped
+    businesses) its remaining requests are still waiting in the scheduler.
+    Those are dropped here before being downloaded.
+
+    Requests without `listing` in meta are not touched.
+    """
+
+    def process_request(self, request : Request, spider : Spider) -> None:
+        listing = request.meta.get("listing")
+
+        if (listing is not None) and hasattr(spider, "get_listing_stream"):
+            if spider.get_listing_stream(*listing).get("saturated"):
+                raise IgnoreRequest(f"Listing saturated - {request.url}")
+
+        return None
@@ -0,0 +1,148 @@
+from concurrent.futures import Future
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_all_start_methods
+from multiprocessing import get_context
+from threading import Lock
+from typing import Callable
+from typing import Optional
+
+from scrapy.crawler import Crawler
+from twisted.internet import reactor
+from twisted.internet.defer import Deferred
+from twisted.python.failure import Failure
+
+_process_pool = None
+_process_pool_users = 0
+_process_pool_lock = Lock()
+
+
+def get_process_pool(max_workers : Optional[int] = None) -> ProcessPoolExecutor:
+    """Worker processes of the process, created on first call (with 
+    `max_workers` of the first caller), shut down when every caller released
+    them (`release_process_pool`)
+
+    Workers are not forked from this process, it already runs threads 
+    (reactor thread pool, database and upload pools) and a forked child can
+    deadlock on locks held by them. They are started by a fork server (spawn
+    where there is none) and import the parse functions.
+    """
+    global _process_pool, _process_pool_users
+
+    with _process_pool_lock:
+        if _process_pool is None:
+            start_method = ("forkserver" 
+                            if "forkserver" in get_all_start_methods() 
+                            else "spawn")
+            _process_pool = ProcessPoolExecutor(max_workers=max_workers,
+                                                mp_context=get_context(start_method))
+        _process_pool_users += 1
+        return _process_pool
+
+
+def release_process_pool() -> None:
+    global _process_pool, _process_pool_users
+
+    with _process_pool_lock:
+        _process_pool_users -= 1
+        if (_process_pool_users <= 0) and (_process_pool is not None):
+            _process_pool.shutdown(wait=False)
+            _process_pool = None
+            _process_pool_users = 0
+
+
+class ParseExecutor:
+    """
+    Run CPU heavy parsing of pages in a pool of worker processes, so that
+    parsing is spread across cores and the reactor thread keeps downloading.
+
+    Parse functions get raw response bytes and must return plain (picklable)
+    data, see `utils.parse_business_homepage` and `utils.parse_menu_page`.
+    Results are delivered through Deferreds, a spider callback can return
+    that Deferred and scrapy will wait for it.
+
+    When `max_pending` pages are waiting to be parsed the engine is paused
+    (no new requests are scheduled), it is resumed when the queue drains to 
+    half of that.
+
+    Worker processes are shared by executors of all the crawlers running in
+    the process (see `get_process_pool`), so parallel locations do not start
+    a pool each. Pending pages are counted per crawler.
+
+    Parameters
+    ----------
+    crawler : Crawler
+        Crawler of the spider, used to pause/unpause the engine
+    max_workers : int or None
+        Number of worker processes (None - number of CPUs), used by the
+        first executor of the process
+    max_pending : int
+        Maximum number of pages waiting to be parsed before scheduling is
+        paused
+    """
+
+    def __init__(self, 
+                 crawler : Crawler, 
+                 max_workers : Optional[int] = None, 
+                 max_pending : int = 64):
+        self.crawler = crawler
+        self.max_pending = max_pending
+        self.pending = 0
+        self.paused = False
+        self.pool = get_process_pool(max_workers)
+
+    @classmethod
+    def from_crawler(cls, crawler : Crawler) -> Optional["ParseExecutor"]:
+        """Create executor from settings, None if `PARSE_EXECUTOR_ENABLED` is
+        False"""
+        settings = crawler.settings
+        if not settings.getbool('PARSE_EXECUTOR_ENABLED'):
+            return None
+
+        return cls(crawler,
+                   max_workers=settings.getint('PARSE_EXECUTOR_WORKERS') or None,
+                   max_pending=settings.getint('PARSE_EXECUTOR_MAX_PENDING', 64))
+
+    def submit(self, fn : Callable, *args) -> Deferred:
+        """Run `fn(*args)` in a worker process
+
+        Returns
+        -------
+        Deferred
+            Fires with the return value of `fn` (or errbacks with its 
+            exception) in the reactor thread
+        """
+        d = Deferred()
+        future = self.pool.submit(fn, *args)
+
+        self.pending += 1
+        if (self.pending >= self.max_pending) and not self.paused:
+            self.paused = True
+            self.crawler.engine.pause()
+
+        # done callback runs in a thread of the pool, not in reactor thread
+        future.add_done_callback(lambda f: reactor.callFromThread(self._done, f, d))
+        return d
+
+    def _done(self, future : Future, d : Deferred) -> None:
+        self.pending -= 1
+        if self.paused and (self.pending <= self.max_pending // 2):
+            self.paused = False
+            self.crawler.engine.unpause()
+
+            # do not wait for engine's heartbeat to schedule next requests
+            slot = getattr(self.crawler.engine, 'slot', None)
+            if slot is not None:
+                slot.nextcall.schedule()
+
+        exception = future.exception()
+        if exception is not None:
+            d.errback(Failure(exception))
+        else:
+            d.callback(future.result())
+
+    def shutdown(self) -> None:
+        """Release worker processes, they are shut down when the last
+        executor of the process is shut down"""
+        if self.pool is not None:
+            self.pool = None
+            release_process_pool()
@@ -1,17 +1,31 @@
-import gzip
+from collections import defaultdict
 from datetime import datetime
-from io import BytesIO
+from time import time
 from traceback import print_exc
+from typing import List
 
-from google.cloud import storage
-import psycopg2
-from psycopg2.extras import execute_values
-
-from scrapy.exporters import JsonLinesItemExporter
+from scrapy.utils.misc import load_object
 from scrapy.utils.project import get_project_settings
 
+from twisted.internet import reactor
+from twisted.internet.defer import Deferred
+from twisted.internet.defer import DeferredList
+from twisted.internet.defer import DeferredSemaphore
+from twisted.internet.defer import gatherResults
+from twisted.internet.defer import succeed
+from twisted.internet.task import LoopingCall
+from twisted.internet.threads import deferToThreadPool
+from twisted.python.threadpool import ThreadPool
+
 from yelp_scraper.credentials import GCP
 from yelp_scraper.credentials import Postgres
+from yelp_scraper.db import bulk_upsert
+from yelp_scraper.db import run_flush
+from yelp_scraper.exporters import CODEC_EXTENSIONS
+from yelp_scraper.exporters import JsonLinesChunkWriter
+from yelp_scraper.exporters import load_zstd_dictionary
+from yelp_scraper.exporters import ParquetChunkWriter
+from yelp_scraper.signals import upload_pending_items
 
 settings = get_project_settings()
 
@@ -21,156 +35,333 @@ class PostgresWriterPipeline:
     Pipeline to store scraped business information or reviews to PostgreSQl
     database
     """
-    def __init__(self):
+    def __init__(self, db_pool):
         super(PostgresWriterPipeline, self).__init__()
         self.items_buffer = []
-        self.conn = None
-        self.cursor = None
-
-    def get_db_connection(self):
-        return psycopg2.connect(host = Postgres.PG_HOST,
-                                port = Postgres.PG_PORT,
-                                dbname = Postgres.PG_DBNAME,
-                                user = Postgres.PG_USER,
-                                password = Postgres.PG_PWD)
-        
-
-    def upload_to_db(self, spider_name : str) -> None:
+        self.db_pool = db_pool
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls(crawler.db_pool)
+
+    def upload_to_db(self, spider_name : str, items : list) -> bool:
+        """Upsert items, runs in a worker thread, see `flush`"""
         try:
-            self.conn = self.get_db_connection()
-            self.cursor = self.conn.cursor()
-
-            if spider_name in ['Businesses', "Businesses_by_Name"]:
-                # The business can be scraped twice - different filter could
-                # give same business - so, removing those duplicates.
-                seen = set()
-                data_to_upload = []
-                for item_dict in self.items_buffer:
-                    if item_dict["business_id"] in seen:
-                        pass
-                    else:
-                        data_to_upload.append(item_dict)
-                        seen.add(item_dict["business_id"])
-
-                print(f"Num of scraped items - {len(data_to_upload)}")
-                # print(f"DO UPDATE SET {', '.join([''.join([str(k), ' = excluded.', str(k)]) for k in data_to_upload[0].keys() if k not in ['location', 'psudo_location', 'query_name']])}")
-                columns_of_data = [k for k in data_to_upload[0].keys() if k not in ['psudo_location', 'query_name']]
-                execute_values(self.cursor, 
-                                (f"INSERT INTO {Postgres.PG_TABLE_NAME} ({', '.join(columns_of_data)}) "
-                                 f"VALUES %s "
-                                 f"ON CONFLICT (business_id) "
-                                 f"DO UPDATE SET {', '.join([''.join([str(k), ' = excluded.', str(k)]) for k in data_to_upload[0].keys() if k not in ['location', 'psudo_location', 'query_name']])}"),
-                               [[value for key, value in item_dict.items() if key not in ["psudo_location", "query_name"]] for item_dict in data_to_upload])
-
-            self.items_buffer = []
+            with self.db_pool.connection() as conn, conn.cursor() as cursor:
+                if spider_name in ['Businesses', "Businesses_by_Name"]:
+                    # The business can be scraped twice - different filter could
+                    # give same business - so, removing those duplicates.
+                    seen = set()
+                    data_to_upload = []
+                    for item_dict in items:
+                        if item_dict["business_id"] in seen:
+                            pass
+                        else:
+                            data_to_upload.append(item_dict)
+                            seen.add(item_dict["business_id"])
+
+                    print(f"Num of scraped items - {len(data_to_upload)}")
+                    columns_of_data = [k for k in data_to_upload[0].keys() if k not in ['psudo_location', 'query_name']]
+                    # location of a business is the location it was first found in
+                    bulk_upsert(cursor,
+                                Postgres.PG_TABLE_NAME,
+                                data_to_upload,
+                                columns=columns_of_data,
+                                update_columns=[k for k in columns_of_data if k not in ['business_id', 'location']])
+            return True
         except:
             print_exc()
             print('exception') 
-        finally:
-            if self.conn:
-                self.conn.commit()
-                self.cursor.close()
-                self.conn.close()
+            return False
+
+    def flush(self, spider_name : str) -> Deferred:
+        items, self.items_buffer = self.items_buffer, []
+
+        def flushed(uploaded):
+            if not uploaded:
+                # retried with the next flush
+                self.items_buffer = items + self.items_buffer
+
+        return (run_flush(self.upload_to_db, spider_name, items)
+                .addCallback(flushed))
 
     def process_item(self, item, spider):
-        # Converting item dict to tuple for bulk upload to db
-        # this will break if order in insert query is not same as order in dict
         self.items_buffer.append(item)
             
         if len(self.items_buffer) >= 1000:
             print("inserting scraped items to db")
-            self.upload_to_db(spider.name)
+            return self.flush(spider.name).addCallback(lambda _: item)
 
         return item
 
     def close_spider(self, spider):
         if self.items_buffer:
             print("inserting scraped items to db")
-            self.upload_to_db(spider.name)
+            return self.flush(spider.name)
 
 
 class CSPipeline:
     """
-    Pipeline to save scraped items to a GCP bucket in gzipped json lines files
-    - Upload data in chunks (default chunk size = 1000)
+    Pipeline to save scraped items to a GCP bucket (or other storage backend, 
+    `REVIEWS_STORAGE_BACKEND`) in compressed (gzip/zstd) json lines files or 
+    in Parquet files partitioned by location and month (`REVIEWS_EXPORT_FORMAT`)
+    - Upload data in chunks of about `BUCKET_MAX_CHUNK_BYTES` bytes, but not
+      more than `BUCKET_MAX_CHUNK_SIZE` items (default = 1000)
     - Save files in bucket with name folder name being name of location
+    - Items are buffered separately for each location (and business, with
+      `BUCKET_PARTITION_BY_BUSINESS`), so one crawl can scrape many locations.
+      When all the buffers together have more than `BUCKET_MAX_BUFFER_BYTES`
+      bytes the largest are uploaded first, buffers older than 
+      `BUCKET_MAX_CHUNK_AGE` seconds are uploaded even if not full
+    - Items are compressed as they arrive, full chunks are uploaded in a
+      pool of `BUCKET_UPLOAD_THREADS` threads, so the crawl does not wait for
+      uploads. At most `BUCKET_MAX_PENDING_UPLOADS` chunks are uploaded (or
+      waiting to be uploaded) at a time, items wait when all are busy.
+    - On `signals.upload_pending_items` (sent before the spider saves its
+      state to db) all the buffered chunks are uploaded, so reviews marked
+      as scraped in db are never only in memory.
     """
 
     def __init__(self):
-        self.bucket_name = GCP.BUCKET
-        self.object_key_template = GCP.FILE_URL
+        self.export_format = settings.get('REVIEWS_EXPORT_FORMAT', 'jsonlines')
+        if self.export_format == 'parquet':
+            self.object_key_template = (GCP.PARQUET_FILE_URL 
+                                        or settings.get('REVIEWS_PARQUET_FILE_URL'))
+        else:
+            self.object_key_template = GCP.FILE_URL or settings.get('REVIEWS_FILE_URL')
 
         self.max_chunk_size = settings.getint('BUCKET_MAX_CHUNK_SIZE', 1000)
-        self.use_gzip = settings.getbool('WANT_TO_GZIP', 
-                                         self.object_key_template.endswith('.gz'))
-
-        self.storage_client = storage.Client()
-        self.items = []
-        self.chunk_number = 0
+        self.max_chunk_bytes = settings.getint('BUCKET_MAX_CHUNK_BYTES', 0)
+
+        self.codec = settings.get('BUCKET_COMPRESSION', 'gzip')
+        if ((self.export_format != 'parquet') 
+                and ('{ext}' not in self.object_key_template)
+                and not self._has_codec_extension(self.object_key_template)):
+            # chunks are read back by the extension (`scripts/compact_reviews.py`)
+            raise ValueError(f"Object key template should end with "
+                             f"'{CODEC_EXTENSIONS.get(self.codec)}' or have {{ext}} "
+                             f"for {self.codec} chunks - {self.object_key_template}")
+        self.compression_level = (settings.getint('BUCKET_COMPRESSION_LEVEL') 
+                                  if settings.get('BUCKET_COMPRESSION_LEVEL') is not None
+                                  else None)
+        self.zstd_dict = None
+        if (self.codec == 'zstd') and settings.get('BUCKET_ZSTD_DICTIONARY'):
+            self.zstd_dict = load_zstd_dictionary(settings.get('BUCKET_ZSTD_DICTIONARY'))
+
+        self.parquet_compression = settings.get('PARQUET_COMPRESSION', 'snappy')
+
+        self.storage = (load_object(settings.get('REVIEWS_STORAGE_BACKEND'))
+                            .from_settings(settings))
+
+        self.upload_pool = ThreadPool(minthreads=0,
+                                      maxthreads=settings.getint('BUCKET_UPLOAD_THREADS', 4),
+                                      name='CSPipeline')
+        self.upload_slots = DeferredSemaphore(settings.getint('BUCKET_MAX_PENDING_UPLOADS', 8))
+        # uploads in flight, removed when they finish
+        self.uploads = set()
+
+        self.partition_by_business = settings.getbool('BUCKET_PARTITION_BY_BUSINESS')
+        if self.partition_by_business and ('{business}' not in self.object_key_template):
+            raise ValueError("Object key template should have {business} "
+                             "to partition by business")
+
+        self.max_buffer_bytes = settings.getint('BUCKET_MAX_BUFFER_BYTES', 0)
+        self.max_chunk_age = settings.getfloat('BUCKET_MAX_CHUNK_AGE', 0)
+        self.age_check = None
+
+        # partition key (location, business or None) -> writer of its chunk
+        self.writers = {}
+        self.writers_started_at = {}
+        # partition key -> number of items uploaded
+        self.chunk_numbers = defaultdict(int)
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        pipeline = cls()
+        crawler.signals.connect(pipeline.upload_pending_items, 
+                                signal=upload_pending_items)
+        return pipeline
+
+    def _has_codec_extension(self, object_key_template : str) -> bool:
+        extension = CODEC_EXTENSIONS.get(self.codec, "")
+        other_extensions = [other 
+                            for other 
+                            in CODEC_EXTENSIONS.values() 
+                            if other and (other != extension)]
+        return (object_key_template.endswith(extension)
+                and not any(object_key_template.endswith(other) 
+                            for other 
+                            in other_extensions))
+
+    def open_spider(self, spider):
+        self.upload_pool.start()
+
+        if self.max_chunk_age > 0:
+            self.age_check = LoopingCall(self._upload_old_chunks, spider)
+            self.age_check.start(min(self.max_chunk_age / 4, 60), now=False)
+
+    def _make_writer(self):
+        if self.export_format == 'parquet':
+            return ParquetChunkWriter(self.parquet_compression)
+
+        return JsonLinesChunkWriter(self.codec, self.compression_level, self.zstd_dict)
+
+    def _get_partition_key(self, item) -> tuple:
+        return (item.get('business_location'), 
+                item.get('business_id') if self.partition_by_business else None)
 
     def process_item(self, item, spider):
-        self.items.append(item)
-        self.city = item.get('business_location')
-        if len(self.items) >= self.max_chunk_size:
-            self._upload_chunk(spider)
+        key = self._get_partition_key(item)
+        writer = self.writers.get(key)
+        if writer is None:
+            writer = self.writers[key] = self._make_writer()
+            self.writers_started_at[key] = time()
 
-        return item
+        writer.write(item)
 
-    def close_spider(self, spider):
-        # Upload remained items to CS.
-        self._upload_chunk(spider)
+        started = []
+        if ((writer.count >= self.max_chunk_size)
+                or (0 < self.max_chunk_bytes <= writer.size)):
+            started.append(self._upload_chunk(spider, key))
 
-    def _upload_chunk(self, spider):
-        if not self.items:
-            print('No reviews scraped!')
-            return  # Do nothing when items is empty.
+        if self.max_buffer_bytes > 0:
+            started.extend(self._upload_largest_chunks(spider))
 
-        f = self._make_fileobj()
+        if started:
+            # item is done when its chunks got upload slots
+            return gatherResults(started).addCallback(lambda _: item)
 
-        # Build object key by replacing variables in object key template.
-        object_key = self.object_key_template.format(**self._get_uri_params(spider))
-        print(object_key)
+        return item
 
-        try:
-            # assuming bucket exists
-            bucket = self.storage_client.get_bucket(self.bucket_name)
-            blob = bucket.blob(object_key)
-            blob.upload_from_file(f)
-            
-        except:
-            print('pipeline CS fail')
-            raise
-        else:
-            print('pipeline CS success')
-        finally:
-            # Prepare for the next chunk
-            self.chunk_number += len(self.items)
-            self.items = []
+    def _upload_largest_chunks(self, spider) -> List[Deferred]:
+        """Upload largest chunks till all the buffers fit in memory cap"""
+        started = []
+        buffered_bytes = sum(writer.size for writer in self.writers.values())
+        for key, writer in sorted(self.writers.items(), 
+                                  key=lambda key_writer: key_writer[1].size, 
+                                  reverse=True):
+            if buffered_bytes <= self.max_buffer_bytes:
+                break
+            buffered_bytes -= writer.size
+            started.append(self._upload_chunk(spider, key))
+
+        return started
+
+    def _upload_old_chunks(self, spider) -> None:
+        now = time()
+        for key, started_at in list(self.writers_started_at.items()):
+            if (now - started_at) >= self.max_chunk_age:
+                self._upload_chunk(spider, key)
+
+    def close_spider(self, spider) -> Deferred:
+        if (self.age_check is not None) and self.age_check.running:
+            self.age_check.stop()
+
+        if not (self.writers or self.chunk_numbers):
+            print('No reviews scraped!')
 
-    def _get_uri_params(self, spider):
+        # Upload remained items to CS and wait for all the uploads.
+        d = self.upload_pending_items(spider)
+        d.addCallback(lambda _: deferToThreadPool(reactor, 
+                                                  self.upload_pool, 
+                                                  self.storage.close))
+
+        def stop_upload_pool(result):
+            # failure of last uploads or of `storage.close` is passed on
+            self.upload_pool.stop()
+            return result
+
+        d.addBoth(stop_upload_pool)
+        return d
+
+    def upload_pending_items(self, spider) -> Deferred:
+        """Upload chunks of all the partitions
+
+        Returns
+        -------
+        Deferred
+            Fires when these and all the other uploads started so far are 
+            finished
+        """
+        d = gatherResults([self._upload_chunk(spider, key) 
+                           for key 
+                           in list(self.writers)])
+        # only uploads still in flight, finished ones are already removed
+        d.addCallback(lambda _: DeferredList(list(self.uploads)))
+        return d
+
+    def _upload_chunk(self, spider, key : tuple) -> Deferred:
+        """Finish and upload the chunk of a partition in upload pool
+
+        Returns
+        -------
+        Deferred
+            Fires when upload is started (an upload slot is free)
+        """
+        writer = self.writers.pop(key, None)
+        self.writers_started_at.pop(key, None)
+        if (writer is None) or (writer.count == 0):
+            return succeed(None)  # Do nothing when items is empty.
+
+        uri_params = self._get_uri_params(spider, key)
+
+        # Prepare for the next chunk
+        self.chunk_numbers[key] += writer.count
+
+        def start_upload(_):
+            d = deferToThreadPool(reactor, 
+                                  self.upload_pool, 
+                                  self._upload_writer, 
+                                  writer, 
+                                  uri_params)
+            self.uploads.add(d)
+
+            def finished(_):
+                self.upload_slots.release()
+                self.uploads.discard(d)
+
+            d.addErrback(lambda failure: failure.printTraceback())
+            d.addBoth(finished)
+
+        return self.upload_slots.acquire().addCallback(start_upload)
+
+    def _upload_writer(self, writer, uri_params):
+        # runs in a thread of upload pool
+        files = writer.finish()
+
+        compressed_size = sum(len(f.getvalue()) for _, f in files)
+        print(f"chunk {uri_params['chunk']} - {writer.count} items, "
+              f"{writer.raw_size / 1e6:.2f} MB -> {compressed_size / 1e6:.2f} MB "
+              f"(ratio {writer.raw_size / max(compressed_size, 1):.1f}) "
+              f"in {writer.compress_time:.2f} s")
+
+        for partition_params, f in files:
+            # Build object key by replacing variables in object key template.
+            object_key = self.object_key_template.format(**{**uri_params, 
+                                                            **partition_params})
+            print(object_key)
+
+            try:
+                self.storage.upload(object_key, f)
+            except:
+                print('pipeline CS fail')
+                print_exc()
+                self._save_failed_file(object_key, f)
+            else:
+                print('pipeline CS success')
+
+    def _save_failed_file(self, object_key, f):
+        # keep file which could not be uploaded, so that it is not lost
+        file_name = "cs_pipeline_failed_" + object_key.replace("/", "_")
+        with open(file_name, "wb") as failed_file:
+            failed_file.write(f.getvalue())
+        print(f"chunk saved to {file_name}")
+
+    def _get_uri_params(self, spider, key : tuple):
         params = {}
-        params['city'] = self.city
-        params['chunk'] = self.chunk_number
+        params['city'], params['business'] = key
+        params['chunk'] = self.chunk_numbers[key]
         params['time'] = datetime.utcnow().replace(microsecond=0) \
                                           .isoformat() \
                                           .replace(':', '-')
         return params
-
-    def _make_fileobj(self):
-        fileobj = BytesIO()
-        f = gzip.GzipFile(mode='wb', fileobj=fileobj) if self.use_gzip else fileobj
-
-        # Build file object using ItemExporter
-        exporter = JsonLinesItemExporter(f)
-        exporter.start_exporting()
-        for item in self.items:
-            exporter.export_item(item)
-        exporter.finish_exporting()
-
-        if f is not fileobj:
-            f.close()  # Close the file if GzipFile
-
-        # Seek to the top of file
-        fileobj.seek(0)
-
-        return fileobj
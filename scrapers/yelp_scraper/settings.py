@@ -10,8 +10,114 @@ SPIDER_MODULES = ['yelp_scraper.spiders']
 NEWSPIDER_MODULE = 'yelp_scraper.spiders'
 
 # GCP Bucket
+# Chunk is uploaded when it has about `BUCKET_MAX_CHUNK_BYTES` (compressed) 
+# bytes or `BUCKET_MAX_CHUNK_SIZE` items, whichever comes first
 BUCKET_MAX_CHUNK_SIZE = 1000
-WANT_TO_GZIP = True
+BUCKET_MAX_CHUNK_BYTES = 8 * 1024 * 1024
+# Codec of json lines chunks - 'gzip', 'zstd' (needs zstandard) or 'none'. 
+# Level of None is codec's default (gzip 6, zstd 3). zstd can use a 
+# dictionary trained on reviews (`scripts/train_zstd_dictionary.py`). 
+# Compression ratio and time of every chunk is printed
+BUCKET_COMPRESSION = 'gzip'
+BUCKET_COMPRESSION_LEVEL = None
+BUCKET_ZSTD_DICTIONARY = None
+# Items are buffered per location (and per business if 
+# `BUCKET_PARTITION_BY_BUSINESS`, object key template needs `{business}` then).
+# Largest buffers are uploaded when all buffers have more than 
+# `BUCKET_MAX_BUFFER_BYTES` bytes, a buffer is uploaded after 
+# `BUCKET_MAX_CHUNK_AGE` seconds even if it is not full (0 - no limit)
+BUCKET_PARTITION_BY_BUSINESS = False
+BUCKET_MAX_BUFFER_BYTES = 256 * 1024 * 1024
+BUCKET_MAX_CHUNK_AGE = 600
+# Chunks are uploaded in background threads, items wait only when
+# `BUCKET_MAX_PENDING_UPLOADS` chunks are being uploaded
+BUCKET_UPLOAD_THREADS = 4
+BUCKET_MAX_PENDING_UPLOADS = 8
+
+# Where reviews are saved, `yelp_scraper.storage.GCSStorageBackend` (GCP
+# bucket) or `yelp_scraper.storage.LocalFSStorageBackend` (files under
+# `LOCAL_STORAGE_ROOT`, every file is fsynced before it is renamed in place,
+# directories every `LOCAL_STORAGE_FSYNC_EVERY` chunks). 
+# Object keys are made from `GCP_FILE_URL` (or `REVIEWS_FILE_URL` if not set),
+# `{ext}` is extension of the codec, a template without it should end with
+# the extension of `BUCKET_COMPRESSION` (chunks are decompressed by it)
+REVIEWS_STORAGE_BACKEND = 'yelp_scraper.storage.GCSStorageBackend'
+REVIEWS_FILE_URL = 'reviews/{city}/{time}_{chunk}.jl{ext}'
+LOCAL_STORAGE_ROOT = 'reviews_store'
+LOCAL_STORAGE_FSYNC_EVERY = 10
+
+# Format of saved reviews, 'jsonlines' (gzipped json lines chunks) or 
+# 'parquet' (columnar, needs pyarrow). Parquet files are partitioned by 
+# location and month of review, keys are made from `GCP_PARQUET_FILE_URL` 
+# (or `REVIEWS_PARQUET_FILE_URL` if not set)
+REVIEWS_EXPORT_FORMAT = 'jsonlines'
+REVIEWS_PARQUET_FILE_URL = 'reviews_parquet/location={city}/month={month}/{time}_{chunk}.parquet'
+PARQUET_COMPRESSION = 'snappy'
+
+# Business listings
+# Stop paging a (location, sortby) listing when at least 
+# `BUSINESS_SATURATION_RATIO` of its last `BUSINESS_SATURATION_WINDOW` pages 
+# returned only businesses already scraped in the crawl
+BUSINESS_SATURATION_WINDOW = 5
+BUSINESS_SATURATION_RATIO = 0.8
+# Yelp usually serve only first 1000 listings, pages before this are all 
+# requested as soon as the first page of a listing is parsed
+BUSINESS_LISTING_CAP = 1000
+
+# Reviews spider
+# Save finished businesses to db every `REVIEWS_CHECKPOINT_BATCH_SIZE` 
+# businesses or `REVIEWS_CHECKPOINT_INTERVAL` seconds, after their reviews
+# are uploaded. A restarted crawl skips businesses saved by the interrupted
+# crawl, if it was interrupted within `REVIEWS_CHECKPOINT_MAX_AGE` seconds
+# (see `checkpoint.py`)
+REVIEWS_CHECKPOINT_BATCH_SIZE = 200
+REVIEWS_CHECKPOINT_INTERVAL = 300
+REVIEWS_CHECKPOINT_DIR = '.'
+REVIEWS_CHECKPOINT_MAX_AGE = 24 * 60 * 60
+# Skip homepages of businesses with no new reviews (as per latest business 
+# listing) and no errors, unless details are older than 
+# `REVIEWS_MAX_STALENESS_DAYS` days
+REVIEWS_CONDITIONAL_CRAWL = False
+REVIEWS_MAX_STALENESS_DAYS = 14
+
+# Parse homepages and menu pages in a pool of worker processes (see 
+# `yelp_scraper.parse_executor`), so parsing uses all cores and does not block
+# downloads. Crawl is paused while `PARSE_EXECUTOR_MAX_PENDING` pages are 
+# waiting to be parsed. `PARSE_EXECUTOR_WORKERS = 0` - one worker per CPU.
+# Workers are shared by crawlers of all the locations running in parallel
+PARSE_EXECUTOR_ENABLED = False
+PARSE_EXECUTOR_WORKERS = 0
+PARSE_EXECUTOR_MAX_PENDING = 64
+
+# Parser for menu pages, "bs4" (BeautifulSoup) or "lxml" (faster, XPath based)
+MENU_PARSER = 'bs4'
+
+# Menus refresh
+# With `MENU_REFRESH`, menus crawler also checks already scraped menus which 
+# were not checked in last `MENU_REFRESH_DAYS` days. Unchanged pages (same 
+# content hash or 304 response) are not parsed and not written
+MENU_REFRESH = False
+MENU_REFRESH_DAYS = 30
+# `menu_url` of a business is set to NULL (reviews crawler finds the new one)
+# when its menu page has no menu in these many scrapes in a row
+MENU_MAX_PARSE_FAILURES = 3
+
+# Database
+# Connections to the database are pooled (`yelp_scraper.extensions.DatabasePool`)
+# and shared by all spiders and pipelines of the process. Connections idle 
+# for `DB_POOL_CHECK_INTERVAL` seconds are checked before use, broken ones are
+# replaced. Writes run in worker threads, so the crawl is not blocked while
+# they wait for a free connection. With parallel locations, `run_scraper.py`
+# raises the pool size to `DB_POOL_CONNECTIONS_PER_LOCATION` per location
+DB_POOL_MIN_CONNECTIONS = 1
+DB_POOL_MAX_CONNECTIONS = 4
+DB_POOL_CONNECTIONS_PER_LOCATION = 2
+DB_POOL_CHECK_INTERVAL = 30
+DB_POOL_CONNECT_RETRIES = 3
+# Spiders read businesses of a location these many rows at a time (keyset 
+# pagination on their own autocommit connection, no transaction is kept open
+# during the crawl), requests are generated as rows arrive
+DB_CURSOR_ITERSIZE = 2000
 
 # Obey robots.txt rules
 ROBOTSTXT_OBEY = False
@@ -50,6 +156,7 @@ TELNETCONSOLE_ENABLED = False
 # See http://scrapy.readthedocs.org/en/latest/topics/downloader-middleware.html
 # https://github.com/alecxe/scrapy-fake-useragent
 DOWNLOADER_MIDDLEWARES = {
+   'yelp_scraper.middlewares.ListingSaturationMiddleware': 100,
    'scrapy_crawlera.CrawleraMiddleware': 610,
    'scrapy.downloadermiddlewares.useragent.UserAgentMiddleware': None,
    'scrapy.downloadermiddlewares.retry.RetryMiddleware': None,
@@ -63,9 +170,9 @@ FAKEUSERAGENT_FALLBACK = 'Mozilla'
 
 # Enable or disable extensions
 # See http://scrapy.readthedocs.org/en/latest/topics/extensions.html
-#EXTENSIONS = {
-#    'scrapy.extensions.telnet.TelnetConsole': None,
-#}
+EXTENSIONS = {
+    'yelp_scraper.extensions.DatabasePool': 100,
+}
 
 # Configure item pipelines
 # See http://scrapy.readthedocs.org/en/latest/topics/item-pipeline.html
@@ -88,8 +195,23 @@ FAKEUSERAGENT_FALLBACK = 'Mozilla'
 
 # Enable and configure HTTP caching (disabled by default)
 # See http://scrapy.readthedocs.org/en/latest/topics/downloader-middleware.html#httpcache-middleware-settings
-# HTTPCACHE_ENABLED = True
-# HTTPCACHE_EXPIRATION_SECS = 0
-# HTTPCACHE_DIR = 'httpcache'
-# HTTPCACHE_IGNORE_HTTP_CODES = []
-# HTTPCACHE_STORAGE = 'scrapy.extensions.httpcache.FilesystemCacheStorage'
+# Responses are cached in a single compressed SQLite file, see 
+# `yelp_scraper.httpcache.SqliteCacheStorage`. Enable it to make re-runs (after 
+# partial failures) almost free
+HTTPCACHE_ENABLED = False
+HTTPCACHE_EXPIRATION_SECS = 0 # for page types not in HTTPCACHE_PAGE_TYPE_TTLS
+HTTPCACHE_DIR = 'httpcache'
+HTTPCACHE_IGNORE_HTTP_CODES = [403, 429, 500, 502, 503, 504]
+HTTPCACHE_STORAGE = 'yelp_scraper.httpcache.SqliteCacheStorage'
+HTTPCACHE_PAGE_TYPE_TTLS = {
+    'snippet' : 24 * 60 * 60,          # search listings - 1 day
+    'review_feed' : 24 * 60 * 60,      # review pages - 1 day (or till new reviews)
+    'homepage' : 3 * 24 * 60 * 60,     # business homepages - 3 days
+    'menu' : 30 * 24 * 60 * 60,        # menus and sub menus - 30 days
+}
+HTTPCACHE_SQLITE_MAX_SIZE = 5 * 1024 ** 3 # bytes, least recently used are evicted
+# Crawlers of the process share one connection to the file. A page is not 
+# cached if the file is locked (by another process) for `HTTPCACHE_SQLITE_TIMEOUT`
+# seconds. Accessed times of cache hits are written in batches
+HTTPCACHE_SQLITE_TIMEOUT = 5
+HTTPCACHE_SQLITE_TOUCH_EVERY = 100
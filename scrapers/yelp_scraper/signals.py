@@ -0,0 +1,7 @@
+# Signals of the project, sent through `crawler.signals` like scrapy signals
+
+# Sent (with `send_catch_log_deferred`) before scraped state is saved to the
+# database, ie `ReviewsCheckpointer.flush`. Pipelines buffering items
+# handle it by saving all the items received so far, the returned Deferred
+# fires when they are saved. Args - spider
+upload_pending_items = object()
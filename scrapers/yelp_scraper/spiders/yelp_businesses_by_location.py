@@ -1,8 +1,10 @@
+from collections import deque
 from json import loads as json_loads
 from pandas import read_csv
 from scrapy import Request
 from scrapy import Spider
 from scrapy.http import Response
+from scrapy.utils.project import get_project_settings
 
 from traceback import print_exc
 from typing import Generator
@@ -14,25 +16,52 @@ from urllib.parse import urlparse
 
 from yelp_scraper.items import Business
 
+settings = get_project_settings()
+
+
 class BusinessSpider(Spider):
     """Business information scraper class
 
     BusinessSpider provides methods to create requests, parse responses to
     get useful information and save that information to PostgreSQL.
 
+    All the sort orders in `sortby_list` are crawled in the same run. A
+    business already scraped by any sort order is not scraped again, and a
+    sort order stops paging through a location once most of its recent pages
+    returned only already scraped businesses.
+
     Parameters
     ----------
-    location : str
-        Name of the location
+    location_list : list
+        Names of the locations
+    sortby_list : list
+        Sort orders of the search listing, like, "recommended", "rating"
     pages : int or None
         Scrape first `pages` number of pages
 
     Attributes
     ----------
-    location : str
-        Name of the location
+    location_list : list
+        Names of the locations
+    sortby_list : list
+        Sort orders of the search listing
     pages : int or None
         Scrape first `pages` number of pages
+    seen_business_ids : set
+        bizIds of all the businesses scraped in this crawl (by any sort order)
+    listing_streams : dict
+        Paging state of each (location, sortby) listing, see 
+        `get_listing_stream`
+    saturation_window : int
+        Number of most recent pages of a listing used to decide whether to
+        stop paging
+    saturation_ratio : float
+        Stop paging a listing when at least this share of its recent pages
+        returned only already scraped businesses
+    listing_cap : int
+        Yelp usually only serve upto `listing_cap` listings. All the pages 
+        before it are requested at once when the first page of a listing is
+        parsed.
 
     Class Attributes
     ----------------
@@ -45,15 +74,6 @@ class BusinessSpider(Spider):
         in `settings.py` file.
     business_reviews_cutoff : int (>= 0)
         Store only businesses with more than `business_reviews_cutoff` reviews.
-    total_results : int
-        Total restaurants listing for a location
-    results_per_page : int
-        Number of results per response page
-    errors_after_1000_listings : int
-        This is used to keep track of number of errors after 1000 restaurant 
-        listing. Yelp usually only serve upto 1000 listings even if 
-        `total_results` is more than that. If this is more than 3, give up
-        subsequent requests
 
     """
     # X-Crawlera-Error analyse this in response 
@@ -66,9 +86,84 @@ class BusinessSpider(Spider):
         }
     }
     business_reviews_cutoff = 0
-    total_results = None
-    results_per_page = None
-    errors_after_1000_listings = 0
+
+    def __init__(self, *args, **kwargs):
+        super(BusinessSpider, self).__init__(*args, **kwargs)
+        self.location_list = kwargs.get('location_list', [])
+        self.pages = kwargs.get('pages')
+
+        sortby = kwargs.get('sortby')
+        self.sortby_list = kwargs.get('sortby_list', 
+                                      [sortby] if sortby else ['recommended'])
+
+        self.seen_business_ids = set()
+        self.listing_streams = {}
+        self.saturation_window = settings.getint('BUSINESS_SATURATION_WINDOW', 5)
+        self.saturation_ratio = settings.getfloat('BUSINESS_SATURATION_RATIO', 0.8)
+        self.listing_cap = settings.getint('BUSINESS_LISTING_CAP', 1000)
+
+    def get_listing_stream(self, location : str, sortby : str) -> dict:
+        """Paging state of the listing of `location` sorted by `sortby`
+
+        Keys of the state:
+            > total_results - Total restaurants listing for the location
+            > results_per_page - Number of results per response page
+            > errors_after_1000_listings - This is used to keep track of 
+              number of errors after 1000 restaurant listing. Yelp usually 
+              only serve upto 1000 listings even if `total_results` is more 
+              than that. If this is more than 3, give up subsequent requests
+            > recent_pages - for last `saturation_window` pages, whether the
+              page returned only already scraped businesses
+            > saturated - True once the listing stopped paging because of
+              already scraped businesses
+            > fanout_end - listings before this index were all requested at
+              once after the first page of the listing was parsed
+
+        Parameters
+        ----------
+        location : str
+            Name of the location
+        sortby : str
+            Sort order of the listing
+
+        Returns
+        -------
+        dict
+            Paging state of the listing
+        """
+        key = (location, sortby)
+        if key not in self.listing_streams:
+            self.listing_streams[key] = {
+                'total_results' : None,
+                'results_per_page' : None,
+                'errors_after_1000_listings' : 0,
+                'recent_pages' : deque(maxlen=self.saturation_window),
+                'saturated' : False,
+                'fanout_end' : None
+            }
+
+        return self.listing_streams[key]
+
+    def is_listing_saturated(self, listing_stream : dict) -> bool:
+        """Check if most of the recent pages of a listing returned only
+        businesses that were already scraped (by this or other sort order)
+
+        Parameters
+        ----------
+        listing_stream : dict
+            Paging state of the listing, see `get_listing_stream`
+
+        Returns
+        -------
+        bool
+            True if listing should stop paging
+        """
+        recent_pages = listing_stream['recent_pages']
+
+        if len(recent_pages) < self.saturation_window:
+            return False
+
+        return (sum(recent_pages) / len(recent_pages)) >= self.saturation_ratio
 
     def start_requests(self) -> Generator[Request, None, None]:
         """Generator that generates request object for first page of each city
@@ -86,47 +181,54 @@ class BusinessSpider(Spider):
         for location in location_list:
             print(f"location - {location}")
 
-            # generate start url for the given location
-            # choq -> include related restaurants from nearby places
-            params = {
-                'cflt' : 'restaurants',
-                # 'choq': 1,
-                # 'find_desc': "Panera Bread",
-                'find_loc' : location,
-                'sortby' : self.sortby,
-                'start' : 0,
-                'request_origin' : 'user'
-            }
-
-            headers = {
-                'Referer' : (f'https://www.yelp.com/search?cflt=restaurants&'
-                            f'find_desc=&find_loc={"%20".join(location.split())}'
-                            f'sortby={self.sortby}'
-                            f'&start=0')
-            }
-
-            url = f"https://www.yelp.com/search/snippet?{urlencode(params)}"
-            print(f"fetching - {url}")
-            url_list.append(Request(url=url, headers=headers, callback=self.child_parse))
+            for sortby in self.sortby_list:
+                # generate start url for the given location
+                # choq -> include related restaurants from nearby places
+                params = {
+                    'cflt' : 'restaurants',
+                    # 'choq': 1,
+                    # 'find_desc': "Panera Bread",
+                    'find_loc' : location,
+                    'sortby' : sortby,
+                    'start' : 0,
+                    'request_origin' : 'user'
+                }
+
+                headers = {
+                    'Referer' : (f'https://www.yelp.com/search?cflt=restaurants&'
+                                f'find_desc=&find_loc={"%20".join(location.split())}'
+                                f'sortby={sortby}'
+                                f'&start=0')
+                }
+
+                url = f"https://www.yelp.com/search/snippet?{urlencode(params)}"
+                print(f"fetching - {url}")
+                url_list.append(Request(url=url, 
+                                        headers=headers, 
+                                        callback=self.child_parse,
+                                        meta={"listing" : (location, sortby)}))
         
         return url_list 
     
     def create_request(self, 
                        query : dict, 
+                       start : int,
                        results_per_page : int) -> Request:
-        """Create request object for the next page
+        """Create request object for the page of listing starting at `start`
 
         Parameters
         ----------
         query : dict
             query string from the previous request, in dictionary format
+        start : int
+            Index of the first business of the page in the listing
         results_per_page : int
             Number of businesses data received in the previous request
 
         Returns
         -------
         Request
-            A request object for the next page
+            A request object for the page
 
         """
         
@@ -135,8 +237,8 @@ class BusinessSpider(Spider):
             # 'choq': 1,
             # 'find_desc': "Panera Bread",
             'find_loc' : query['find_loc'][0],
-            'sortby' : self.sortby,
-            'start' : int(query['start'][0]) + results_per_page,
+            'sortby' : query['sortby'][0],
+            'start' : start,
             'request_origin' : 'user'
         }
 
@@ -144,13 +246,20 @@ class BusinessSpider(Spider):
             'Referer' : (f'https://www.yelp.com/search?cflt=restaurants&'
                          f'find_desc=&find_loc='
                          f'{"%20".join(query["find_loc"][0].split())}'
-                         f'sortby={self.sortby}'
-                         f'start={int(query["start"][0]) + results_per_page}')
+                         f'sortby={query["sortby"][0]}'
+                         f'start={start}')
         }
         
         url = f"https://www.yelp.com/search/snippet?{urlencode(params)}"
         print(f"fetching - {url}")
-        return Request(url=url, headers=headers, callback=self.child_parse)
+        # earlier pages first, so that saturation of the listing is detected
+        # before its last pages are downloaded
+        return Request(url=url, 
+                       headers=headers, 
+                       callback=self.child_parse,
+                       priority=-(start // results_per_page),
+                       meta={"listing" : (query['find_loc'][0], 
+                                          query['sortby'][0])})
 
 
     def child_parse(self, response : Response) -> Generator[Union[Request, 
@@ -174,6 +283,8 @@ class BusinessSpider(Spider):
         """
         # get query string from the url
         query = parse_qs(urlparse(response.url).query)
+        listing_stream = self.get_listing_stream(query.get('find_loc', [None])[0],
+                                                 query.get('sortby', [None])[0])
 
         # response object is JSON, not html
         try:
@@ -189,6 +300,7 @@ class BusinessSpider(Spider):
 
             # print(f"\nbusiness_dict_list - {business_dict_list}\n")
 
+            num_new_businesses = 0
             for business_dict in business_dict_list:
                 try:
                     business_info = business_dict.get("searchResultBusiness")
@@ -198,6 +310,11 @@ class BusinessSpider(Spider):
                     # if can't find find reviews, don't blow the flow
                     num_reviews = business_info.get('reviewCount', 0)
 
+                    # The business can be listed by more than one sort order, 
+                    # scraping it only once per crawl
+                    if business_dict["bizId"] in self.seen_business_ids:
+                        continue
+
                     # Remove ads and consider business only if num_reviews >= cutoff
                     if (not is_ad) and (num_reviews >= self.business_reviews_cutoff):
                         # The order of this dictionary cannot be changed.
@@ -234,6 +351,8 @@ class BusinessSpider(Spider):
                         business_item["address_line1"] = business_info.get("formattedAddress")
 
                         # print(f"\nitem - {business_item}\n")
+                        self.seen_business_ids.add(business_dict["bizId"])
+                        num_new_businesses += 1
                         yield business_item
                 except:
                     print_exc()
@@ -249,27 +368,55 @@ class BusinessSpider(Spider):
             #                            .get('mainContentComponentsListProps')
             #                            .get('paginationInfo'))
             print(pagination_dict)
-            self.total_results = int(pagination_dict.get('totalResults'))
-            self.results_per_page = int(pagination_dict.get('resultsPerPage'))
+            listing_stream['total_results'] = int(pagination_dict.get('totalResults'))
+            listing_stream['results_per_page'] = int(pagination_dict.get('resultsPerPage'))
+
+            # page with only already scraped businesses (or ads)
+            listing_stream['recent_pages'].append(num_new_businesses == 0)
+            if self.is_listing_saturated(listing_stream):
+                if not listing_stream['saturated']:
+                    print(f"Stop paging - {query.get('find_loc', [None])[0]} "
+                          f"sorted by {query.get('sortby', [None])[0]}, "
+                          f"recent pages have only already scraped businesses")
+                listing_stream['saturated'] = True
 
         except:
             print("Exception!!")
             print_exc()
             if int(query.get('start')[0]) >= 1000:
                 # usually yelp do not serve listing above 1000
-                self.errors_after_1000_listings += 1
+                listing_stream['errors_after_1000_listings'] += 1
 
         finally:
             # url for any subsequent request
             # https://www.yelp.com/search/snippet?find_loc=San%20Francisco&sortby=review_count&start=10&parent_request_id=7ff323db7eff95da&request_origin=user
-            if self.total_results and (self.errors_after_1000_listings < 3):
-                self.errors_after_1000_listings = 0
+            total_results = listing_stream['total_results']
+            results_per_page = listing_stream['results_per_page']
+
+            if (total_results 
+                    and (listing_stream['errors_after_1000_listings'] < 3)
+                    and (not listing_stream['saturated'])):
+                listing_stream['errors_after_1000_listings'] = 0
                 start = int(query.get('start')[0])
+                next_start = start + results_per_page
 
+                # listings to scrape are bounded by `pages`
+                listings_end = total_results
                 if self.pages is not None:
-                    if (((start + self.results_per_page) < self.total_results)
-                            and (((start / self.results_per_page) + 1) < self.pages)):
-                        yield self.create_request(query, self.results_per_page)
-
-                elif (start + self.results_per_page) < self.total_results:
-                    yield self.create_request(query, self.results_per_page)
\ No newline at end of file
+                    listings_end = min(listings_end, self.pages * results_per_page)
+
+                if listing_stream['fanout_end'] is None:
+                    # first page of the listing - request all the remaining 
+                    # pages (upto listing cap) at once
+                    listing_stream['fanout_end'] = min(listings_end, self.listing_cap)
+
+                    for page_start in range(next_start, 
+                                            listing_stream['fanout_end'], 
+                                            results_per_page):
+                        yield self.create_request(query, page_start, results_per_page)
+
+                elif listing_stream['fanout_end'] <= next_start < listings_end:
+                    # last page before listing cap or any page after that.
+                    # yelp usually do not serve listings after 1000, these 
+                    # are requested one at a time until errors pile up
+                    yield self.create_request(query, next_start, results_per_page)
\ No newline at end of file
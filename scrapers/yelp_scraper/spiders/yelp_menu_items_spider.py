@@ -1,10 +1,9 @@
-from bs4 import BeautifulSoup
 from datetime import datetime
+from datetime import timezone
 
 from pickle import dump as pickle_dump
 import psycopg2
 import psycopg2.extras
-from psycopg2.extras import execute_values
 from psycopg2.extras import Json
 
 from scrapy import Request
@@ -14,11 +13,21 @@ from scrapy.utils.project import get_project_settings
 
 from traceback import print_exc
 
+from twisted.internet.defer import Deferred
+
+from typing import Dict
 from typing import Generator
+from typing import List
 from typing import Union
 
 from yelp_scraper.credentials import Postgres
-from yelp_scraper.utils import get_menu
+from yelp_scraper.db import bulk_upsert
+from yelp_scraper.db import connect
+from yelp_scraper.db import fetch_in_batches
+from yelp_scraper.db import run_flush
+from yelp_scraper.parse_executor import ParseExecutor
+from yelp_scraper.utils import parse_menu_page
+from yelp_scraper.utils import refresh_menu
 
 settings = get_project_settings()
 
@@ -41,9 +50,31 @@ class MenuSpider(Spider):
     business_data : dict
         This will store menu_items_scraped_flag for each business.
     conn
-        Database connection object to business information table
+        Database connection (own, autocommit) to fetch businesses to scrape,
+        closed when all the start requests are generated
     cursor
         Cursor for database
+    menu_parser : str
+        Parser for menu pages, "bs4" or "lxml" (`MENU_PARSER` setting)
+    refresh_menus : bool
+        If True, also scrape again menus (already scraped) which were not
+        checked in last `refresh_days` days. Only changed menus and sub menus
+        are parsed, menu in database is replaced by them and the unchanged
+        sub menus (see `utils.refresh_menu`)
+    refresh_days : int
+        Menus are checked for changes after these many days
+    max_parse_failures : int
+        `menu_url` is set to None when its page had no menu in these many 
+        scrapes in a row
+    fingerprints : dict
+        Fingerprints of menu pages (of businesses to scrape) from last scrape,
+        menu_url -> {"business_id", "sub_menu_name", "content_hash", "etag", 
+        "last_modified", "parse_failures"}
+    checked_fingerprints : dict
+        Fingerprints of menu pages downloaded in this run, menu_url -> row of 
+        `menu_fingerprints` table
+    parse_executor : ParseExecutor or None
+        Pool of worker processes to parse pages in, None if disabled
     
 
     Class Attributes
@@ -67,13 +98,17 @@ class MenuSpider(Spider):
         self.menu_data = {}
         self.conn = None # database connection
         self.cursor = None
-
-    def get_db_connection(self):
-        return psycopg2.connect(host = Postgres.PG_HOST,
-                                port = Postgres.PG_PORT,
-                                dbname = Postgres.PG_DBNAME,
-                                user = Postgres.PG_USER,
-                                password = Postgres.PG_PWD)
+        self.parse_executor = None
+        self.menu_parser = kwargs.get('menu_parser') or settings.get('MENU_PARSER', 'bs4')
+        self.refresh_menus = kwargs.get('refresh_menus')
+        if self.refresh_menus is None:
+            self.refresh_menus = settings.getbool('MENU_REFRESH')
+
+        self.refresh_days = int(kwargs.get('refresh_days')
+                                or settings.getint('MENU_REFRESH_DAYS', 30))
+        self.max_parse_failures = settings.getint('MENU_MAX_PARSE_FAILURES', 3)
+        self.fingerprints = {}
+        self.checked_fingerprints = {}
 
     def start_requests(self) -> Generator[Request, None, None]:
         """Generator that generates request object for the menu page of each
@@ -85,123 +120,301 @@ class MenuSpider(Spider):
             A request object for the menu page of a restaurant
 
         """
+        self.parse_executor = ParseExecutor.from_crawler(self.crawler)
 
         try:
-            self.conn = self.get_db_connection()
+            # own connection (not from the pool), it is used till the last 
+            # request is generated, which is close to the end of the crawl
+            self.conn = connect(autocommit=True)
             self.cursor = self.conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
         except:
             print_exc()
             exit(0)
 
-        try:
-            self.cursor.execute((f"select business_id, menu_url "
-                                 f"from {Postgres.PG_TABLE_NAME} "
-                                 f"where location = '{self.location}' "
-                                         f"and menu_url is not null "
-                                         f"and menu_items_scraped_flag = 0"))
+        businesses_query = (f"from {Postgres.PG_TABLE_NAME} "
+                            f"where location = %(location)s "
+                                    f"and menu_url is not null "
+                                    f"and (menu_items_scraped_flag = 0")
+
+        if self.refresh_menus:
+            # scraped menus not checked in last `refresh_days` days
+            businesses_query += (f" or not exists (select 1 "
+                                                  f"from {Postgres.PG_MENU_FINGERPRINTS_TABLE_NAME} f "
+                                                  f"where f.menu_url = {Postgres.PG_TABLE_NAME}.menu_url "
+                                                      f"and f.checked_at > now() - make_interval(days => %(refresh_days)s))")
+        businesses_query += ")"
+        params = {"location" : self.location, 
+                  "refresh_days" : self.refresh_days}
 
+        try:
+            # fingerprints of menu and sub menus of these businesses
+            self.cursor.execute((f"select menu_url, business_id, sub_menu_name, "
+                                        f"content_hash, etag, last_modified, parse_failures "
+                                 f"from {Postgres.PG_MENU_FINGERPRINTS_TABLE_NAME} "
+                                 f"where business_id in (select business_id {businesses_query})"),
+                                params)
+            self.fingerprints = {row.get("menu_url") : dict(row)
+                                 for row
+                                 in self.cursor.fetchall()}
         except:
-            self.cursor.execute("ROLLBACK")
-            self.conn.commit()
-            self.cursor.close()
-            self.conn.close()
             print_exc()
+            self.close_db_connection()
             exit(0)
 
-        db_menu_url_list_dict = self.cursor.fetchall()
+        # rows are fetched `DB_CURSOR_ITERSIZE` at a time while requests are
+        # yielded, no transaction is kept open in between
+        rows = fetch_in_batches(self.cursor,
+                                f"select business_id, menu_url, menu_items_scraped_flag {businesses_query}",
+                                params,
+                                key="business_id",
+                                batch_size=settings.getint('DB_CURSOR_ITERSIZE', 2000))
 
-        if self.conn:
-            self.conn.commit()
-            self.cursor.close()
+        num_menus = 0
+        try:
+            for row in rows:
+                business_id = row.get("business_id")
+                menu_url = row.get("menu_url")
+
+                # only changed sub menus of already scraped menu are parsed
+                self.menu_data[business_id] = {"menu" : {},
+                                               "db_menu_url" : menu_url,
+                                               "refresh" : row.get("menu_items_scraped_flag") == 1}
+                num_menus += 1
+
+                # "https://www.yelp.com/menu/ramuntos-brick-oven-pizza-williston-williston"
+                print(f"Fetching {menu_url}")
+                yield self.create_request(menu_url, business_id, self.parse)
+        except psycopg2.Error:
+            # menus fetched so far are still scraped
+            print_exc()
+        finally:
+            print(f"{num_menus} menus to scrape for {self.location}")
+            self.close_db_connection()
+
+    def close_db_connection(self) -> None:
+        """Close connection of `start_requests`, when all the requests are 
+        generated or the spider is closed"""
+        if (self.conn is not None) and not self.conn.closed:
             self.conn.close()
 
-        for row in db_menu_url_list_dict:
-            business_id = row.get("business_id")
-            menu_url = row.get("menu_url")
+    def create_request(self, 
+                       menu_url : str, 
+                       business_id : str, 
+                       callback) -> Request:
+        """Create request for a menu or sub menu page
 
-            self.menu_data[business_id] = {"menu" : {}}
+        When refreshing a menu, the request is conditional (If-None-Match /
+        If-Modified-Since) if yelp sent ETag / Last-Modified last time, and is
+        not served from HTTP cache.
+
+        Parameters
+        ----------
+        menu_url : str
+            URL of the page (without domain), like, 
+            `/menu/ramuntos-brick-oven-pizza-williston-williston`
+        business_id : str
+            Business id
+        callback
+            `parse` for menu, `child_parse` for sub menu
+
+        Returns
+        -------
+        Request
+            A request object for the page
+        """
+        meta = {"business_id" : business_id,
+                "menu_url" : menu_url}
+        headers = {}
+
+        if self.menu_data[business_id].get("refresh"):
+            meta["dont_cache"] = True
+            meta["handle_httpstatus_list"] = [304]
+
+            fingerprint = self.fingerprints.get(menu_url, {})
+            if fingerprint.get("etag"):
+                headers["If-None-Match"] = fingerprint.get("etag")
+            if fingerprint.get("last_modified"):
+                headers["If-Modified-Since"] = fingerprint.get("last_modified")
+
+        return Request(url="https://www.yelp.com" + menu_url, 
+                       callback=callback,
+                       headers=headers,
+                       meta=meta)
+
+    def get_known_hash(self, response : Response) -> Union[str, None]:
+        """Content hash of the page from last scrape, None if page should be 
+        parsed anyway"""
+        business_id = response.meta.get("business_id")
+        if not self.menu_data[business_id].get("refresh"):
+            return None
+
+        return self.fingerprints.get(response.meta.get("menu_url"), {}).get("content_hash")
+
+    def record_fingerprint(self, 
+                           response : Response, 
+                           parsed_page : dict,
+                           sub_menu_name : Union[str, None] = None,
+                           parse_failures : int = 0) -> None:
+        """Keep fingerprint of downloaded page, to save in database"""
+        if (parsed_page.get("content_hash") is None) and not parse_failures:
+            return
+
+        menu_url = response.meta.get("menu_url")
+        old_fingerprint = self.fingerprints.get(menu_url, {})
+
+        etag = response.headers.get("ETag")
+        last_modified = response.headers.get("Last-Modified")
+
+        self.checked_fingerprints[menu_url] = (
+            menu_url,
+            response.meta.get("business_id"),
+            sub_menu_name or old_fingerprint.get("sub_menu_name"),
+            parsed_page.get("content_hash"),
+            etag.decode("latin-1") if etag else old_fingerprint.get("etag"),
+            last_modified.decode("latin-1") if last_modified else old_fingerprint.get("last_modified"),
+            parse_failures)
+
+    def get_parsed_page(self, response : Response) -> Union[Deferred, dict]:
+        """Parse menu page (see `utils.parse_menu_page`), in a worker process
+        if parse executor is enabled"""
+        known_hash = self.get_known_hash(response)
+
+        if response.status == 304:
+            # not modified, nothing to parse
+            return {"menu" : None, 
+                    "sub_menu_name" : None, 
+                    "sub_menu_urls" : None,
+                    "content_hash" : known_hash, 
+                    "unchanged" : True}
+
+        if self.parse_executor is not None:
+            return self.parse_executor.submit(parse_menu_page, 
+                                              response.body, 
+                                              response.encoding,
+                                              self.menu_parser,
+                                              known_hash)
+
+        return parse_menu_page(response.body, 
+                               response.encoding, 
+                               self.menu_parser, 
+                               known_hash)
 
-            # "https://www.yelp.com/menu/ramuntos-brick-oven-pizza-williston-williston"
-            print(f"Fetching {menu_url}")
-            yield Request(url="https://www.yelp.com" + menu_url, 
-                          callback=self.parse,
-                          meta={"business_id":business_id,
-                                "menu_url":menu_url})
     
-    def parse(self, response : Response) -> Generator[Union[Request, 
-                                                            None] ,
-                                                      None,
-                                                      None]:
-        """Generator function that parses menu page response.
+    def parse(self, response : Response) -> Union[Deferred, List[Request]]:
+        """Parses menu page response.
         
         The parser scrapes following items from menu page:
             > Categories of dishes
             > Dishes within each category
             > Description of dishes - mostly ingredients (if available)
 
+        If parse executor is enabled, page is parsed in a worker process and
+        a Deferred firing with the requests is returned.
+
         Parameters
         ----------
         response 
             Response object of the menu page
 
-        Yields
-        ------
-        Menu
-            A Menu object for the postgres pipeline
+        Returns
+        -------
+        list of Request or Deferred
+            Requests for the sub menus of the business
 
         """
+        parsed_page = self.get_parsed_page(response)
+        if isinstance(parsed_page, Deferred):
+            return parsed_page.addCallback(self.handle_menu_page, response)
 
+        return self.handle_menu_page(parsed_page, response)
+
+    def handle_menu_page(self, 
+                         parsed_page : dict, 
+                         response : Response) -> List[Request]:
+        """Store parsed menu page (see `utils.parse_menu_page`) and create
+        requests for sub menus"""
         business_id = response.meta.get("business_id")
         db_menu_url = response.meta.get("menu_url")
         request_url = response.url
 
-        soup = BeautifulSoup(response.text, "html.parser")
-
-        try:
-            scraped_menu = get_menu(soup)
-        except:
+        if parsed_page.get("unchanged"):
+            print(f"Menu not changed - {request_url}")
+            self.record_fingerprint(response, parsed_page)
+
+            sub_menu_url_list = parsed_page.get("sub_menu_urls")
+            if sub_menu_url_list is None:
+                # not modified response, sub menus from last scrape
+                sub_menu_url_list = [menu_url
+                                     for menu_url, fingerprint
+                                     in self.fingerprints.items()
+                                     if (fingerprint.get("business_id") == business_id)
+                                         and (menu_url != db_menu_url)]
+
+            self.set_sub_menu_names(business_id,
+                                    self.fingerprints.get(db_menu_url, {}).get("sub_menu_name"),
+                                    sub_menu_url_list)
+
+            return [self.create_request(sub_menu_url, business_id, self.child_parse)
+                    for sub_menu_url
+                    in sub_menu_url_list]
+
+        scraped_menu = parsed_page.get("menu")
+        if scraped_menu is None:
+            # no content hash is kept, so the page is parsed again next time
+            parse_failures = self.fingerprints.get(db_menu_url, {}).get("parse_failures", 0) + 1
+            self.record_fingerprint(response, 
+                                    {**parsed_page, "content_hash" : None}, 
+                                    parse_failures=parse_failures)
+
+            if parse_failures < self.max_parse_failures:
+                # a single bad page must not erase the url, menu in database 
+                # is left as it is
+                print()
+                print(f"Could not parse menu ({parse_failures} times in a row), "
+                      f"keeping it as it is - {request_url}")
+                print()
+                return []
+
+            # url is outdated, reviews crawler will update it if business 
+            # has a menu now (see `utils.get_menu`)
             print()
             print(f"Invalid manu url - {request_url}")
             print()
-            scraped_menu = None
             self.menu_data[business_id]["menu"] = None
             self.menu_data[business_id]["menu_url"] = None
             self.menu_data[business_id]["menu_items_scraped_flag"] = 0
-
-        if scraped_menu is not None:
-            try:
-                sub_menu_name_list = [i.text.strip().lower() 
-                                    for i 
-                                    in soup.select('.sub-menus li')]
-
-                if sub_menu_name_list:
-                    sub_menu_name = "-".join((sub_menu_name_list[0]
-                                                    .lower()
-                                                    .replace("/", "-")
-                                                    .split()))
-                else:
-                    sub_menu_name = "menu"
-            except:
-                sub_menu_name = "menu"
-
-            self.menu_data[business_id]["menu"][sub_menu_name] = scraped_menu
-            self.menu_data[business_id]["menu_url"] = db_menu_url
-            self.menu_data[business_id]["menu_items_scraped_flag"] = 1
-
-            try:
-                sub_menu_url_list = [i['href'] 
-                                    for i 
-                                    in soup.select('.sub-menus li a')]
-            except:
-                sub_menu_url_list = []
-
-            for sub_menu_url in sub_menu_url_list:
-                print(f"sub menu {sub_menu_url}")
-                yield Request(url="https://www.yelp.com" + sub_menu_url, 
-                            callback=self.child_parse,
-                            meta={"business_id":business_id})
-
-    def child_parse(self, response : Response):
+            return []
+
+        sub_menu_name = parsed_page.get("sub_menu_name")
+        self.record_fingerprint(response, parsed_page, sub_menu_name)
+        self.menu_data[business_id]["menu"][sub_menu_name] = scraped_menu
+        self.menu_data[business_id]["menu_url"] = db_menu_url
+        self.menu_data[business_id]["menu_items_scraped_flag"] = 1
+        self.set_sub_menu_names(business_id, sub_menu_name, parsed_page.get("sub_menu_urls"))
+
+        requests = []
+        for sub_menu_url in parsed_page.get("sub_menu_urls"):
+            print(f"sub menu {sub_menu_url}")
+            requests.append(self.create_request(sub_menu_url, business_id, self.child_parse))
+
+        return requests
+
+    def set_sub_menu_names(self, 
+                           business_id : str, 
+                           sub_menu_name : Union[str, None], 
+                           sub_menu_url_list : List[str]) -> None:
+        """Keep names of all the sub menus the menu has now, menu page's own
+        and the linked ones, sub menus not in it are removed from a refreshed
+        menu (see `utils.refresh_menu`)"""
+        sub_menu_names = [sub_menu_url.rsplit("/", 1)[-1] 
+                          for sub_menu_url 
+                          in sub_menu_url_list]
+        if sub_menu_name:
+            sub_menu_names.insert(0, sub_menu_name)
+
+        self.menu_data[business_id]["sub_menu_names"] = sub_menu_names
+
+    def child_parse(self, response : Response) -> Union[Deferred, None]:
         """
         Parameters
         ----------
@@ -209,34 +422,154 @@ class MenuSpider(Spider):
             Response object of the menu page
 
         """
+        parsed_page = self.get_parsed_page(response)
+        if isinstance(parsed_page, Deferred):
+            return parsed_page.addCallback(self.handle_sub_menu_page, response)
+
+        return self.handle_sub_menu_page(parsed_page, response)
 
+    def handle_sub_menu_page(self, 
+                             parsed_page : dict, 
+                             response : Response) -> None:
         business_id = response.meta.get('business_id')
-        try:
-            sub_menu_name = response.url.rsplit("/", 1)[-1]
+        sub_menu_name = response.url.rsplit("/", 1)[-1]
 
-            soup = BeautifulSoup(response.text, "html.parser")
+        self.record_fingerprint(response, parsed_page, sub_menu_name)
+        if parsed_page.get("unchanged"):
+            return
 
-            scraped_menu = get_menu(soup)
+        scraped_menu = parsed_page.get("menu")
+        if scraped_menu:
+            self.menu_data[business_id]["menu"][sub_menu_name] = scraped_menu
 
-            if scraped_menu:
-                self.menu_data[business_id]["menu"][sub_menu_name] = scraped_menu
-        except:
-            pass
+            # menu page itself may not have changed
+            self.menu_data[business_id]["menu_url"] = self.menu_data[business_id].get("db_menu_url")
+            self.menu_data[business_id]["menu_items_scraped_flag"] = 1
         
-    def closed(self, reason : str) -> None:
+    def upload_to_db(self, 
+                     values_to_insert : List[tuple], 
+                     fingerprints_to_insert : List[tuple],
+                     refreshed_sub_menus : Dict[str, Union[List[str], None]]) -> bool:
+        """Upsert menus and fingerprints of menu pages, in one transaction, 
+        runs in a worker thread (see `closed`)
+
+        Whole menu of a business is written. Refreshed menus 
+        (`refreshed_sub_menus`, business_id -> names of sub menus the menu has
+        now) were scraped with only the changed sub menus, they are completed
+        with the unchanged sub menus of the menu in database (see 
+        `utils.refresh_menu`) before writing.
+
+        Returns
+        -------
+        bool
+            True if menus and fingerprints are saved in the database
+        """
+        try:
+            conn = self.crawler.db_pool.getconn()
+            cursor = conn.cursor()
+        except:
+            print_exc()
+            return False
+
+        try:
+            stored_menus = {}
+            if refreshed_sub_menus:
+                # locked till commit, so menus are not changed in between
+                cursor.execute(f"select business_id, menu "
+                               f"from {Postgres.PG_TABLE_NAME} "
+                               f"where business_id = any(%s) "
+                               f"for update",
+                               (list(refreshed_sub_menus),))
+                stored_menus = dict(cursor.fetchall())
+
+            rows = []
+            for business_id, business_url, menu_url, menu_items_scraped_flag, menu in values_to_insert:
+                if (menu is not None) and (business_id in refreshed_sub_menus):
+                    menu = refresh_menu(stored_menus.get(business_id) or {},
+                                        menu,
+                                        refreshed_sub_menus[business_id])
+
+                rows.append((business_id,
+                             business_url,
+                             menu_url,
+                             menu_items_scraped_flag,
+                             None if menu is None else Json(menu)))
+
+            bulk_upsert(cursor,
+                        Postgres.PG_TABLE_NAME,
+                        rows,
+                        columns=["business_id",
+                                 "business_url",
+                                 "menu_url",
+                                 "menu_items_scraped_flag",
+                                 "menu"],
+                        update_columns=["menu_url", 
+                                        "menu_items_scraped_flag", 
+                                        "menu"])
+
+            # after menus, so a failed write is retried next time
+            bulk_upsert(cursor,
+                        Postgres.PG_MENU_FINGERPRINTS_TABLE_NAME,
+                        fingerprints_to_insert,
+                        columns=["menu_url",
+                                 "business_id",
+                                 "sub_menu_name",
+                                 "content_hash",
+                                 "etag",
+                                 "last_modified",
+                                 "parse_failures",
+                                 "checked_at",
+                                 "changed_at"],
+                        conflict_columns=["menu_url"],
+                        update_expressions={"changed_at" : ("case when {table}.content_hash "
+                                                                      "is distinct from excluded.content_hash "
+                                                                 "then excluded.checked_at "
+                                                                 "else {table}.changed_at end")})
+            conn.commit()
+            return True
+        except:
+            print_exc()
+            conn.rollback()
+            return False
+
+        finally:
+            cursor.close()
+            self.crawler.db_pool.putconn(conn)
+
+    def closed(self, reason : str) -> Deferred:
         """This function is called when spider closes for any reason.
 
         Saving the `menu_items_scraped_flag` and `menu` in the database.
+        A refreshed menu replaces the menu in database, with its unchanged 
+        sub menus kept, businesses with no changes, failed requests or a
+        menu page without menu (fewer than `max_parse_failures` times in a
+        row) are not written. Fingerprints of all the downloaded pages are 
+        written.
 
         Parameters
         ----------
         reason : str 
             Reason for the closing of spider
 
+        Returns
+        -------
+        Deferred
+            Fires when menus are written, spider waits for it
         """
+        if self.parse_executor is not None:
+            self.parse_executor.shutdown()
+
+        # spider closed before all the requests were generated
+        self.close_db_connection()
+
         if self.menu_data:
             values_to_insert = []
+            refreshed_sub_menus = {}
             for k, v in self.menu_data.items():
+                if "menu_items_scraped_flag" not in v:
+                    # menu unchanged or not downloaded
+                    continue
+
                 # NOTE:
                 # values_to_insert -> [(business_id, 
                 #                       business_url, 
@@ -245,44 +578,32 @@ class MenuSpider(Spider):
                 #                       menu)]
                 # Since `business_url` is `not null` column in db, 
                 # "", acts as placeholder, it will not overwrite value in db
-                if v.get("menu", {}) is None:
-                    menu = None
-                else:
-                    menu = Json(v.get("menu", {}))
-
                 values_to_insert.extend([(k, 
                                           "",
                                           v.get("menu_url"),
                                           v.get("menu_items_scraped_flag", 0), 
-                                          menu)])
+                                          v.get("menu", {}))])
 
-            with open(f"menu_spider_update_data_{datetime.now().strftime('%b_%d_%Y_%H_%M')}.pickle", "wb") as f:
+                if v.get("refresh"):
+                    refreshed_sub_menus[k] = v.get("sub_menu_names")
+
+            fingerprints_to_insert = [(*fingerprint, 
+                                       datetime.now(timezone.utc),
+                                       datetime.now(timezone.utc))
+                                      for fingerprint
+                                      in self.checked_fingerprints.values()]
+
+            file_name = f"menu_spider_update_data_{datetime.now().strftime('%b_%d_%Y_%H_%M')}.pickle"
+            with open(file_name, "wb") as f:
                 pickle_dump(values_to_insert, f)
 
-            try:
-                self.conn = self.get_db_connection()
-                self.cursor = self.conn.cursor()
-            except:
-                print_exc()
-                exit(0)
-
-            try:
-                execute_values(self.cursor, 
-                               (f"INSERT INTO {Postgres.PG_TABLE_NAME} (business_id, "
-                                                                f"business_url, "
-                                                                f"menu_url, "
-                                                                f"menu_items_scraped_flag, "
-                                                                f"menu) "
-                                f"VALUES %s "
-                                f"ON CONFLICT (business_id) "
-                                f"DO UPDATE SET menu_url = excluded.menu_url, "
-                                                f"menu_items_scraped_flag = excluded.menu_items_scraped_flag, "
-                                                f"menu = excluded.menu"), 
-                                values_to_insert)
-            except:
-                print_exc()
-
-            finally:
-                self.conn.commit()
-                self.cursor.close()
-                self.conn.close()
+            def report(uploaded):
+                if not uploaded:
+                    print(f"Could not save menus of {self.location} to db, "
+                          f"they are kept in {file_name}")
+
+            return (run_flush(self.upload_to_db,
+                              values_to_insert,
+                              fingerprints_to_insert,
+                              refreshed_sub_menus)
+                        .addCallback(report))
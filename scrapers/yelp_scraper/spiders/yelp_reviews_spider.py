@@ -1,14 +1,12 @@
-from ast import literal_eval
-from bs4 import BeautifulSoup
 from collections import defaultdict
 from datetime import datetime
+from datetime import timezone
 from html import unescape 
 import json
 
 import pickle
 import psycopg2
 import psycopg2.extras
-from psycopg2.extras import execute_values
 from psycopg2.extras import Json
 
 from re import compile
@@ -20,19 +18,27 @@ from scrapy.utils.project import get_project_settings
 
 from traceback import print_exc
 
+from twisted.internet.defer import Deferred
+
 from typing import Generator
 from typing import List
 from typing import Tuple
 from typing import Union
 
 from unicodedata import normalize
-from urllib.parse import parse_qs
 from urllib.parse import urlencode
-from urllib.parse import urlparse
 
+from yelp_scraper.checkpoint import ReviewsCheckpointer
 from yelp_scraper.credentials import Postgres
+from yelp_scraper.db import bulk_upsert
+from yelp_scraper.db import connect
+from yelp_scraper.db import fetch_in_batches
+from yelp_scraper.db import get_columns
+from yelp_scraper.db import keep_non_empty
+from yelp_scraper.intervals import IntervalSet
 from yelp_scraper.items import Review
-from yelp_scraper.utils import BusinessDetails
+from yelp_scraper.parse_executor import ParseExecutor
+from yelp_scraper.utils import parse_business_homepage
 from yelp_scraper.utils import merge_two_dictionaries
 
 settings = get_project_settings()
@@ -57,10 +63,20 @@ class ReviewsSpider(Spider):
     business_data : dict
         This will store metadata for each business, like, previous reviews count,
         indexes of error in previous runs, menu url, current reviews count.
+    conditional_crawl : bool
+        If True, skip businesses with no new reviews (as per the latest 
+        business listing), no errors and details scraped within last
+        `max_staleness_days` days
+    max_staleness_days : int
+        Details (hours, amenities, menu url, ...) of a business are scraped
+        again after these many days even if it has no new reviews
     conn
-        Database connection object to business information table
+        Database connection (own, autocommit) to fetch businesses to scrape,
+        closed when all the start requests are generated
     cursor
         Cursor for database
+    parse_executor : ParseExecutor or None
+        Pool of worker processes to parse homepages in, None if disabled
     
 
     Class Attributes
@@ -89,71 +105,62 @@ class ReviewsSpider(Spider):
         self.pages = kwargs.get('pages')
         self.location = kwargs.get('location')
         self.business_data = {}
+        self.conditional_crawl = kwargs.get('conditional_crawl')
+        if self.conditional_crawl is None:
+            self.conditional_crawl = settings.getbool('REVIEWS_CONDITIONAL_CRAWL')
+
+        self.max_staleness_days = int(kwargs.get('max_staleness_days')
+                                      or settings.getint('REVIEWS_MAX_STALENESS_DAYS', 14))
         self.conn = None # database connection for businesses info
         self.cursor = None
-        self.covid19_tags_set = set()
-        self.amenities_tags_set = set()
-
-    def get_db_connection(self):
-        return psycopg2.connect(host = Postgres.PG_HOST,
-                                port = Postgres.PG_PORT,
-                                dbname = Postgres.PG_DBNAME,
-                                user = Postgres.PG_USER,
-                                password = Postgres.PG_PWD)
+        self.parse_executor = None
+        self.checkpointer = ReviewsCheckpointer(
+            self,
+            batch_size=settings.getint('REVIEWS_CHECKPOINT_BATCH_SIZE', 200),
+            interval=settings.getfloat('REVIEWS_CHECKPOINT_INTERVAL', 300),
+            checkpoint_dir=settings.get('REVIEWS_CHECKPOINT_DIR', '.'),
+            max_age=settings.getfloat('REVIEWS_CHECKPOINT_MAX_AGE', 24 * 60 * 60))
 
     def create_request(self, 
-                       response_url : str, 
-                       tuple_index : int, 
-                       review_start_end : Tuple[int, int], 
-                       business_id : str,
-                       num_reviews_per_page : int = 20) -> Request:
-        """Create request object for the next page
+                       business_url : str, 
+                       page_start : int, 
+                       review_ranges : List[Tuple[int, int]], 
+                       business_id : str) -> Request:
+        """Create request object for a page of reviews
 
         Parameters
         ----------
-        response_url : str
-            URL of previous request
-        tuple_index : int
-            Index of error tuple from the list of errors
-        review_start_end : tuple(int, int)
-            Tuple of error
+        business_url : str
+            URL of the homepage of the business
+        page_start : int
+            Index of the first review of the page (multiple of 20)
+        review_ranges : list of tuple(int, int)
+            Ranges of reviews to scrape from this page (both ends inclusive)
         business_id : str
             Business id. For example, if URL is - 
             `www.yelp.com/biz/brendas-french-soul-food-san-francisco-5` then
             id is `brendas-french-soul-food-san-francisco-5`
-        num_reviews_per_page : int
-            Number of reviews received in a response
 
         Returns
         -------
         Request
-            A request object for the next page
+            A request object for the page
 
         """
         
         # https://www.yelp.com/biz/brendas-french-soul-food-san-francisco-5/review_feed?sort_by=date_desc&start=0
         # https://www.yelp.com/biz/lJAGnYzku5zSaLnQ_T6_GQ/review_feed?rl=en&sort_by=date_desc&q=&start=20
-        parsed_url = urlparse(response_url)
-        query = parse_qs(parsed_url.query) 
-
-        if query:
-            start = int(query['start'][0]) + num_reviews_per_page
-            referer = response_url
-            base_url = response_url.split('?')[0]
-        else:
-            start = 0
-            referer = None
-            base_url = response_url + "/review_feed"
+        base_url = business_url.split('?')[0] + "/review_feed"
 
         params = {
             'rl' : 'en',
             'sort_by' : 'date_desc',
             'q': '',
-            'start' : start
+            'start' : page_start
         }
 
         headers = {
-            'Referer' : referer,
+            'Referer' : business_url,
             'x-requested-by-react': True,
             'x-requested-with': 'XMLHttpRequest'
         }
@@ -164,20 +171,28 @@ class ReviewsSpider(Spider):
                        headers=headers, 
                        callback=self.child_parse, 
                        errback=self.request_error_handler,
-                       meta=dict(tuple_index=tuple_index, 
-                                 review_start_end = review_start_end, 
-                                 business_id = business_id))
+                       meta=dict(page_start = page_start,
+                                 review_ranges = review_ranges, 
+                                 business_id = business_id,
+                                 # offsets point to other reviews once new
+                                 # ones are posted, see `SqliteCacheStorage`
+                                 httpcache_version = self.business_data[business_id]
+                                                         .get('current_reviews_count')))
 
 
     def get_error_requests(self, 
                            response_url : str, 
                            business_id : str) -> Generator[Request, None, None]:
-        """Generator to generate initial error requests
+        """Generator to generate requests for all the pages of errors
+
+        Page offsets of all the errors are known upfront, so requests for all
+        the pages are generated at once instead of following pages one by 
+        one.
 
         Parameters
         ----------
         response_url : str
-            URL of previous request
+            URL of the homepage of the business
         business_id : str
             Business id. For example, if URL is - 
             `www.yelp.com/biz/brendas-french-soul-food-san-francisco-5` then
@@ -189,8 +204,7 @@ class ReviewsSpider(Spider):
             A request object
 
         """
-        url = response_url
-        # ea = -1 represents last run scraped all then available reviews
+        # empty `ea` represents last run scraped all then available reviews
         lrc = self.business_data[business_id].get('last_reviews_count')
 
         #NOTE crc from homepage sometimes do not match with crc from json response
@@ -201,8 +215,7 @@ class ReviewsSpider(Spider):
         if lrc == -1:
             # Scraping reviews for the first time for this business
             # therefore scraping crc reviews ie 0 to crc - 1
-            ea = [(0, crc - 1)]
-            # yield create_request(response_url)
+            ea = IntervalSet([(0, crc)])
         else:
             # lrc != -1 means that reviews has been scraped atleast once
             # for this business
@@ -210,56 +223,32 @@ class ReviewsSpider(Spider):
             ea = self.business_data[business_id].get('errors_at')
 
             if delta > 0:
-                # `delta` new reviews has been added
-                new_reviews = [(0, delta - 1)]
-
-                if ea != -1:
-                    # Apart from fetching `delta` new reviews we will have to 
-                    # get reviews where previously error occured (ea != -1)
-
-                    # if already have [(0, ..)] then join shoft max value by 
-                    # `delta`
-                    try:
-                        new_reviews = [max([(start, end + delta) for \
-                                        start, end in ea if start == 0])]
-                    except:
-                        pass
-
-                    # Shifting previous error indexes by `delta` and appending 
-                    # new_reviews
-                    ea = [(start + delta, end + delta) for start, end in \
-                        ea if start != 0] + new_reviews
-
-                else:
-                    # last run scraped all then available reviews
-                    # so, only grtting new reviews
-                    ea = new_reviews
-
-        if ea != -1:
+                # `delta` new reviews has been added at the start. Apart from
+                # fetching `delta` new reviews we will have to get reviews 
+                # where previously error occured (shifted by `delta`), an
+                # error starting at 0 joins the new reviews.
+                ea = ea.shift(delta) | IntervalSet([(0, delta)])
+
+        if ea:
             self.business_data[business_id]['errors_at'] = ea
         
-            print(f'Errors at {ea}\n')
-
-            for i, (start, end) in enumerate(ea):
-                # `start` in url needs to be multiple of 20
-                # start of an error can be anything,
-                # therefore, getting nearest multiple of 20 <= `start`
-                yelp_start = start - (start % 20)
-
-                if yelp_start != 0:
-                    # Only need to change `response_url` for start != 0
-
-                    # since, `create_request` return request on the basis of 
-                    # response.url, we need to use start = 20 to get request
-                    # with start = 40. Therefore, `yelp_start - 20`
-                    query = f'/review_feed?rl=en&sort_by=date_desc&q=&start={yelp_start - 20}'
-                    url = response_url + query
-                
-                print(f'fetching data for {url}..')
-                yield self.create_request(url, 
-                                        i, 
-                                        (start, end),
-                                        business_id)
+            print(f'Errors at {ea.to_pg()}\n')
+
+            # `start` in url needs to be multiple of 20, start of an error can 
+            # be anything. Grouping parts of errors by the page they are on, 
+            # so that a page shared by two errors is requested only once.
+            pages = defaultdict(list)
+            for start, end in ea.to_inclusive():
+                for page_start in range(start - (start % 20), end + 1, 20):
+                    pages[page_start].append((max(start, page_start), 
+                                              min(end, page_start + 19)))
+
+            print(f'fetching {len(pages)} pages of reviews for {response_url}..')
+            for page_start, review_ranges in sorted(pages.items()):
+                yield self.create_request(response_url, 
+                                          page_start,
+                                          review_ranges,
+                                          business_id)
     
 
     def get_reviews_details_json(self, 
@@ -317,93 +306,86 @@ class ReviewsSpider(Spider):
             A request object for the homepage of a restaurant
 
         """
+        self.parse_executor = ParseExecutor.from_crawler(self.crawler)
 
         try:
-            self.conn = self.get_db_connection()
+            # own connection (not from the pool), it is used till the last 
+            # request is generated, which is close to the end of the crawl
+            self.conn = connect(autocommit=True)
             self.cursor = self.conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
         except:
             print_exc()
             exit(0)
 
+        # other details from db are kept by the upsert if scraped values 
+        # are empty (see `upload_to_db`), so they are not fetched
+        sql_query = ("select business_id, "
+                            "business_url, "
+                            "num_reviews, "
+                            "last_reviews_count, "
+                            "errors_at::text "
+                     f"from {Postgres.PG_TABLE_NAME} where location = %(location)s")
+
+        if self.conditional_crawl:
+            # nothing to scrape for a business if latest listing shows no
+            # new reviews, all reviews are scraped and details are fresh
+            sql_query += (" and not coalesce(num_reviews = last_reviews_count "
+                                           "and isempty(errors_at) "
+                                           "and details_scraped_at > now() - make_interval(days => %(max_staleness_days)s), "
+                                        "false)")
+
+        # rows are fetched `DB_CURSOR_ITERSIZE` at a time while requests are
+        # yielded, no transaction is kept open in between
+        rows = fetch_in_batches(self.cursor,
+                                sql_query,
+                                {"location" : self.location,
+                                 "max_staleness_days" : self.max_staleness_days},
+                                key="business_id",
+                                batch_size=settings.getint('DB_CURSOR_ITERSIZE', 2000))
+
+        num_businesses = 0
         try:
-            sql_query = (f"select business_id, "
-                                  f"business_url, "
-                                  f"is_business_closed, "
-                                  f"year_established, "
-                                  f"overall_rating, "
-                                  f"num_reviews, "
-                                  f"menu_url, "
-                                  f"price_range, "
-                                  f"phone_number, "
-                                  f"num_reviews_5_stars, "
-                                  f"num_reviews_4_stars, "
-                                  f"num_reviews_3_stars, "
-                                  f"num_reviews_2_stars, "
-                                  f"num_reviews_1_star, "
-                                  f"address_line1, "
-                                  f"address_line2, "
-                                  f"address_line3, "
-                                  f"city, "
-                                  f"region_code, "
-                                  f"postal_code, "
-                                  f"country_code, "
-                                  f"operation_hours_Mon, "
-                                  f"operation_hours_Tue, "
-                                  f"operation_hours_Wed, "
-                                  f"operation_hours_Thu, "
-                                  f"operation_hours_Fri, "
-                                  f"operation_hours_Sat, "
-                                  f"operation_hours_Sun, "
-                                  f"categories, "
-                                  f"top_food_items, "
-                                  f"monthly_ratings_by_year, "
-                                  f"last_reviews_count, "
-                                  f"errors_at "
-                         f"from {Postgres.PG_TABLE_NAME} where location = '{self.location}'")
-
-            self.cursor.execute(sql_query)
-
-        except:
-            self.cursor.execute("ROLLBACK")
-            self.conn.commit()
-            self.cursor.close()
-            self.conn.close()
+            for row in rows:
+                business_id = row["business_id"]
+                business_url = row["business_url"]
+
+                if self.checkpointer.is_flushed(business_id):
+                    # already done by the interrupted previous run
+                    continue
+
+                # MARKER - business_data[business_id] has 5 keys, 
+                #            `num_reviews` (used if homepage has none), 
+                #            `last_reviews_count`, `errors_at` from db,
+                #            `scraped_reviews` and `pending_requests`
+                self.business_data[business_id] = {
+                    "num_reviews" : row["num_reviews"],
+                    "last_reviews_count" : row["last_reviews_count"],
+                    "errors_at" : IntervalSet.from_pg(row["errors_at"]),
+                    "scraped_reviews" : IntervalSet(),
+                    "pending_requests" : 0}
+                num_businesses += 1
+
+                # "https://www.yelp.com/biz/brendas-french-soul-food-san-francisco-5" 
+                print(f"fetching - https://www.yelp.com{business_url}...") 
+
+                yield Request(url = "https://www.yelp.com" + business_url, 
+                              callback = self.parse,
+                              meta={"business_id" : business_id})
+        except psycopg2.Error:
+            # businesses fetched so far are still scraped
             print_exc()
-            exit(0)
-
-        db_business_data_list_dict = self.cursor.fetchall()
+        finally:
+            print(f"{num_businesses} businesses to scrape for {self.location}")
+            self.close_db_connection()
 
-        if not self.conn.closed:
-            self.conn.commit()
-            self.cursor.close()
+    def close_db_connection(self) -> None:
+        """Close connection of `start_requests`, when all the requests are 
+        generated or the spider is closed"""
+        if (self.conn is not None) and not self.conn.closed:
             self.conn.close()
-
-        for row in db_business_data_list_dict:
-            business_id = row["business_id"]
-            business_url = row["business_url"]
-
-            business_dict = {key : row[key] 
-                             for key 
-                             in row 
-                             if key != "business_id"}
-
-            business_dict['resolved_error_indexes'] = []
-            business_dict["errors_at"] = literal_eval(business_dict.get('errors_at'))
-
-            # MARKER - business_data[business_id] has 33 keys, 
-            #            32 from db (except business_id)
-            #            and `resolved_error_indexes`
-            self.business_data[business_id] = business_dict
-
-            # "https://www.yelp.com/biz/brendas-french-soul-food-san-francisco-5" 
-            print(f"fetching - https://www.yelp.com{business_url}...") 
-
-            yield Request(url = "https://www.yelp.com" + business_url, 
-                          callback = self.parse,
-                          meta={"business_id" : business_id})
     
-    def parse(self, response : Response) -> Generator[Request, None, None]:
-        """Generator function that parses homepage response.
+    def parse(self, response : Response) -> Union[Deferred, List[Request]]:
+        """Parses homepage response.
         
         The parser scrapes following items from homepage:
             > Top food items
@@ -412,45 +394,61 @@ class ReviewsSpider(Spider):
         
         It generates initial requests for all the errors.
 
+        If parse executor is enabled, page is parsed in a worker process and
+        a Deferred firing with the requests is returned.
+
         Parameters
         ----------
         response 
             Response object of the homepage
 
-        Yields
-        ------
-        Request
-            A request object for an error
+        Returns
+        -------
+        list of Request or Deferred
+            Request objects for the errors
 
         """
+        # only JSON payloads of the page are parsed, not the whole page
+        if self.parse_executor is not None:
+            return (self.parse_executor
+                        .submit(parse_business_homepage, response.body, response.encoding)
+                        .addCallback(self.handle_business_details, response))
+
+        return self.handle_business_details(parse_business_homepage(response.body, 
+                                                                    response.encoding),
+                                            response)
+
+    def handle_business_details(self, 
+                                business_details_updates_dict : dict, 
+                                response : Response) -> List[Request]:
+        """Merge parsed homepage (see `utils.parse_business_homepage`) with 
+        business data and create requests for the errors"""
         business_id = response.meta.get("business_id")
 
-        soup = BeautifulSoup(unescape(response.text.replace("<!--","").replace("-->","")), "html.parser")
-
-        details_obj = BusinessDetails(soup)
-        business_details_updates_dict = details_obj.get_all_updates_and_details()
-
         business_details_dict = business_details_updates_dict.get("business_details")
         covid19_updates_dict = business_details_updates_dict.get("covid19_updates")
         amenities_dict = business_details_updates_dict.get("amenities")
 
-        # keeping track of all the services names, and amenities label.
-        # will be used when storing these services in db
-        self.covid19_tags_set = self.covid19_tags_set | set(covid19_updates_dict)
-        self.amenities_tags_set = self.amenities_tags_set | set(amenities_dict)
-
         # merging new details with details from db
         business_details_dict = merge_two_dictionaries(self.business_data[business_id], 
                                                         business_details_dict)
 
         self.business_data[business_id] = {**business_details_dict,
                                            "current_reviews_count" : business_details_dict.get("num_reviews", 0),
-                                           **covid19_updates_dict,
-                                           **amenities_dict}
+                                           "details_scraped_at" : datetime.now(timezone.utc),
+                                           # only the flags seen on the homepage
+                                           "business_flags" : {**covid19_updates_dict,
+                                                               **amenities_dict}}
 
+        requests = []
         if self.scrape_reviews:
-            for req in self.get_error_requests(response.url, business_id):
-                yield req
+            requests = list(self.get_error_requests(response.url, business_id))
+
+        self.business_data[business_id]['pending_requests'] = len(requests)
+        if not requests:
+            self.checkpointer.business_finished(business_id)
+
+        return requests
 
     def child_parse(self, response : Response) -> Generator[Union[Request, 
                                                                   None] ,
@@ -496,158 +494,214 @@ class ReviewsSpider(Spider):
                                 we can get this by (20 - 59 - 47) = 8 (python slice notations!!)
         """
 
-        response_json = json.loads(response.body_as_unicode())
+        response_json = json.loads(response.text)
 
-        reviews_start, reviews_end = response.meta.get('review_start_end')
-        tuple_index = response.meta.get('tuple_index')
+        review_ranges = response.meta.get('review_ranges')
         business_id = response.meta.get('business_id')
 
         # Actual request start
         _, start, _ = response_json.get('pagination').values()
         end = start + 19
 
-        reviews_to_get_start = 0
-        reviews_to_get_end = 20
-        if start < reviews_start:
-            reviews_to_get_start = (reviews_start - start)
-        if end > reviews_end:
-            reviews_to_get_end = (20 - (end - reviews_end))
-
-
-        reviews_info = response_json.get('reviews')[reviews_to_get_start : reviews_to_get_end]
-        for extracted_review_info in self.get_reviews_details_json(reviews_info):
-            review_item = Review()
-            review_item['review_id'] = extracted_review_info['review_id']
-            review_item['review'] = extracted_review_info['review']
-            review_item['date'] = extracted_review_info['date']
-            review_item['rating'] = extracted_review_info['rating']
-            review_item['business_name'] = extracted_review_info['business_name']
-            review_item['business_id'] = extracted_review_info['business_id']
-            review_item['business_alias'] = extracted_review_info['business_alias']
-            review_item['business_location'] = self.location
-            review_item['sentiment'] = extracted_review_info['sentiment']
-            
-            yield review_item
-
-        # if self.pages is not None:
-        #     if (start + num_reviews_per_page) < ((self.pages) * num_reviews_per_page):
-        #         yield self.create_request(response.url, num_reviews_per_page)
-
-        # if start of next request falls beyound total reviews to scrape then
-        # stop and update `resolved_error_indexes`
-        if (start + 20) < reviews_end:
-            yield self.create_request(response.url,
-                                      tuple_index,
-                                      (reviews_start, reviews_end),
-                                      business_id)
-        else:
-            self.business_data[business_id]['resolved_error_indexes'] += [tuple_index]
+        reviews_list = response_json.get('reviews')
+        for reviews_start, reviews_end in review_ranges:
+            reviews_to_get_start = 0
+            reviews_to_get_end = 20
+            if start < reviews_start:
+                reviews_to_get_start = (reviews_start - start)
+            if end > reviews_end:
+                reviews_to_get_end = (20 - (end - reviews_end))
+
+            reviews_info = reviews_list[reviews_to_get_start : reviews_to_get_end]
+            for extracted_review_info in self.get_reviews_details_json(reviews_info):
+                review_item = Review()
+                review_item['review_id'] = extracted_review_info['review_id']
+                review_item['review'] = extracted_review_info['review']
+                review_item['date'] = extracted_review_info['date']
+                review_item['rating'] = extracted_review_info['rating']
+                review_item['business_name'] = extracted_review_info['business_name']
+                review_item['business_id'] = extracted_review_info['business_id']
+                review_item['business_alias'] = extracted_review_info['business_alias']
+                review_item['business_location'] = self.location
+                review_item['sentiment'] = extracted_review_info['sentiment']
+                
+                yield review_item
 
-    def closed(self, reason : str) -> None:
-        """This function is called when spider closes for any reason.
+            # whole range is marked as scraped, even if the page had less 
+            # reviews than expected (see NOTE on crc in `get_error_requests`)
+            self.business_data[business_id]['scraped_reviews'].add(reviews_start, 
+                                                                   reviews_end + 1)
 
-        Saving the status of errors in database and closing database conns.
+        self.request_done(business_id)
+
+    def request_done(self, business_id : str) -> None:
+        """Keep track of requests of a business still in flight, business is
+        finished when there is none left
 
         Parameters
         ----------
-        reason : str 
-            Reason for the closing of spider
+        business_id : str
+            Business id
+        """
+        self.business_data[business_id]['pending_requests'] -= 1
 
+        if self.business_data[business_id]['pending_requests'] == 0:
+            self.checkpointer.business_finished(business_id)
+
+    def get_db_row(self, business_id : str) -> dict:
+        """Row of `restaurants_info` table for a business, with the status
+        of errors.
+
+        Parameters
+        ----------
+        business_id : str
+            Business id
+
+        Returns
+        -------
+        dict
+            column name -> value
         """
-        covid19_amenities_tags_dict = {tag : 0 
-                                       for tag 
-                                       in (self.covid19_tags_set 
-                                           | self.amenities_tags_set)}
-
-        values_to_insert = []
-        if self.business_data:
-            for key, v in self.business_data.items():
-                business_details_updates_dict = {"business_id" : key,
-                                                 **covid19_amenities_tags_dict,
-                                                 **v}
-
-                # If there is an error for the very first call in `start_requests`
-                # then `current_reviews_count` will not be set and 
-                # since, no request has been processed `current_reviews_count` =
-                # `last_reviews_count`
-                last_reviews_count = (business_details_updates_dict
-                                        .get('current_reviews_count'))
-
-                errors_at = business_details_updates_dict.get('errors_at')
-                if (errors_at != -1) and self.scrape_reviews:
-                    errors_at = [(i,j)
-                                 for k,(i,j)
-                                 in enumerate(errors_at)
-                                 if k not in v.get('resolved_error_indexes')]
-
-                    if len(errors_at) == 0:
-                        errors_at = -1
-
-                errors_at = str(errors_at)
-
-                business_details_updates_dict["last_reviews_count"] = last_reviews_count
-                business_details_updates_dict["errors_at"] = errors_at
-                business_details_updates_dict["monthly_ratings_by_year"] = \
-                    Json(business_details_updates_dict["monthly_ratings_by_year"])
-
-                if "resolved_error_indexes" in business_details_updates_dict.keys():
-                    del business_details_updates_dict["resolved_error_indexes"]
-                if "current_reviews_count" in business_details_updates_dict.keys():
-                    del business_details_updates_dict["current_reviews_count"]
-
-                if not self.scrape_reviews:
-                    # this is also the reason why we have `num_reviews` and 
-                    # `last_reviews_count`:
-                    # `num_reviews` is latest but `last_reviews_count` can be any
-                    # historical value
-                    # if no reviews are to be scraped, 
-                    # no need to update `last_reviews_count`
-                    _ = business_details_updates_dict.pop("last_reviews_count")
-
-                values_to_insert.append(business_details_updates_dict)
-
-        with open(f"reviews_spider_update_data_{datetime.now().strftime('%b_%d_%Y_%H_%M')}.pickle", "wb") as f:
-            pickle.dump(values_to_insert, f)
+        v = self.business_data[business_id]
+
+        # Since `business_url` is `not null` column in db, "", acts as 
+        # placeholder, it will not overwrite value in db
+        business_details_updates_dict = {"business_id" : business_id,
+                                         "business_url" : "",
+                                         **v}
+
+        # If there is an error for the very first call in `start_requests`
+        # then `current_reviews_count` will not be set and 
+        # since, no request has been processed `current_reviews_count` =
+        # `last_reviews_count`
+        last_reviews_count = (business_details_updates_dict
+                                .get('current_reviews_count', 
+                                     v.get('last_reviews_count')))
+
+        errors_at = business_details_updates_dict.get('errors_at')
+        if self.scrape_reviews:
+            # reviews from pages which failed are still errors
+            errors_at = errors_at - v.get('scraped_reviews')
+
+        errors_at = errors_at.to_pg()
+
+        business_details_updates_dict["last_reviews_count"] = last_reviews_count
+        business_details_updates_dict["errors_at"] = errors_at
+        # merged with flags in db, empty if homepage was not parsed
+        business_details_updates_dict["business_flags"] = \
+            Json(business_details_updates_dict.get("business_flags", {}))
+        if "monthly_ratings_by_year" in business_details_updates_dict:
+            # not there if homepage was not parsed
+            business_details_updates_dict["monthly_ratings_by_year"] = \
+                Json(business_details_updates_dict["monthly_ratings_by_year"])
+
+        for key in ["scraped_reviews", "pending_requests", "current_reviews_count"]:
+            if key in business_details_updates_dict.keys():
+                del business_details_updates_dict[key]
+
+        if not self.scrape_reviews:
+            # this is also the reason why we have `num_reviews` and 
+            # `last_reviews_count`:
+            # `num_reviews` is latest but `last_reviews_count` can be any
+            # historical value
+            # if no reviews are to be scraped, 
+            # no need to update `last_reviews_count`
+            _ = business_details_updates_dict.pop("last_reviews_count")
+
+        return business_details_updates_dict
+
+    def upload_to_db(self, values_to_insert : List[dict]) -> bool:
+        """Upsert rows (from `get_db_row`) in `restaurants_info` table.
+
+        Details which were not scraped (homepage failed) or are empty keep
+        their values in db, like `merge_two_dictionaries`. Covid19/amenity 
+        flags are merged with the flags in db.
+
+        Batches are written from a worker thread (see 
+        `ReviewsCheckpointer.flush`), so this only reads state of the spider.
+
+        Parameters
+        ----------
+        values_to_insert : list of dict
+            Rows to upsert
+
+        Returns
+        -------
+        bool
+            True if rows are saved in the database
+        """
+        if not values_to_insert:
+            return True
 
         try:
-            self.conn = self.get_db_connection()
-            self.cursor = self.conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
+            conn = self.crawler.db_pool.getconn()
+            cursor = conn.cursor()
         except:
             print_exc()
-            exit(0)
+            self._dump_rows(values_to_insert)
+            return False
 
         try:
-            # fetch all column names
-            self.cursor.execute((f"select column_name "
-                                 f"from information_schema.columns "
-                                 f"where table_name = '{Postgres.PG_TABLE_NAME}'"))
-            
-            column_names_set = set([column_name[0] for column_name in self.cursor.fetchall()])
-
-            columns_to_add_to_table = (self.covid19_tags_set 
-                                       | self.amenities_tags_set) - column_names_set
-
-            if columns_to_add_to_table:
-                self.cursor.execute((f'ALTER TABLE {Postgres.PG_TABLE_NAME} {", ".join([f"ADD COLUMN {column} int4 NULL DEFAULT 0"  for column in columns_to_add_to_table])}'))
-
-            if values_to_insert:
-                execute_values(self.cursor,
-                               (f'INSERT INTO {Postgres.PG_TABLE_NAME} ({", ".join(values_to_insert[0].keys())}) '
-                                f'VALUES %s '
-                                f'ON CONFLICT (business_id) '
-                                f'DO UPDATE SET {", ".join(["".join([str(k), " = excluded.", str(k)]) for k in values_to_insert[0].keys()])}'),
-                               [[value for value in data_dict.values()] for data_dict in values_to_insert])
+            # details not scraped (or empty) keep the values in db
+            columns = get_columns(values_to_insert)
+            not_merged = {"business_id", "business_url", "errors_at", "last_reviews_count"}
+            update_expressions = {column : keep_non_empty(column)
+                                  for column
+                                  in columns
+                                  if column not in not_merged}
+            update_expressions["business_flags"] = "{table}.business_flags || excluded.business_flags"
+            bulk_upsert(cursor,
+                        Postgres.PG_TABLE_NAME,
+                        values_to_insert,
+                        columns=columns,
+                        update_columns=[column for column in columns if column not in ["business_id", "business_url"]],
+                        update_expressions=update_expressions)
+            conn.commit()
+            return True
         except:
             print_exc()
+            conn.rollback()
+            self._dump_rows(values_to_insert)
+            return False
 
         finally:
-            self.conn.commit()
-            self.cursor.close()
-            self.conn.close()
+            cursor.close()
+            self.crawler.db_pool.putconn(conn)
+
+    def _dump_rows(self, values_to_insert : List[dict]) -> None:
+        # keep rows which could not be saved, so that they are not lost
+        with open(f"reviews_spider_update_data_{datetime.now().strftime('%b_%d_%Y_%H_%M_%S')}.pickle", "wb") as f:
+            pickle.dump(values_to_insert, f)
+
+    def closed(self, reason : str) -> Deferred:
+        """This function is called when spider closes for any reason.
+
+        Saving the status of errors of businesses not saved by checkpoints 
+        in database.
+
+        Parameters
+        ----------
+        reason : str 
+            Reason for the closing of spider
+
+        Returns
+        -------
+        Deferred
+            Fires when all the businesses are written, spider waits for it
+        """
+        if self.parse_executor is not None:
+            self.parse_executor.shutdown()
+
+        # spider closed before all the requests were generated
+        self.close_db_connection()
+
+        return self.checkpointer.close(reason)
 
     def request_error_handler(self, failure) -> None:
         """This function is called when error occurs in processing any request.
-        Update start of an error (if required).
+
+        Reviews of the failed page are not marked as scraped, so they remain
+        in `errors_at` and will be scraped in the next run.
 
         Parameters
         ----------
@@ -656,18 +710,8 @@ class ReviewsSpider(Spider):
 
         """
 
-        meta = failure.value.response.meta
-        reviews_start, reviews_end = meta.get('review_start_end')
-        tuple_index = meta.get('tuple_index')
-        business_id = meta.get('business_id')
-
-        response_url = failure.value.response.url
-        query = parse_qs(urlparse(response_url).query)
-        start = int(query['start'][0])
-
-        # if the start of request is greater than error start then that means
-        # that there was atleast one successful request and error starting index
-        # need to be changed.
-        # Keep in mind that error end point do not change!
-        if start > reviews_start:
-            self.business_data[business_id]['errors_at'][tuple_index] = (start, reviews_end)
\ No newline at end of file
+        meta = failure.request.meta
+        print(f"Failed to fetch reviews {meta.get('review_ranges')} "
+              f"of {meta.get('business_id')} - {failure.request.url}")
+
+        self.request_done(meta.get('business_id'))
@@ -0,0 +1,181 @@
+import os
+from threading import Lock
+from typing import BinaryIO
+from typing import List
+from typing import Tuple
+from uuid import uuid4
+
+from scrapy.settings import Settings
+
+from yelp_scraper.credentials import GCP
+
+
+class BaseStorageBackend:
+    """
+    Where `CSPipeline` saves the chunks of scraped items.
+
+    `upload` is called from the upload threads of the pipeline (several at a
+    time), `close` once after all the uploads are done. `list`, `read` and
+    `delete` are used by offline jobs, like, `scripts/compact_reviews.py`.
+    """
+
+    @classmethod
+    def from_settings(cls, settings : Settings) -> "BaseStorageBackend":
+        return cls()
+
+    def upload(self, object_key : str, fileobj : BinaryIO) -> None:
+        """Save file object (at position 0) under `object_key`, like,
+        `reviews/Chicago, IL/1000_2020-08-01T10-00-00.jl.gz`"""
+        raise NotImplementedError
+
+    def list(self, prefix : str) -> List[Tuple[str, float]]:
+        """Keys starting with `prefix`, with their last modified time (unix
+        timestamp)"""
+        raise NotImplementedError
+
+    def read(self, object_key : str) -> bytes:
+        raise NotImplementedError
+
+    def delete(self, object_key : str) -> None:
+        raise NotImplementedError
+
+    def close(self) -> None:
+        pass
+
+
+class GCSStorageBackend(BaseStorageBackend):
+    """Save chunks in GCP bucket `GCP.BUCKET` (assuming bucket exists)"""
+
+    def __init__(self, bucket_name : str):
+        # imported here, so that other backends work without GCP libraries
+        from google.cloud import storage
+
+        self.storage_client = storage.Client()
+        # handle is reused for all the chunks
+        self.bucket = self.storage_client.bucket(bucket_name)
+
+    @classmethod
+    def from_settings(cls, settings : Settings) -> "GCSStorageBackend":
+        return cls(GCP.BUCKET)
+
+    def upload(self, object_key : str, fileobj : BinaryIO) -> None:
+        blob = self.bucket.blob(object_key)
+        blob.upload_from_file(fileobj)
+
+    def list(self, prefix : str) -> List[Tuple[str, float]]:
+        return [(blob.name, blob.updated.timestamp())
+                for blob
+                in self.storage_client.list_blobs(self.bucket, prefix=prefix)]
+
+    def read(self, object_key : str) -> bytes:
+        return self.bucket.blob(object_key).download_as_string()
+
+    def delete(self, object_key : str) -> None:
+        self.bucket.blob(object_key).delete()
+
+
+class LocalFSStorageBackend(BaseStorageBackend):
+    """
+    Save chunks as files under `root_dir`, object key is the path of the file
+    relative to `root_dir` (so keys partition files by location, same as
+    in bucket).
+
+    File is written to a temporary file, fsynced and then renamed, so
+    readers never see a partial chunk, even after a crash. Renames are 
+    durable once their directories are fsynced, which is done every 
+    `fsync_every` chunks and on close, instead of after every chunk. A crash
+    can lose the last chunks, but not leave a partial one.
+
+    Parameters
+    ----------
+    root_dir : str
+        Directory to save chunks in
+    fsync_every : int
+        Number of chunks to fsync directories for together, 0 - never fsync
+        (leave it to OS, a crash can then leave partial or empty files)
+    """
+
+    def __init__(self, root_dir : str, fsync_every : int = 10):
+        self.root_dir = root_dir
+        self.fsync_every = fsync_every
+        self.unsynced = 0
+        self.unsynced_dirs = set()
+        self._lock = Lock()
+
+    @classmethod
+    def from_settings(cls, settings : Settings) -> "LocalFSStorageBackend":
+        return cls(settings.get('LOCAL_STORAGE_ROOT', 'reviews_store'),
+                   settings.getint('LOCAL_STORAGE_FSYNC_EVERY', 10))
+
+    def get_path(self, object_key : str) -> str:
+        path = os.path.normpath(os.path.join(self.root_dir, object_key))
+        if os.path.commonpath([os.path.abspath(path),
+                               os.path.abspath(self.root_dir)]) != os.path.abspath(self.root_dir):
+            raise ValueError(f"Object key outside of storage root - {object_key}")
+
+        return path
+
+    def upload(self, object_key : str, fileobj : BinaryIO) -> None:
+        path = self.get_path(object_key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        tmp_path = f"{path}.{uuid4().hex}.tmp"
+        with open(tmp_path, "wb") as f:
+            while True:
+                block = fileobj.read(1024 * 1024)
+                if not block:
+                    break
+                f.write(block)
+
+            if self.fsync_every > 0:
+                # data must be on disk before the rename is
+                f.flush()
+                os.fsync(f.fileno())
+
+        os.replace(tmp_path, path)
+
+        if self.fsync_every > 0:
+            with self._lock:
+                self.unsynced += 1
+                self.unsynced_dirs.add(os.path.dirname(path))
+                if self.unsynced >= self.fsync_every:
+                    self._fsync_dirs()
+
+    def list(self, prefix : str) -> List[Tuple[str, float]]:
+        # prefix can end in the middle of a file name, like, keys of bucket
+        prefix_path = os.path.join(self.root_dir, prefix)
+        search_dir = prefix_path if prefix_path.endswith(os.sep) else os.path.dirname(prefix_path)
+
+        keys = []
+        for directory, _, file_names in os.walk(search_dir):
+            for file_name in file_names:
+                path = os.path.join(directory, file_name)
+                if path.startswith(prefix_path) and not file_name.endswith(".tmp"):
+                    keys.append((os.path.relpath(path, self.root_dir).replace(os.sep, "/"),
+                                 os.path.getmtime(path)))
+
+        return sorted(keys)
+
+    def read(self, object_key : str) -> bytes:
+        with open(self.get_path(object_key), "rb") as f:
+            return f.read()
+
+    def delete(self, object_key : str) -> None:
+        os.remove(self.get_path(object_key))
+
+    def _fsync_dirs(self) -> None:
+        directories, self.unsynced_dirs = self.unsynced_dirs, set()
+        self.unsynced = 0
+
+        # renames are durable only when directory is synced
+        for directory in directories:
+            fd = os.open(directory, os.O_RDONLY)
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+
+    def close(self) -> None:
+        with self._lock:
+            if self.unsynced_dirs:
+                self._fsync_dirs()
@@ -1,9 +1,22 @@
+from bs4 import BeautifulSoup
+from bs4 import NavigableString
+from bs4 import Tag
+from html import unescape
 import json
+from lxml import etree
+from lxml.html import fromstring as lxml_fromstring
 
 from re import compile
+from re import DOTALL
+from re import IGNORECASE
 from re import sub
 import unidecode
+from functools import lru_cache
+from hashlib import sha1
+from functools import wraps
 from traceback import print_exc
+from typing import List
+from typing import Union
 
 
 def remove_any_brackets(item: str) -> str:
@@ -19,7 +32,10 @@ def remove_any_brackets(item: str) -> str:
     str
         String with brackets removed
     """
-    processed_item = ''
+    if ('[' not in item) and ('(' not in item):
+        return item
+
+    processed_chars = []
     skip1c = 0
     skip2c = 0
     for char in item:
@@ -32,11 +48,11 @@ def remove_any_brackets(item: str) -> str:
         elif char == ')'and skip2c > 0:
             skip2c -= 1
         elif skip1c == 0 and skip2c == 0:
-            processed_item += char
-    return processed_item
+            processed_chars.append(char)
+    return ''.join(processed_chars)
 
 
-menu_items_to_remove = [
+menu_items_to_remove = frozenset([
     "cup","way","sol","uni","can","mix","hot","mac","red","hat","nem","pop",
     "nan","res","the","cafe","inch","thin","soda","cake","bowl","tune","live",
     "mild","club","cola","lime","beer","sole","well","solo","coka","fire",
@@ -69,9 +85,25 @@ menu_items_to_remove = [
     "manhattan","benchmark","roll of garbage bags","garbage bag each",
     "sani spritz spray","toilet paper","kids cups no spill locking lid",
     "kleenex box","sani wipes"
-]
+])
+
+# single pass replacement of ".", "&" and "-"
+_MENU_ITEM_TRANSLATION = str.maketrans({"." : ". ", 
+                                        "&" : "and", 
+                                        "-" : " "})
+
+_MENU_ITEM_PATTERNS = [compile(r'\*|\"|\$|#'), # remove * and " and $ and #
+                       compile(r'\d+\s*(lb|pounds|pound|oz|ounces|ounce|inches|inch'
+                               r'|grams|gram|pcs|pieces|piece|each|cup'
+                               r'|bowl|scoops|scoop|pot|liters|liter'
+                               r'|or less|off)\s*((of)*)\.*\s+'),
+                       compile(r'\s*\S*[0-9]\S*')] # remove anyword with digits in it
 
+# chains have same dishes in all the locations, so most names repeat
+MENU_ITEM_CACHE_SIZE = 65536
 
+
+@lru_cache(maxsize=MENU_ITEM_CACHE_SIZE)
 def preprocess_menu_item(item: str) -> str:
     """Pre-process menu items
 
@@ -103,21 +135,13 @@ def preprocess_menu_item(item: str) -> str:
         # not considering menu items with length > 70 or < 3
         return ""
     else:
-        item = unidecode.unidecode(item + " ")\
-                                        .lower()\
-                                        .replace(".", ". ")\
-                                        .replace("&", "and")\
-                                        .replace("-", " ")\
-                                        .replace(" w/", " with ")
-        to_remove = [f'\*|\"|\$|#', # remove * and " and $ and #
-                     f'\d+\s*(lb|pounds|pound|oz|ounces|ounce|inches|inch'
-                             f'|grams|gram|pcs|pieces|piece|each|cup'
-                             f'|bowl|scoops|scoop|pot|liters|liter'
-                             f'|or less|off)\s*((of)*)\.*\s+',
-                     f'\s*\S*[0-9]\S*'] # remove anyword with digits in it
+        item = (unidecode.unidecode(item + " ")
+                         .lower()
+                         .translate(_MENU_ITEM_TRANSLATION)
+                         .replace(" w/", " with "))
                      
-        for pattern in to_remove:
-            item = sub(pattern, ' ', item)
+        for pattern in _MENU_ITEM_PATTERNS:
+            item = pattern.sub(' ', item)
         
         item = ' '.join(item.replace(".", "").split())
         
@@ -126,14 +150,20 @@ def preprocess_menu_item(item: str) -> str:
         else:
             return item
 
+
+def preprocess_menu_items(items: List[str]) -> List[str]:
+    """Pre-process list of menu items, see `preprocess_menu_item`"""
+    return [preprocess_menu_item(item) for item in items]
+
 def get_menu(soup):
     try:
         menu_section = soup.select('.menu-sections')[0]
     except:
         # if error occurs that means the url in the db for menu is outdated
-        # handle this exception in main code, and make menu_url = None
-        # so, that next time the reviews scraper runs, it will update the 
-        # url if exists.
+        # (or the page was bad), handle this exception in main code, and 
+        # make menu_url = None after `MENU_MAX_PARSE_FAILURES` errors in a 
+        # row so, that next time the reviews scraper runs, it will update 
+        # the url if exists.
         raise
     
     try:
@@ -186,6 +216,96 @@ def get_menu(soup):
         return {}
 
 
+def _has_class(class_name: str) -> str:
+    """XPath predicate, element has `class_name` in its classes (same as CSS
+    `.class_name`)"""
+    return f"contains(concat(' ', normalize-space(@class), ' '), ' {class_name} ')"
+
+
+# selectors of `get_menu_lxml`, same elements as `get_menu` finds with 
+# BeautifulSoup (class regexes are matched against whole class string)
+_XPATH_MENU_SECTIONS = etree.XPath(f"//*[{_has_class('menu-sections')}]")
+_XPATH_SECTION_HEADERS = etree.XPath(".//div[normalize-space(@class)"
+                                     "='section-header section-header--no-spacing']")
+_XPATH_SECTION_ITEMS = etree.XPath(f".//div[{_has_class('u-space-b3')}]")
+_XPATH_ITEM_DETAILS = etree.XPath(".//div[contains(normalize-space(@class), "
+                                  "'arrange_unit arrange_unit--fill menu-item-detail')]")
+_XPATH_ITEM_PRICES = etree.XPath(".//div[contains(normalize-space(@class), "
+                                 "'menu-item-prices arrange_uni')]")
+_XPATH_FIRST_H2 = etree.XPath("(.//h2)[1]")
+_XPATH_FIRST_H4 = etree.XPath("(.//h4)[1]")
+_XPATH_FIRST_P = etree.XPath("(.//p)[1]")
+_XPATH_PRICE_AMOUNT = etree.XPath(f"(.//*[{_has_class('menu-item-price-amount')}])[1]")
+_XPATH_SUB_MENUS = etree.XPath(f"//*[{_has_class('sub-menus')}]//li")
+_XPATH_SUB_MENU_URLS = etree.XPath(f"//*[{_has_class('sub-menus')}]//li//a/@href")
+_XPATH_SUB_MENU_LISTS = etree.XPath(f"//*[{_has_class('sub-menus')}]")
+_XPATH_VISIBLE_TEXT_AND_LINKS = etree.XPath(".//text()[not(ancestor::script or ancestor::style)]"
+                                            " | .//a/@href")
+
+
+def _first_text(xpath: etree.XPath, element) -> Union[str, None]:
+    found = xpath(element)
+    return found[0].text_content() if found else None
+
+
+def get_menu_lxml(tree) -> dict:
+    """Same as `get_menu`, for a page parsed with lxml (`lxml.html` tree)
+
+    Sections, items, prices and descriptions are paired using precompiled 
+    XPaths, instead of regex class matching of BeautifulSoup tree.
+
+    Raises
+    ------
+    IndexError
+        Page has no menu, ie. menu url is outdated
+    """
+    menu_section = _XPATH_MENU_SECTIONS(tree)[0]
+
+    try:
+        menu_items_dict = {}
+
+        food_categories = _XPATH_SECTION_HEADERS(menu_section)
+        menu_items_list = _XPATH_SECTION_ITEMS(menu_section)
+
+        if len(food_categories) != len(menu_items_list):
+            menu_items_list = menu_items_list[1:]
+
+        for food_category, menu_items in zip(food_categories, menu_items_list):
+            category = _XPATH_FIRST_H2(food_category)[0].text_content().strip().lower()
+            menu_items_dict[category] = category_items = []
+
+            for p, price in zip(_XPATH_ITEM_DETAILS(menu_items), 
+                                _XPATH_ITEM_PRICES(menu_items)):
+                name = _first_text(_XPATH_FIRST_H4, p)
+                if name is None:
+                    continue
+
+                name = name.strip().lower()
+                processed_name = preprocess_menu_item(name)
+                if not processed_name:
+                    continue
+
+                one_category_food_items_dict = {'name' : name,
+                                                'processed_name' : processed_name}
+
+                price_amount = _first_text(_XPATH_PRICE_AMOUNT, price)
+                if price_amount is not None:
+                    one_category_food_items_dict['price'] = price_amount.replace("\\n", "").strip()
+
+                desc = _first_text(_XPATH_FIRST_P, p)
+                if desc is not None:
+                    one_category_food_items_dict['desc'] = desc
+
+                category_items.append(one_category_food_items_dict)
+
+        scraped_menu = {k:v for k, v in  menu_items_dict.items() if len(v)}
+        
+        return scraped_menu
+    except:
+        print_exc()
+        return {}
+
+
 def merge_two_dictionaries(d1: dict, d2: dict) -> dict:
     """
     Merge dictionaries `d1` and `d2` in such a way that all keys in `d2` has 
@@ -221,17 +341,182 @@ def merge_two_dictionaries(d1: dict, d2: dict) -> dict:
     
     return merged_dict
 
+def refresh_menu(stored_menu: dict, 
+                 scraped_menu: dict, 
+                 sub_menu_names: Union[List[str], None]) -> dict:
+    """
+    Menu after a refresh, which only parses changed sub menus
+
+    Sub menus are in the order of `sub_menu_names` (names of all the sub 
+    menus the menu has now), changed ones are from `scraped_menu` and 
+    unchanged (or not downloaded) ones from `stored_menu`. Sub menus no longer
+    linked from the menu page are removed. If `sub_menu_names` is None 
+    (not known), changed sub menus are merged into `stored_menu`.
+
+    Example:
+    stored_menu = {"dinner": {...}, "lunch": {...}, "brunch": {...}}
+    scraped_menu = {"lunch": {new}}
+    sub_menu_names = ["dinner", "lunch"]
+    refreshed = {"dinner": {...}, "lunch": {new}} # brunch was removed
+    """
+    if sub_menu_names is None:
+        return {**stored_menu, **scraped_menu}
+
+    refreshed_menu = {}
+    for sub_menu_name in sub_menu_names:
+        if sub_menu_name in scraped_menu:
+            refreshed_menu[sub_menu_name] = scraped_menu[sub_menu_name]
+        elif sub_menu_name in stored_menu:
+            refreshed_menu[sub_menu_name] = stored_menu[sub_menu_name]
+
+    for sub_menu_name, sub_menu in scraped_menu.items():
+        refreshed_menu.setdefault(sub_menu_name, sub_menu)
+
+    return refreshed_menu
+
+# <script type="application/json" ...>payload</script>
+_JSON_SCRIPT_PATTERN = compile(rb'<script\b[^>]*\btype\s*=\s*["\']application/json["\'][^>]*>(.*?)</script\s*>',
+                               DOTALL | IGNORECASE)
+
+
+def extract_json_scripts(body: bytes, encoding: str = "utf-8") -> List[str]:
+    """Get payloads of all `<script type="application/json">` tags of a page
+    without parsing the whole page.
+
+    Yelp wraps these payloads in html comments and escapes them (like, 
+    `&quot;`), comments are removed and payloads are unescaped.
+
+    Parameters
+    ----------
+    body : bytes
+        Raw html of the page
+    encoding : str
+        Encoding of the page
+    
+    Returns
+    -------
+    list of str
+        JSON strings, in the order they appear on the page
+    """
+    return [unescape(payload.replace(b"<!--", b"")
+                            .replace(b"-->", b"")
+                            .decode(encoding, errors="replace"))
+            for payload
+            in _JSON_SCRIPT_PATTERN.findall(body)]
+
+
+def _memoized(method):
+    """Compute value of a method (without arguments) only once per object,
+    values are stored in `_memo` dict of the object"""
+    @wraps(method)
+    def wrapper(self):
+        if method.__name__ not in self._memo:
+            self._memo[method.__name__] = method(self)
+        return self._memo[method.__name__]
+
+    return wrapper
+
+
+class ApolloCache:
+    """Resolver for the normalized Apollo (GraphQL) cache from the homepage.
+
+    The cache is a flat dict of id -> node, nodes refer to other nodes with
+    `{"id": ..., "type": "id"}` references. References are resolved only when
+    they are accessed.
+
+    Parameters
+    ----------
+    nodes : dict
+        Parsed JSON payload of the cache (id -> node)
+    """
+
+    def __init__(self, nodes: dict):
+        self.nodes = nodes
+
+    def node(self, node_id: str) -> dict:
+        """Node with id `node_id`, empty dict if there is no such node"""
+        return self.nodes.get(node_id) or {}
+
+    def resolve(self, value):
+        """Node referred by `value` if it is a reference, else `value`"""
+        if isinstance(value, dict) and value.get("id") in self.nodes:
+            return self.nodes[value["id"]]
+        return value
+
+    def select(self, node_id: str, *fields: str) -> List[dict]:
+        """Follow `fields` starting from node `node_id`, resolving references
+        and flattening lists on the way.
+
+        Example:
+        select("Business.x", "operationHours", "regularHoursMergedWithSpecialHoursForCurrentWeek")
+        -> nodes of hours of each day of the week
+
+        Returns
+        -------
+        list of dict
+            Nodes at the end of the path
+        """
+        nodes = [self.node(node_id)]
+
+        for field in fields:
+            next_nodes = []
+            for node in nodes:
+                value = node.get(field) if isinstance(node, dict) else None
+                if value is None:
+                    continue
+
+                for item in (value if isinstance(value, list) else [value]):
+                    next_nodes.append(self.resolve(item))
+
+            nodes = next_nodes
+
+        return nodes
+
+
 class BusinessDetails:
+    """Business details, covid19 updates and amenities from the homepage of a
+    business.
 
-    def __init__(self, soup):
-        self.soup = soup
+    Everything is read from the JSON payloads of the page, html is parsed 
+    (`soup`) only if menu url or number of reviews is not found in them.
+
+    Covid19 updates, amenities, hours, etc. are read from the Apollo cache
+    payload through `ApolloCache`. Each group of details is computed when it
+    is first asked for and then reused.
+
+    Parameters
+    ----------
+    html : bytes or str
+        Raw html of the homepage
+    encoding : str
+        Encoding of `html` (if bytes)
+    """
+
+    def __init__(self, html: Union[bytes, str], encoding: str = "utf-8"):
+        if isinstance(html, str):
+            html = html.encode(encoding)
+
+        self.html = html
+        self.encoding = encoding
+        self._soup = None
+        self._memo = {}
+        self.apollo_cache = ApolloCache({})
         self.parsed_dict_biz_updates = None
         self.parsed_dict_biz_datails = None
         self.base_key = None
         self.business_id = None
         self.is_business_closed = None # 1 or 0 or None
         self.overall_rating = None
-        self._set_inst_variables(soup)
+        self._set_inst_variables(extract_json_scripts(html, encoding))
+
+    @property
+    def soup(self):
+        # Full parse of the page, only needed for fallbacks
+        if self._soup is None:
+            text = self.html.decode(self.encoding, errors="replace")
+            self._soup = BeautifulSoup(unescape(text.replace("<!--","").replace("-->","")), 
+                                       "html.parser")
+        return self._soup
     
     def _split_camel_case(self, input_cc_string: str) -> str:
         # "ABCXyzaPqr" -> ["ABC", "Xyza", "Pqr"]
@@ -239,24 +524,19 @@ class BusinessDetails:
                       r' \1', 
                       sub('([A-Z]+)', r' \1', input_cc_string)).split()
 
-    def _set_inst_variables(self, soup):
-        script_json_list = soup.findAll('script', type="application/json")
-
+    def _set_inst_variables(self, script_json_list):
         for script_json in script_json_list:
             try:
-                parsed_dict = json.loads(script_json.string)
+                parsed_dict = json.loads(script_json)
                 parsed_dict_keys = parsed_dict.keys()
 
-                if any([("$ROOT_QUERY.business" in key) 
-                        for key 
-                        in parsed_dict_keys]):
-
-                    root_dict = parsed_dict.get("ROOT_QUERY")
-
-                    for k, v in root_dict.items():
-                        if "business" in k:
+                # Apollo cache, with business as one of the root queries
+                if isinstance(parsed_dict.get("ROOT_QUERY"), dict):
+                    for k, v in parsed_dict["ROOT_QUERY"].items():
+                        if ("business" in k) and isinstance(v, dict):
                             self.base_key = v.get("id")
                             self.parsed_dict_biz_updates = parsed_dict
+                            self.apollo_cache = ApolloCache(parsed_dict)
                 
                 if "bizDetailsPageProps" in parsed_dict_keys:
                     try:
@@ -279,53 +559,24 @@ class BusinessDetails:
             except:
                 continue
 
-    def _get_ids_list(self, dict_keys):
-        sections_list_dict = (self.parsed_dict_biz_updates
-                                        .get(dict_keys[0])
-                                        .get(dict_keys[1]))
-
-        if not isinstance(sections_list_dict, list):
-            sections_list_dict = [sections_list_dict]
-
-        sections_ids_list = [section_dict.get("id") 
-                             for section_dict 
-                             in sections_list_dict]
-
-        attribute_ids_list = []
-        for section_id in sections_ids_list:
-            attribute_ids_list_dict = (self.parsed_dict_biz_updates
-                                                .get(section_id)
-                                                .get(dict_keys[2]))
-
-            attribute_ids_list.extend([attribute.get("id") 
-                                        for attribute 
-                                        in attribute_ids_list_dict])
-
-        return attribute_ids_list
-
+    @_memoized
     def get_covid19_updates(self):
         covid19_updates = {}
 
         if self.base_key:
             try:
-                key1 = ".".join([self.base_key, "serviceUpdateSummary"])
-                key2 = "attributeAvailabilitySections"
-                key3 = "attributeAvailabilityList"
+                attributes = self.apollo_cache.select(".".join([self.base_key, "serviceUpdateSummary"]),
+                                                      "attributeAvailabilitySections",
+                                                      "attributeAvailabilityList")
 
-                attribute_ids_list = self._get_ids_list((key1, key2, key3))
-
-                for attribute_id in attribute_ids_list:
-                    label = (self.parsed_dict_biz_updates
-                                    .get(attribute_id)
-                                    .get("label"))
+                for attribute in attributes:
+                    label = attribute.get("label")
 
                     label = label.lower().split()
                     label = "_".join(["covid19"] + label) # covid19_label
                     label = label.replace("-", "_")
 
-                    availability = (self.parsed_dict_biz_updates
-                                            .get(attribute_id)
-                                            .get("availability"))
+                    availability = attribute.get("availability")
 
                     covid19_updates[label] = (1
                                               if availability == "AVAILABLE" 
@@ -335,29 +586,24 @@ class BusinessDetails:
         
         return covid19_updates
 
+    @_memoized
     def get_amenities(self):
         amenities = {}
 
         if self.base_key:
             try:
-                key1 = self.base_key
-                key2 = "organizedProperties({\"clientPlatform\":\"WWW\"})"
-                key3 = "properties"
-
-                amenities_ids_list = self._get_ids_list((key1, key2, key3))
+                properties = self.apollo_cache.select(self.base_key,
+                                                      "organizedProperties({\"clientPlatform\":\"WWW\"})",
+                                                      "properties")
 
-                for amenities_id in amenities_ids_list:
-                    amenity = (self.parsed_dict_biz_updates
-                                        .get(amenities_id)
-                                        .get("alias"))
+                for amenity_property in properties:
+                    amenity = amenity_property.get("alias")
 
                     amenity = self._split_camel_case(amenity) # list
                     amenity = "_".join(["amenity"] + amenity) # amenity_label
                     amenity = amenity.lower().replace("-", "_")
 
-                    is_active = (self.parsed_dict_biz_updates
-                                        .get(amenities_id)
-                                        .get("isActive"))
+                    is_active = amenity_property.get("isActive")
 
                     amenities[amenity] = 1 if is_active else 0
             except:
@@ -365,6 +611,7 @@ class BusinessDetails:
         
         return amenities
 
+    @_memoized
     def get_operation_hours(self):
         operation_hours = { 'operation_hours_mon': None,
                             'operation_hours_tue': None,
@@ -376,20 +623,15 @@ class BusinessDetails:
 
         if self.base_key:
             try:
-                key1 = self.base_key
-                key2 = "operationHours"
-                key3 = "regularHoursMergedWithSpecialHoursForCurrentWeek"
+                op_hours_list = self.apollo_cache.select(self.base_key,
+                                                         "operationHours",
+                                                         "regularHoursMergedWithSpecialHoursForCurrentWeek")
 
-                op_hours_ids_list = self._get_ids_list((key1, key2, key3))
+                for op_hours in op_hours_list:
+                    day_of_week = op_hours.get("dayOfWeekShort").lower()
 
-                for op_hours_id in op_hours_ids_list:
-                    day_of_week = (self.parsed_dict_biz_updates
-                                            .get(op_hours_id)
-                                            .get("dayOfWeekShort").lower())
-
-                    hours = (self.parsed_dict_biz_updates.get(op_hours_id)
-                                        .get("regularHours")
-                                        .get("json")[0].lower())
+                    hours = (op_hours.get("regularHours")
+                                     .get("json")[0].lower())
 
                     operation_hours["_".join(["operation", "hours", day_of_week])] = hours
             except:
@@ -398,51 +640,45 @@ class BusinessDetails:
         
         return operation_hours
 
+    @_memoized
     def get_categories(self):
         categories = []
 
         try:
-            categories_ids_list_dict = (self.parsed_dict_biz_updates
-                                                .get(self.base_key)
-                                                .get("categories"))
-
-            categories_ids_list = [category_id_dict.get("id")
-                                    for category_id_dict
-                                    in categories_ids_list_dict]
-
-            for category_id in categories_ids_list:
-                categories.append(self.parsed_dict_biz_updates\
-                                            .get(category_id)\
-                                            .get("title"))
+            for category in self.apollo_cache.select(self.base_key, "categories"):
+                categories.append(category.get("title"))
         except:
             pass
             
         return categories
 
+    @_memoized
     def get_price_range(self):
         price_range = None
         try:
-            price_range = (self.parsed_dict_biz_updates
-                                    .get(".".join([self.base_key, 
-                                                   "priceRange"]))
+            price_range = (self.apollo_cache
+                                    .node(".".join([self.base_key, 
+                                                    "priceRange"]))
                                     .get("description"))
         except:
             pass
 
         return price_range 
 
+    @_memoized
     def get_phone_number(self):
         phone_number = None
         try:
-            phone_number = (self.parsed_dict_biz_updates
-                                    .get(".".join([self.base_key, 
-                                                   "phoneNumber"]))
+            phone_number = (self.apollo_cache
+                                    .node(".".join([self.base_key, 
+                                                    "phoneNumber"]))
                                     .get("formatted"))
         except:
             pass
 
         return phone_number
     
+    @_memoized
     def get_address(self):
         address = { 'address_line1': None,
                     'address_line2': None,
@@ -452,8 +688,8 @@ class BusinessDetails:
                     'postal_code': None,
                     'country_code': None }
         try:
-            address_ = (self.parsed_dict_biz_updates
-                                .get(".".join([self.base_key, 
+            address_ = (self.apollo_cache
+                                .node(".".join([self.base_key, 
                                                "location", 
                                                "address"])))
 
@@ -461,8 +697,8 @@ class BusinessDetails:
                         for k, v 
                         in address_.items()}
 
-            country_code = (self.parsed_dict_biz_updates
-                                    .get(".".join([self.base_key, 
+            country_code = (self.apollo_cache
+                                    .node(".".join([self.base_key, 
                                                    "location", 
                                                    "country"]))
                                     .get("code"))
@@ -477,6 +713,7 @@ class BusinessDetails:
         return address
 
 
+    @_memoized
     def get_year_established(self):
         # Year of establishment
         try:
@@ -491,6 +728,7 @@ class BusinessDetails:
         
         return year_established
 
+    @_memoized
     def get_top_food_items(self):
         # Top menu items (list)
         try:
@@ -498,14 +736,15 @@ class BusinessDetails:
                                             .get("popularDishesCarouselProps")
                                             .get("popularDishes"))
 
-            top_food_items = [preprocess_menu_item(i["dishName"]) 
-                              for i 
-                              in top_food_items_dict_list]
+            top_food_items = preprocess_menu_items([i["dishName"] 
+                                                    for i 
+                                                    in top_food_items_dict_list])
         except:
             top_food_items = []
         
         return top_food_items
 
+    @_memoized
     def get_menu_url(self):
         # Menu URL (URL or None)
         menu_url = None
@@ -531,6 +770,7 @@ class BusinessDetails:
 
         return menu_url
     
+    @_memoized
     def get_num_reviews(self):
         # Number of reviewws
         try:
@@ -546,6 +786,7 @@ class BusinessDetails:
         
         return num_reviews
 
+    @_memoized
     def get_monthly_ratings_by_year(self):
         # Monthly ratings by year
         try:
@@ -557,6 +798,7 @@ class BusinessDetails:
         
         return monthly_ratings_by_year
 
+    @_memoized
     def get_rating_histogram(self):
         # Rating histogram
         rating_histogram = {'num_reviews_5_stars': None,
@@ -580,6 +822,7 @@ class BusinessDetails:
         
         return rating_histogram
 
+    @_memoized
     def get_all_biz_details(self):
         details = {}
         details["is_business_closed"] = self.is_business_closed
@@ -605,6 +848,7 @@ class BusinessDetails:
 
         return details
 
+    @_memoized
     def get_all_updates_and_details(self):
         business_id = self.business_id
         covid19_updates = self.get_covid19_updates()
@@ -613,4 +857,175 @@ class BusinessDetails:
         return {"business_id" : business_id,
                 "business_details" : self.get_all_biz_details(),
                 "covid19_updates" : covid19_updates,
-                "amenities" : amenities}
\ No newline at end of file
+                "amenities" : amenities}
+
+# Parse functions below run in worker processes of `ParseExecutor`, so they 
+# take raw response bytes and return only plain data (which can be pickled)
+
+def parse_business_homepage(body: bytes, encoding: str = "utf-8") -> dict:
+    """Parse homepage of a business, see 
+    `BusinessDetails.get_all_updates_and_details`"""
+    return BusinessDetails(body, encoding).get_all_updates_and_details()
+
+
+def _get_sub_menu_name(sub_menu_name_list: List[str]) -> str:
+    if sub_menu_name_list:
+        return "-".join((sub_menu_name_list[0]
+                                .lower()
+                                .replace("/", "-")
+                                .split()))
+    else:
+        return "menu"
+
+
+def menu_page_fingerprint(tree) -> Union[str, None]:
+    """Hash of the menu part (menu sections and sub menus list) of a menu page
+    parsed with lxml, rest of the page (scripts, ads, ...) changes on every 
+    request. None if page has no menu."""
+    menu_sections = _XPATH_MENU_SECTIONS(tree)
+    if not menu_sections:
+        return None
+
+    content_hash = sha1()
+    for element in menu_sections + _XPATH_SUB_MENU_LISTS(tree):
+        for text in _XPATH_VISIBLE_TEXT_AND_LINKS(element):
+            content_hash.update(text.strip().encode("utf-8"))
+            content_hash.update(b"\0")
+
+    return content_hash.hexdigest()
+
+
+def menu_page_fingerprint_bs4(soup) -> Union[str, None]:
+    """Same as `menu_page_fingerprint`, for a page parsed with BeautifulSoup
+
+    NOTE: both parsers can build slightly different trees (like, whitespace
+    between tags), so fingerprints of a page may not be the same with both,
+    changing `MENU_PARSER` can make menus refresh parse every menu once.
+    """
+    menu_sections = soup.select('.menu-sections')
+    if not menu_sections:
+        return None
+
+    content_hash = sha1()
+    for element in menu_sections + soup.select('.sub-menus'):
+        for node in element.descendants:
+            if isinstance(node, Tag):
+                if (node.name == "a") and node.get("href"):
+                    text = node["href"]
+                else:
+                    continue
+            elif (type(node) is not NavigableString) \
+                    or node.find_parent(["script", "style"]) is not None:
+                # comments, doctypes, ...
+                continue
+            else:
+                text = str(node)
+
+            content_hash.update(text.strip().encode("utf-8"))
+            content_hash.update(b"\0")
+
+    return content_hash.hexdigest()
+
+
+def parse_menu_page(body: Union[bytes, str], 
+                    encoding: str = "utf-8",
+                    parser: str = "bs4", 
+                    known_hash: Union[str, None] = None) -> dict:
+    """Parse menu page of a business
+
+    Page is decoded and parsed once, with `parser`, the fingerprint is 
+    computed from the same tree.
+
+    Parameters
+    ----------
+    body : bytes or str
+        Menu page, raw response body (decoded here, so that it is done in 
+        the worker process, see `ParseExecutor`)
+    encoding : str
+        Encoding of the response
+    parser : str
+        "bs4" - BeautifulSoup with `get_menu` or "lxml" - `get_menu_lxml` 
+    known_hash : str or None
+        Fingerprint (`menu_page_fingerprint`) of the page from the last
+        scrape, menu is not parsed if page has the same fingerprint
+
+    Returns
+    -------
+    dict
+        {"menu" : menu dict (see `get_menu`), None if page has no menu ie. 
+                  menu url is outdated (or page is unchanged),
+         "sub_menu_name" : name of the menu shown on the page,
+         "sub_menu_urls" : urls of other sub menus of the business,
+         "content_hash" : fingerprint of the page,
+         "unchanged" : True if fingerprint is same as `known_hash`}
+    """
+    html = body.decode(encoding, errors="replace") if isinstance(body, bytes) else body
+
+    if parser == "lxml":
+        try:
+            tree = lxml_fromstring(html)
+        except:
+            return {"menu" : None, "sub_menu_name" : None, "sub_menu_urls" : [],
+                    "content_hash" : None, "unchanged" : False}
+
+        content_hash = menu_page_fingerprint(tree)
+        get_sub_menu_urls = _get_sub_menu_urls_lxml
+        parse_page = _parse_menu_page_lxml
+    else:
+        tree = BeautifulSoup(html, "html.parser")
+        content_hash = menu_page_fingerprint_bs4(tree)
+        get_sub_menu_urls = _get_sub_menu_urls_bs4
+        parse_page = _parse_menu_page_bs4
+
+    if (known_hash is not None) and (content_hash == known_hash):
+        return {"menu" : None, 
+                "sub_menu_name" : None, 
+                "sub_menu_urls" : get_sub_menu_urls(tree),
+                "content_hash" : content_hash, 
+                "unchanged" : True}
+
+    return {**parse_page(tree), "content_hash" : content_hash, "unchanged" : False}
+
+
+def _get_sub_menu_urls_bs4(soup) -> List[str]:
+    return [i['href'] 
+            for i 
+            in soup.select('.sub-menus li a')
+            if i.get('href')]
+
+
+def _get_sub_menu_urls_lxml(tree) -> List[str]:
+    return [str(i) for i in _XPATH_SUB_MENU_URLS(tree)]
+
+
+def _parse_menu_page_bs4(soup) -> dict:
+    try:
+        scraped_menu = get_menu(soup)
+    except:
+        return {"menu" : None, "sub_menu_name" : None, "sub_menu_urls" : []}
+
+    try:
+        sub_menu_name = _get_sub_menu_name([i.text.strip().lower() 
+                                            for i 
+                                            in soup.select('.sub-menus li')])
+    except:
+        sub_menu_name = "menu"
+
+    return {"menu" : scraped_menu, 
+            "sub_menu_name" : sub_menu_name, 
+            "sub_menu_urls" : _get_sub_menu_urls_bs4(soup)}
+
+
+def _parse_menu_page_lxml(tree) -> dict:
+    try:
+        scraped_menu = get_menu_lxml(tree)
+    except:
+        return {"menu" : None, "sub_menu_name" : None, "sub_menu_urls" : []}
+
+    sub_menu_name = _get_sub_menu_name([i.text_content().strip().lower() 
+                                        for i 
+                                        in _XPATH_SUB_MENUS(tree)])
+
+    return {"menu" : scraped_menu, 
+            "sub_menu_name" : sub_menu_name, 
+            "sub_menu_urls" : _get_sub_menu_urls_lxml(tree)}